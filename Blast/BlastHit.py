@@ -20,6 +20,7 @@ class BlastHit(object):
     * s_end : Hit end position of the subject
     * evalue : E value of the alignement
     * bscore : Bit score of the alignement
+    * q_file : Path of the query file of the hit if known
     A class list is used to track all instances generated.
     """
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
@@ -71,7 +72,7 @@ class BlastHit(object):
         @param ref Name of a reference sequence in the subject database
         @return The list of all BlastHit object generated for this reference
         """
-        return [hit for hit in self.Instances if hit.s_id == "ref"]
+        return [hit for hit in self.Instances if hit.s_id == ref]
 
     @ classmethod
     def reset_list (self):
@@ -83,7 +84,7 @@ class BlastHit(object):
 
     #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
 
-    def __init__(self, q_id, s_id, identity, length, mis, gap, q_start, q_end, s_start, s_end, evalue, bscore):
+    def __init__(self, q_id, s_id, identity, length, mis, gap, q_start, q_end, s_start, s_end, evalue, bscore, track=True):
         """
         Create a BlastHit object which is automatically added to the class tracking instance list
         The object with the following parameters are required for object initialisation
@@ -99,9 +100,11 @@ class BlastHit(object):
         @param  s_end   Hit end position of the subject
         @param  evalue  E value of the alignement
         @param  bscore Bit score of the alignement
+        @param  track If False the object is not added to the class tracking instance list and
+        does not take an id from the class counter (streamed hits)
         """
         
-        self.id = self.next_id()
+        self.id = self.next_id() if track else None
         self.q_id = q_id
         self.s_id = s_id
         self.identity = float(identity)
@@ -110,19 +113,20 @@ class BlastHit(object):
         self.gap = int(gap)
         self.evalue = float(evalue)
         self.bscore = float(bscore)
+        self.q_file = None
 
         # Autoadapt start and end so that start is always smaller than end
-        self.q_start = int(q_start) if int(q_start) < int(q_end) else int(q_end)
-        self.q_end = int(q_end) if int(q_start) < int(q_end) else int(q_start)
-        self.s_start = int(s_start) if int(s_start) < int(s_end) else int(s_end)
-        self.s_end = int(s_end) if int(s_start) < int(s_end) else int(s_start)
+        q_start, q_end, s_start, s_end = int(q_start), int(q_end), int(s_start), int(s_end)
+        self.q_start, self.q_end = (q_start, q_end) if q_start < q_end else (q_end, q_start)
+        self.s_start, self.s_end = (s_start, s_end) if s_start < s_end else (s_end, s_start)
 
         # Orientation of the query and subject along the hit. True if positive
-        self.q_orient = int(q_start) < int(q_end)
-        self.s_orient = int(s_start) < int(s_end)
+        self.q_orient = q_start < q_end
+        self.s_orient = s_start < s_end
 
         # Add the instance to the class instance tracking list
-        self.Instances.append(self)
+        if track:
+            self.Instances.append(self)
 
     def __repr__(self):
         msg = "HIT {}".format(self.id)
@@ -1,12 +1,16 @@
 #~~~~~~~GLOBAL IMPORTS~~~~~~~#
 
 # Standard library packages import
-from os import path
+from os import path, remove, fdopen
+from tempfile import mkstemp
+from multiprocessing.pool import ThreadPool
+import gzip
 
 # Local library packages import
-from pyDNA.Utilities import mkdir, import_seq, file_basename, file_name, file_extension, fgunzip
+from pyDNA.Utilities import mkdir, import_seq, file_basename, file_name, file_extension, fgunzip, count_seq
 from BlastnWrapper import Aligner
 from MakeblastdbWrapper import NewDB, ExistingDB
+from MaskIntervals import MaskIntervals
 
 #~~~~~~~MAIN METHODS~~~~~~~#
 
@@ -19,7 +23,13 @@ def align  (query_list,
             db_maker = "makeblastdb",
             db_opt = "",
             db_outdir = "./blast_db/",
-            db_outname = "out"):
+            db_outname = "out",
+            cache_dir = None,
+            cache_size = 0,
+            result_cache = None,
+            num_processes = 1,
+            batch_size = 0,
+            shard_size = 0):
 
     """
     Main function of RefMasker that integrate database creation, blast and homology masking
@@ -36,7 +46,246 @@ def align  (query_list,
     @param db_opt makeblastdb command line options as a string
     @param db_outdir Directory where to store the database files
     @param db_outname Basename of the database files
-    @return A list of BlastHit objects
+    @param cache_dir Facultative IndexCache directory where new databases are stored and reused
+    for identical references and options. db_outdir and db_outname are then ignored
+    @param cache_size Maximal size of the cache in bytes. 0 = no eviction
+    @param result_cache Facultative directory of a ResultCache where blast results are stored and
+    reused for identical queries, database and options. Not used by scheduled alignments
+    @param num_processes Number of blastn processes running concurrently (each one using
+    num_threads threads)
+    @param batch_size Query files containing less records are concatenated in a single blastn
+    run up to this number of records. 0 = no batching
+    @param shard_size Query files containing more records are split in shards of at most this
+    number of records, with the records evenly distributed. 0 = no sharding
+    @return A list of BlastHit objects. The q_file attribute of hits contains the path of the
+    query file they come from. Hits are ordered as the query files in query_list
+    """
+    # Import an existing database or create a new one
+    db = _get_db(subject_db, subject_fasta, db_maker, db_opt, db_outdir, db_outname, cache_dir, cache_size)
+
+    # Initialise a Blastn object
+    blast = Aligner(db, align_opt, aligner, num_threads, result_cache)
+    #~print (repr(blast))
+
+    # Schedule batches and shards of queries in concurrent blastn processes
+    if num_processes > 1 or batch_size or shard_size:
+        return _scheduled_align(blast, query_list, num_processes, batch_size, shard_size)
+
+    # Generate a list of hit containing hits of all sequence in query list in subject
+    hit_list = []
+    # Extend the list of hits for each query in a bigger list.
+    for query in query_list:
+        hits = blast.align(query)
+        for hit in hits:
+            hit.q_file = query
+        hit_list.extend(hits)
+
+    return hit_list
+
+def align_intervals (query_list,
+                     subject_db = None,
+                     subject_fasta = None,
+                     aligner = "blastn",
+                     align_opt = "",
+                     num_threads = 1,
+                     db_maker = "makeblastdb",
+                     db_opt = "",
+                     db_outdir = "./blast_db/",
+                     db_outname = "out",
+                     cache_dir = None,
+                     cache_size = 0,
+                     buffer_size = 10000):
+    """
+    Streaming version of align for homology masking. Blast hits are never stored: the subject
+    intervals of hits are merged on the fly in a MaskIntervals object that can be directly passed
+    to RefMasker.mask. Peak memory thus depends on the number of masked intervals and not on the
+    number of hits.
+    @param query_list List of paths indicating fasta files containing query sequences (can be
+    gzipped). Fasta can contains multiple sequences.
+    @param subject_db Basename of file from a blast database created by "makeblastdb" if available
+    @param subject_fasta Reference fasta file. Required if no ref_index is given (can be gzipped)
+    @param aligner Path ot the blastn executable. Not required if blast+ if added to your path
+    @param blastn_opt Blastn command line options as a string
+    @param db_maker Path ot the makeblastdb executable. Not required if blast+ if added to your path
+    @param db_opt makeblastdb command line options as a string
+    @param db_outdir Directory where to store the database files
+    @param db_outname Basename of the database files
+    @param cache_dir Facultative IndexCache directory where new databases are stored and reused
+    for identical references and options. db_outdir and db_outname are then ignored
+    @param cache_size Maximal size of the cache in bytes. 0 = no eviction
+    @param buffer_size Minimal number of intervals buffered per subject sequence before merging
+    @return A MaskIntervals object
+    """
+    # Import an existing database or create a new one
+    db = _get_db(subject_db, subject_fasta, db_maker, db_opt, db_outdir, db_outname, cache_dir, cache_size)
+
+    # Initialise a Blastn object
+    blast = Aligner(db, align_opt, aligner, num_threads)
+
+    # Add the intervals of hits of all sequence in query list to the same interval set
+    intervals = MaskIntervals(buffer_size)
+    for query in query_list:
+        blast.align_intervals(query, intervals)
+
+    return intervals
+
+#~~~~~~~PRIVATE METHODS~~~~~~~#
+
+# Query names of batched query files. Plain alphanumeric names are reported as they are by
+# blastn, whereas prefixing the original names would change the parsing of gi|... like deflines
+BATCH_ID = "pyDNAquery{}"
+
+def _scheduled_align (blast, query_list, num_processes, batch_size, shard_size):
+    """
+    Group small query files in batches and split large ones in shards, then run the blastn jobs in
+    a pool of threads (each thread waits for its own blastn process)
+    @return A list of BlastHit objects in the order of query_list
+    """
+    jobs, tmp_list = _make_jobs(query_list, batch_size, shard_size)
+    print ("{} query files scheduled in {} blastn jobs".format(len(query_list), len(jobs)))
+
+    pool = ThreadPool(max(1, num_processes))
+    try:
+        results = pool.map(lambda job: _run_job(blast, job), jobs)
+    finally:
+        pool.terminate()
+        for tmp_path in tmp_list:
+            remove(tmp_path)
+
+    # Number the hits of each query file from 0 as in the serial path
+    hit_list = []
+    for hit in (hit for job_hits in results for hit in job_hits):
+        hit.id = hit_list[-1].id+1 if hit_list and hit_list[-1].q_file == hit.q_file else 0
+        hit_list.append(hit)
+
+    return hit_list
+
+def _run_job (blast, job):
+    """
+    Blast a query fasta file and restore the source query file and the original query name of hits
+    @param job Tuple (fasta path, source) where source is the path of the source query file or
+    for batches a list of (source query file path, original query name) indexed by the ordinal
+    of the query in the batch file
+    """
+    fasta_path, source = job
+    hit_list = []
+
+    # Hits are not registered in the BlastHit class list which is not thread safe
+    for hit in blast.iter_align(fasta_path):
+        if isinstance(source, list):
+            hit.q_file, hit.q_id = source[int(hit.q_id[len(BATCH_ID.format("")):])]
+        else:
+            hit.q_file = source
+        hit_list.append(hit)
+
+    return hit_list
+
+def _make_jobs (query_list, batch_size, shard_size):
+    """
+    Create the list of blastn jobs and the temporary fasta files of batches and shards
+    @return A tuple (list of jobs, list of temporary files)
+    """
+    jobs = []
+    tmp_list = []
+    batch = []
+    batch_records = 0
+
+    for query in query_list:
+        n_records = count_seq(query, "fasta")
+
+        # Large file = split in shards with evenly distributed records
+        if shard_size and n_records > shard_size:
+            batch_records = _flush_batch(batch, jobs, tmp_list)
+            n_shards = (n_records + shard_size - 1) // shard_size
+            sizes = [n_records//n_shards + (1 if i < n_records%n_shards else 0) for i in range(n_shards)]
+            for tmp_path in _write_shards(query, sizes):
+                jobs.append((tmp_path, query))
+                tmp_list.append(tmp_path)
+
+        # Small file = add to the current batch
+        elif batch_size and n_records < batch_size:
+            batch.append(query)
+            batch_records += n_records
+            if batch_records >= batch_size:
+                batch_records = _flush_batch(batch, jobs, tmp_list)
+
+        # Else blast the file as it is
+        else:
+            batch_records = _flush_batch(batch, jobs, tmp_list)
+            jobs.append((query, query))
+
+    _flush_batch(batch, jobs, tmp_list)
+    return jobs, tmp_list
+
+def _flush_batch (batch, jobs, tmp_list):
+    """
+    Concatenate the query files of a batch in a temporary file with queries renamed after their
+    ordinal in the batch, add the job and empty the batch. The job maps each ordinal to the source
+    file and the original name (first word of the description line) of the query
+    @return 0, the number of records in the emptied batch
+    """
+    if len(batch) == 1:
+        jobs.append((batch[0], batch[0]))
+    elif batch:
+        fd, tmp_path = mkstemp(suffix=".fa")
+        tmp_list.append(tmp_path)
+        names = []
+        with fdopen(fd, "w") as out:
+            for query in batch:
+                with _open_fasta(query) as fasta:
+                    for line in fasta:
+                        if line[0] == ">":
+                            names.append((query, (line[1:].split() or [""])[0]))
+                            line = ">{}\n".format(BATCH_ID.format(len(names)-1))
+                        out.write(line)
+        jobs.append((tmp_path, names))
+
+    del batch[:]
+    return 0
+
+def _write_shards (query, sizes):
+    """
+    Split a fasta file in temporary files containing the numbers of records given in sizes
+    @return The list of temporary file paths
+    """
+    tmp_list = []
+    out = None
+    shard = -1
+    remaining = 0
+
+    with _open_fasta(query) as fasta:
+        for line in fasta:
+            # Start a new shard when the current one is full
+            if line[0] == ">":
+                if not remaining:
+                    if out:
+                        out.close()
+                    shard += 1
+                    remaining = sizes[shard]
+                    fd, tmp_path = mkstemp(suffix=".fa")
+                    tmp_list.append(tmp_path)
+                    out = fdopen(fd, "w")
+                remaining -= 1
+            if out:
+                out.write(line)
+
+    if out:
+        out.close()
+    return tmp_list
+
+def _open_fasta (fasta_path):
+    """
+    Open an eventually gzipped fasta file
+    """
+    if fasta_path[-2:].lower() == "gz":
+        return gzip.open(fasta_path, "r")
+    else:
+        return open(fasta_path, "r")
+
+def _get_db (subject_db, subject_fasta, db_maker, db_opt, db_outdir, db_outname, cache_dir=None, cache_size=0):
+    """
+    Validate an existing blast database or create a new one from the subject fasta file
+    @return A NewDB or ExistingDB object
     """
     # Try to import an existing database
     try:
@@ -55,20 +304,14 @@ def align  (query_list,
             raise Exception("Invalid or no fasta file provided. Cannot create a database")
 
         print ("Generate a database...")
-        mkdir(db_outdir)
-        db_path = path.join (db_outdir, db_outname)
+        if cache_dir:
+            db_path = None
+        else:
+            mkdir(db_outdir)
+            db_path = path.join (db_outdir, db_outname)
 
-        # Create the new database
-        db = NewDB(ref_path=subject_fasta, db_path=db_path, makeblastdb_opt=db_opt, makeblastdb=db_maker)
+        # Create the new database or reuse a cached one
+        db = NewDB(ref_path=subject_fasta, db_path=db_path, makeblastdb_opt=db_opt, makeblastdb=db_maker,
+            cache_dir=cache_dir, cache_size=cache_size)
 
-    # Initialise a Blastn object
-    blast = Aligner(db, align_opt, aligner, num_threads)
-    #~print (repr(blast))
-
-    # Generate a list of hit containing hits of all sequence in query list in subject
-    hit_list = []
-    # Extend the list of hits for each query in a bigger list.
-    for query in query_list:
-        hit_list.extend(blast.align(query))
-
-    return hit_list
+    return db
@@ -1,14 +1,13 @@
 #~~~~~~~GLOBAL IMPORTS~~~~~~~#
 # Standard library packages import
-import gzip
-from os import close, remove, path
 from multiprocessing import cpu_count
-from time import time
-from tempfile import mkstemp
 
 # Local library packages
-from pyDNA.Utilities import run_command, file_basename, fgunzip
+from pyDNA.Utilities import iter_command, file_basename, gunzip_pipe
 from BlastHit import BlastHit
+from MaskIntervals import MaskIntervals
+from HitTable import HitTable
+from ResultCache import ResultCache
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class Aligner(object):
@@ -26,23 +25,30 @@ class Aligner(object):
         msg += "Blastn path : {}\n".format(self.blastn)
         msg += "Options : {}\n".format(self.blastn_opt)
         msg += repr(self.Blastdb)
+        if self.result_cache:
+            msg += repr(self.result_cache)
         return msg
 
     def __str__(self):
         return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
 
-    def __init__ (self, Blastdb, blastn_opt="", blastn="blastn", num_threads=1):
+    def __init__ (self, Blastdb, blastn_opt="", blastn="blastn", num_threads=1, result_cache=None):
         """
         Initialize the object and index the reference genome if necessary
         @param Blastdb Blast database object NewDB or ExistingDB
         @param blastn_opt Blastn command line options as a string
         @param blastn Path ot the bwa executable. If bwa if already added to your system path
         do not change the default value
+        @param result_cache Facultative ResultCache object or cache directory path. If given, align
+        returns the stored results of a previous identical blast instead of running blastn
         """
         # Creating object variables
         self.blastn = blastn
         self.Blastdb = Blastdb
         self.num_threads = num_threads
+        if isinstance(result_cache, str):
+            result_cache = ResultCache(result_cache)
+        self.result_cache = result_cache
 
         # init an option dict and attribute defaut options
         # if num_threads == 0 use all cores on the node
@@ -59,40 +65,146 @@ class Aligner(object):
         @param  query Path to a fasta file containing the query sequences
         @param  evalue  Cutoff used in blast to select valid hits
         @return A list of BlastHit objects if at least one hit was found
-        @exception (SystemError,OSerror) May be returned by run_command in case of invalid command line
+        @exception (SystemError,OSerror) May be returned by iter_command in case of invalid command line
         """
+        # Get the hits from the result cache, running blastn if needed
+        if self.result_cache:
+            # Hits are numbered and the class counter reset as in _align
+            hits_list = list(self._cached_table(query))
+            for hit in hits_list:
+                hit.id = BlastHit.next_id()
+            BlastHit.reset_list()
+            return hits_list
+
         # Build the command line string
         query_name = file_basename(query)
+        blastn_opt, stdin_file, feeder = self._query_input(query)
 
-        # If the fasta file is compressed = extract the file in a temporary file
-        if query[-2:].lower() == "gz":
-            print ("Extracting the compressed fasta in a temporary file")
-            fd, tmp_path = mkstemp()
-            fgunzip (in_path=query, out_path=tmp_path)
-            blastn_opt = self.blastn_opt + " -query {}".format(tmp_path)
-            hits_list = self._align(query_name, blastn_opt)
-            close(fd)
-            remove(tmp_path)
-            return hits_list
-        # Else just proceed by using the fasta reference
-        else:
-            blastn_opt = self.blastn_opt + " -query {}".format(query)
-            return self._align(query_name, blastn_opt)
+        hits_list = self._align(query_name, blastn_opt, stdin_file)
+        self._join_feeder(feeder)
+        return hits_list
 
-    def _align (self, query_name, blastn_opt):
+    def align_intervals (self, query, intervals=None):
+        """
+        Blast query against a subject database and add the subject interval of each hit to a
+        MaskIntervals object. Blastn output is parsed line by line as it is produced and no
+        BlastHit objects are created, so that memory use does not depend on the number of hits
+        @param  query Path to a fasta file containing the query sequences
+        @param  intervals MaskIntervals object to update. If None a new one is created
+        @return The updated MaskIntervals object
+        @exception (SystemError,OSerror) May be returned by iter_command in case of invalid command line
+        """
+        if intervals is None:
+            intervals = MaskIntervals()
+        query_name = file_basename(query)
+        blastn_opt, stdin_file, feeder = self._query_input(query)
+
+        self._align_intervals(query_name, blastn_opt, intervals, stdin_file)
+        self._join_feeder(feeder)
+        return intervals
+
+    def _align_intervals (self, query_name, blastn_opt, intervals, stdin_file=None):
 
         print ("Blast {} against {} database with blastn".format(query_name, file_basename (self.Blastdb.db_path))),
 
         # Build the command line string
         cmd = "{} {}".format(self.blastn, blastn_opt)
 
-        # Run the command line without stdin and asking only stdout
-        blast_lines = run_command(cmd, stdin=None, ret_stderr=False, ret_stdout=True).splitlines()
-
-        for line in blast_lines:
-            # Parse each result lines and create a BlastHit object
+        n_hits = 0
+        for line in iter_command(cmd, stdin_file):
+            # Subject name, start and end are the 2nd, 9th and 10th fields. Start and end are
+            # swapped for hits on the reverse strand as in BlastHit
             h = line.split()
-            BlastHit(h[0], h[1] , h[2], h[3], h[4], h[5], h[6], h[7], h[8], h[9], h[10], h[11])
+            s_start, s_end = int(h[8]), int(h[9])
+            if s_start < s_end:
+                intervals.add(h[1], s_start, s_end)
+            else:
+                intervals.add(h[1], s_end, s_start)
+            n_hits += 1
+
+        print ("\t{} hits found".format(n_hits))
+
+    def align_table (self, query, table=None):
+        """
+        Blast query against a subject database and add the hits to a columnar HitTable as blastn
+        results are produced. No BlastHit object is created
+        @param  query Path to a fasta file containing the query sequences
+        @param  table HitTable object to update. If None a new one is created
+        @return The updated HitTable object
+        @exception (SystemError,OSerror) May be returned by iter_command in case of invalid command line
+        """
+        if table is None:
+            table = HitTable()
+        query_name = file_basename(query)
+        blastn_opt, stdin_file, feeder = self._query_input(query)
+
+        self._align_table(query_name, blastn_opt, table, stdin_file)
+        self._join_feeder(feeder)
+        return table
+
+    def iter_align (self, query):
+        """
+        Generator version of align. Blastn results are parsed as they are produced and BlastHit
+        objects are yielded one by one without being stored in the BlastHit class list, so that
+        memory use does not depend on the number of hits.
+        @param  query Path to a fasta file containing the query sequences
+        @return A generator of BlastHit objects
+        @exception (SystemError,OSerror) May be returned by iter_command in case of invalid command line
+        """
+        query_name = file_basename(query)
+        blastn_opt, stdin_file, feeder = self._query_input(query)
+
+        for hit in self._iter_hits(query_name, blastn_opt, False, stdin_file):
+            yield hit
+        self._join_feeder(feeder)
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _cached_table (self, query):
+        """
+        @return The HitTable of query from the result cache. In case of cache miss, blastn is run
+        and the results are stored in the cache
+        """
+        key = self.result_cache.key(query, self.Blastdb.db_path, self.blastn_opt)
+        table = self.result_cache.get(key)
+
+        if table is None:
+            table = self.align_table(query)
+            self.result_cache.put(key, table)
+        else:
+            print ("Blast {} against {} database with blastn\t{} hits found in the result cache".format(
+                file_basename(query), file_basename(self.Blastdb.db_path), len(table)))
+
+        return table
+
+    def _query_input (self, query):
+        """
+        Build the blastn options for a query file. A gzipped query is decompressed by a background
+        thread in a pipe connected to blastn standard input instead of being extracted in a
+        temporary file
+        @return A tuple (blastn options, stdin file or None, feeder thread or None)
+        """
+        if query[-2:].lower() == "gz":
+            print ("Streaming the compressed fasta to blastn")
+            stdin_file, feeder = gunzip_pipe(query)
+            return self.blastn_opt + " -query -", stdin_file, feeder
+
+        return self.blastn_opt + " -query {}".format(query), None, None
+
+    def _join_feeder (self, feeder):
+        """
+        Wait for the end of the decompression of a streamed query and raise its errors
+        """
+        if feeder:
+            feeder.join()
+            if feeder.error:
+                raise Exception ("Error during the decompression of the query\n{}".format(feeder.error))
+
+    def _align (self, query_name, blastn_opt, stdin_file=None):
+
+        # Parse each result lines as they are produced and create tracked BlastHit objects
+        for hit in self._iter_hits(query_name, blastn_opt, True, stdin_file):
+            pass
 
         # Sumarize the hit count in the different references
         print ("\t{} hits found".format(BlastHit.count_total()))
@@ -101,3 +213,26 @@ class Aligner(object):
         hits_list = BlastHit.get()
         BlastHit.reset_list()
         return hits_list
+
+    def _align_table (self, query_name, blastn_opt, table, stdin_file=None):
+
+        print ("Blast {} against {} database with blastn".format(query_name, file_basename (self.Blastdb.db_path))),
+
+        # Build the command line string
+        cmd = "{} {}".format(self.blastn, blastn_opt)
+
+        n_hits = len(table)
+        table.add_lines(iter_command(cmd, stdin_file))
+        print ("\t{} hits found".format(len(table)-n_hits))
+
+    def _iter_hits (self, query_name, blastn_opt, track, stdin_file=None):
+
+        print ("Blast {} against {} database with blastn".format(query_name, file_basename (self.Blastdb.db_path))),
+
+        # Build the command line string
+        cmd = "{} {}".format(self.blastn, blastn_opt)
+
+        # Run the command line and parse the standard output lines as they are produced
+        for line in iter_command(cmd, stdin_file):
+            h = line.split()
+            yield BlastHit(h[0], h[1] , h[2], h[3], h[4], h[5], h[6], h[7], h[8], h[9], h[10], h[11], track=track)
@@ -0,0 +1,153 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Standard library packages import
+from bisect import bisect_right
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class HitIndex(object):
+    """
+    @class  HitIndex
+    @brief  Per subject sequence index of hits for fast overlap queries. Each subject has a nested
+    containment list (NCList): hits contained in another hit are stored in the sublist of the
+    containing hit, so that starts and ends are both sorted in each list and overlapping hits
+    can be found by binary search. The index is built in O(n log n) and a query costs
+    O(log n + number of overlapping hits). Hit intervals are taken as [s_start, s_end) as in
+    RefMasker.mask.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "HIT INDEX\n"
+        for s_id in sorted(self.lists):
+            merged = self.merge(s_id)
+            msg += "  {}\tHits : {}\tMerged intervals : {}\tCovered bases : {}\n".format(
+                s_id, self.counts[s_id], len(merged), sum(end-start for start, end in merged))
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __contains__(self, s_id):
+        return s_id in self.lists
+
+    def __init__ (self, hit_list):
+        """
+        Build the index from a list of hits
+        @param hit_list Iterable of hit objects with at least s_id, s_start and s_end fields
+        (BlastHit, HomologyHit or a HitTable). Empty intervals are skipped
+        """
+        intervals = {}
+        for hit in hit_list:
+            if hit.s_start < hit.s_end:
+                intervals.setdefault(hit.s_id, []).append((hit.s_start, hit.s_end, hit))
+
+        self.lists = {}
+        self.counts = {}
+        for s_id, interval_list in intervals.items():
+            self.lists[s_id] = self._build(interval_list)
+            self.counts[s_id] = len(interval_list)
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def overlap (self, s_id, start, end):
+        """
+        @return The list of hits of the subject s_id overlapping the interval [start, end)
+        """
+        if s_id not in self.lists or start >= end:
+            return []
+
+        levels = self.lists[s_id]
+        hits = []
+        to_scan = [0]
+        while to_scan:
+            starts, ends, items, children = levels[to_scan.pop()]
+            # First interval of the list ending after start
+            i = bisect_right(ends, start)
+            while i < len(starts) and starts[i] < end:
+                hits.append(items[i])
+                if children[i] is not None:
+                    to_scan.append(children[i])
+                i += 1
+
+        return hits
+
+    def coverage (self, s_id, start, end):
+        """
+        @return The fraction of the interval [start, end) of s_id covered by at least one hit
+        """
+        if start >= end:
+            return 0.0
+
+        covered = 0
+        last = start
+        for hit_start, hit_end in sorted(
+            (max(hit.s_start, start), min(hit.s_end, end)) for hit in self.overlap(s_id, start, end)):
+            if hit_end > last:
+                covered += hit_end - max(hit_start, last)
+                last = hit_end
+
+        return float(covered)/(end-start)
+
+    def merge (self, s_id):
+        """
+        @return A sorted list of non overlapping [start, end] intervals covered by the hits of s_id
+        """
+        if s_id not in self.lists:
+            return []
+
+        # Hits of the top level list contain all the others and are sorted by start and end
+        starts, ends = self.lists[s_id][0][:2]
+        merged = []
+        for start, end in zip(starts, ends):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+
+        return merged
+
+    def interval_dict (self):
+        """
+        @return A dictionnary of merged intervals per subject sequence
+        """
+        return {s_id: self.merge(s_id) for s_id in self.lists}
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _build (self, interval_list):
+        """
+        Build a NCList as a list of levels. Each level is a tuple of 4 lists: starts, ends, hits and
+        index of the level of contained hits (or None). Level 0 is the top level list
+        """
+        # Sort by start and by decreasing end so that containing intervals come first
+        interval_list.sort(key=lambda interval: (interval[0], -interval[1]))
+
+        levels = [([], [], [], [])]
+        stack = [] # (end, level, position) of the chain of intervals containing the current one
+        for start, end, hit in interval_list:
+            while stack and stack[-1][0] < end:
+                stack.pop()
+
+            if stack:
+                parent_end, parent_level, parent_pos = stack[-1]
+                children = levels[parent_level][3]
+                if children[parent_pos] is None:
+                    children[parent_pos] = len(levels)
+                    levels.append(([], [], [], []))
+                level = children[parent_pos]
+            else:
+                level = 0
+
+            starts, ends, items, children = levels[level]
+            starts.append(start)
+            ends.append(end)
+            items.append(hit)
+            children.append(None)
+            stack.append((end, level, len(starts)-1))
+
+        return levels
@@ -0,0 +1,201 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Third party package import
+import numpy as np
+
+# Local library packages
+from BlastHit import BlastHit
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class HitTable(object):
+    """
+    @class  HitTable
+    @brief  Columnar storage of blast hits in a NumPy structured array. Query and subject names
+    are interned: the array contains indexes in the q_names and s_names lists. Start and end
+    positions are ordered as in BlastHit and the orientation is stored in q_orient and s_orient.
+    The table can be filtered and summarized with vectorized operations, saved and loaded in a
+    binary file. Iterating or indexing the table returns BlastHit objects (not tracked in the
+    BlastHit class list) for compatibility with the per object API.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS FIELDS~~~~~~~#
+
+    dtype = np.dtype([
+        ("q_id", np.int32), ("s_id", np.int32), ("identity", np.float64), ("length", np.int32),
+        ("mis", np.int32), ("gap", np.int32), ("q_start", np.int64), ("q_end", np.int64),
+        ("s_start", np.int64), ("s_end", np.int64), ("q_orient", np.bool_), ("s_orient", np.bool_),
+        ("evalue", np.float64), ("bscore", np.float64)])
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "HIT TABLE\n"
+        msg += "  Hits : {}\tQueries : {}\tSubjects : {}\n".format(
+            len(self), len(self.q_names), len(self.s_names))
+        for s_id, (count, length) in sorted(self.stat_per_ref().items()):
+            msg += "  {}\tHits : {}\tCumulated length : {}\n".format(s_id, count, length)
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __len__(self):
+        return self.n_hits
+
+    def __iter__(self):
+        for i in xrange(self.n_hits):
+            yield self[i]
+
+    def __getitem__(self, i):
+        """
+        @return A BlastHit view of the ith hit
+        """
+        if i < 0:
+            i += self.n_hits
+        if not 0 <= i < self.n_hits:
+            raise IndexError ("HitTable index out of range")
+
+        h = self.array[i]
+        q_start, q_end = (h["q_start"], h["q_end"]) if h["q_orient"] else (h["q_end"], h["q_start"])
+        s_start, s_end = (h["s_start"], h["s_end"]) if h["s_orient"] else (h["s_end"], h["s_start"])
+        return BlastHit(self.q_names[h["q_id"]], self.s_names[h["s_id"]], h["identity"],
+            h["length"], h["mis"], h["gap"], q_start, q_end, s_start, s_end, h["evalue"],
+            h["bscore"], track=False)
+
+    def __init__ (self, q_names=None, s_names=None, array=None):
+        """
+        Create an empty table or a table from existing names lists and structured array
+        @param q_names List of query names indexed by the q_id column
+        @param s_names List of subject names indexed by the s_id column
+        @param array Structured array of HitTable.dtype
+        """
+        self.q_names = list(q_names) if q_names is not None else []
+        self.s_names = list(s_names) if s_names is not None else []
+        self._q_index = {name: i for i, name in enumerate(self.q_names)}
+        self._s_index = {name: i for i, name in enumerate(self.s_names)}
+
+        if array is None:
+            self._data = np.zeros(1024, dtype=self.dtype)
+            self.n_hits = 0
+        else:
+            self._data = np.array(array, dtype=self.dtype)
+            self.n_hits = len(self._data)
+
+    #~~~~~~~PROPERTIES~~~~~~~#
+
+    @property
+    def array(self):
+        """
+        Structured array of the hits (view without the unused preallocated rows)
+        """
+        return self._data[:self.n_hits]
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def add_line (self, line):
+        """
+        Parse a line of blastn tabular output (outfmt 6) and add the hit to the table
+        """
+        h = line.split()
+        q_start, q_end, s_start, s_end = int(h[6]), int(h[7]), int(h[8]), int(h[9])
+
+        # Double the capacity of the array if full (tables built from an empty array have none)
+        if self.n_hits == len(self._data):
+            self._data = np.resize(self._data, max(1024, 2*len(self._data)))
+
+        self._data[self.n_hits] = (
+            self._intern(h[0], self.q_names, self._q_index),
+            self._intern(h[1], self.s_names, self._s_index),
+            float(h[2]), int(h[3]), int(h[4]), int(h[5]),
+            min(q_start, q_end), max(q_start, q_end), min(s_start, s_end), max(s_start, s_end),
+            q_start < q_end, s_start < s_end, float(h[10]), float(h[11]))
+        self.n_hits += 1
+
+    def add_lines (self, lines):
+        """
+        Add all hits of an iterable of blastn tabular output lines
+        @return The table itself
+        """
+        for line in lines:
+            self.add_line(line)
+        return self
+
+    def filter (self, max_evalue=None, min_identity=None, min_length=None):
+        """
+        @param max_evalue Maximal E value of hits to keep
+        @param min_identity Minimal % of identity of hits to keep
+        @param min_length Minimal length of hits to keep
+        @return A new HitTable containing only the hits passing all the filters
+        """
+        a = self.array
+        mask = np.ones(len(a), dtype=np.bool_)
+        if max_evalue is not None:
+            mask &= a["evalue"] <= max_evalue
+        if min_identity is not None:
+            mask &= a["identity"] >= min_identity
+        if min_length is not None:
+            mask &= a["length"] >= min_length
+        return HitTable(self.q_names, self.s_names, a[mask])
+
+    def get_ref (self, ref):
+        """
+        @param ref Name of a reference sequence in the subject database
+        @return A new HitTable containing only the hits of this reference
+        """
+        a = self.array
+        if ref not in self._s_index:
+            return HitTable(self.q_names, self.s_names, a[:0])
+        return HitTable(self.q_names, self.s_names, a[a["s_id"] == self._s_index[ref]])
+
+    def stat_per_ref (self):
+        """
+        @return Number of hits and cumulated length of hits per subject sequence
+        """
+        a = self.array
+        count = np.bincount(a["s_id"], minlength=len(self.s_names))
+        length = np.bincount(a["s_id"], weights=a["length"], minlength=len(self.s_names))
+        return {name: [int(count[i]), int(length[i])] for i, name in enumerate(self.s_names) if count[i]}
+
+    def interval_dict (self):
+        """
+        @return A dictionnary of list of (s_start, s_end) intervals per subject sequence
+        """
+        a = self.array
+        order = np.argsort(a["s_id"], kind="mergesort")
+        s_id, s_start, s_end = a["s_id"][order], a["s_start"][order], a["s_end"][order]
+        bounds = np.flatnonzero(np.diff(s_id))+1
+        d = {}
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(a)]):
+            if start < end:
+                d[self.s_names[s_id[start]]] = zip(s_start[start:end].tolist(), s_end[start:end].tolist())
+        return d
+
+    def save (self, path):
+        """
+        Save the table in a binary numpy .npz file
+        @param path Path of the file. The .npz extension is added by numpy if absent
+        """
+        np.savez(path, hits=self.array,
+            q_names=np.array(self.q_names, dtype=np.str_), s_names=np.array(self.s_names, dtype=np.str_))
+
+    @ classmethod
+    def load (self, path):
+        """
+        @param path Path of a file created by HitTable.save
+        @return A HitTable object
+        """
+        with np.load(path) as f:
+            return self(f["q_names"].tolist(), f["s_names"].tolist(), f["hits"])
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _intern (self, name, names, index):
+        """
+        Return the index of name in the list of names, adding it if needed
+        """
+        i = index.get(name)
+        if i is None:
+            i = index[name] = len(names)
+            names.append(name)
+        return i
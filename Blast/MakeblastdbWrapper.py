@@ -1,12 +1,11 @@
 #~~~~~~~GLOBAL IMPORTS~~~~~~~#
 # Standard library packages import
-import gzip
-from os import close, remove, path
+from os import remove, path
 from time import time
-from tempfile import mkstemp
 
 # Local library packages
-from pyDNA.Utilities import run_command, file_basename, fgunzip
+from pyDNA.Utilities import run_command, file_basename, gunzip_pipe
+from pyDNA.IndexCache import IndexCache
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class NewDB(object):
@@ -29,35 +28,59 @@ class NewDB(object):
     def __str__(self):
         return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
 
-    def __init__ (self, ref_path, db_path="./out", makeblastdb_opt="", makeblastdb="makeblastdb"):
+    def __init__ (self, ref_path, db_path="./out", makeblastdb_opt="", makeblastdb="makeblastdb",
+        cache_dir=None, cache_size=0):
         """
         Create a blastdb from a reference fastq file
         @param ref_path Path of the fasta file containing the reference sequence. Can be gzipped
-        but in this case the compressed file will be extracted in a temporary file
+        in which case the file is decompressed in a pipe connected to makeblastdb standard input
         @param db_path Outname for the blast db files basename.
         @param makeblastdb_opt makeblastdb command line options as a string
         @param makeblastdb Path ot the makeblastdb executable. If blast+ if already added to your
         system path do not change the default value
+        @param cache_dir Facultative IndexCache directory. If given, a database previously built from
+        the same reference content with the same options is reused, else the database is built in
+        the cache. db_path is then ignored and points to the database files in the cache
+        @param cache_size Maximal size of the cache in bytes. 0 = no eviction
         """
         # Creating object variables
         self.makeblastdb = makeblastdb
-        self.db_path = db_path
         self.db_name = file_basename(ref_path)
 
+        if cache_dir:
+            cache = IndexCache(cache_dir, cache_size)
+            key = cache.fingerprint([ref_path], "makeblastdb", makeblastdb_opt)
+            self.db_path = cache.get(key, lambda db_path: self._build(ref_path, db_path, makeblastdb_opt))
+            self.makeblastdb_opt = "{} -out {} -dbtype {} -input_type {} ".format (
+                makeblastdb_opt, self.db_path, "nucl", "fasta")
+        else:
+            self._build(ref_path, db_path, makeblastdb_opt)
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _build(self, ref_path, db_path, makeblastdb_opt):
+        """
+        Build the command line options and create the database in db_path
+        """
+        self.db_path = db_path
+
         # init an option dict and attribute defaut options
         self.makeblastdb_opt = "{} -out {} -dbtype {} -input_type {} ".format (
             makeblastdb_opt, self.db_path, "nucl", "fasta")
 
         try:
-            # If the fasta file is compressed = extract the file in a tempory file
+            # If the fasta file is compressed = stream the decompressed file to makeblastdb stdin
             if ref_path[-2:].lower() == "gz":
-                print ("Extracting the compressed fasta in a temporary file")
-                fd, tmp_path = mkstemp()
-                fgunzip (in_path=ref_path, out_path=tmp_path)
-                self.makeblastdb_opt += "-in {}".format(tmp_path)
-                self._make_db()
-                close(fd)
-                remove(tmp_path)
+                print ("Streaming the compressed fasta to makeblastdb")
+                self.makeblastdb_opt += "-in -"
+                # Without title the database would be named after the standard input
+                if "-title" not in makeblastdb_opt:
+                    self.makeblastdb_opt += " -title {}".format(self.db_name)
+                stdin_file, feeder = gunzip_pipe(ref_path)
+                self._make_db(stdin_file)
+                feeder.join()
+                if feeder.error:
+                    raise Exception ("Error during the decompression of the reference\n{}\n".format(feeder.error))
 
             # Else just proceed by using the fasta reference
             else:
@@ -68,18 +91,17 @@ class NewDB(object):
             self._remove_db_files()
             raise Exception (E.message+"Impossible to generate a valid database from the reference sequence")
 
-    #~~~~~~~PRIVATE METHODS~~~~~~~#
-
-    def _make_db(self):
+    def _make_db(self, stdin_file=None):
         """
         Create a blastn database from ref_path using makeblastdb
+        @param stdin_file Facultative file object connected to makeblastdb standard input
         """
         # Build the command line
         cmd = "{} {}".format(self.makeblastdb, self.makeblastdb_opt)
 
-        # Run the command line without stdin and asking both stdout and stderr
+        # Run the command line asking both stdout and stderr
         start_time = time()
-        stdout, stderr = run_command(cmd, stdin=None, ret_stderr=True, ret_stdout=True)
+        stdout, stderr = run_command(cmd, stdin=None, ret_stderr=True, ret_stdout=True, stdin_file=stdin_file)
 
         # Verify the output
         if not stdout:
@@ -0,0 +1,85 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Local library packages
+from pyDNA.Utilities import merge_intervals
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class MaskIntervals(object):
+    """
+    @class  MaskIntervals
+    @brief  Per subject sequence sets of half-open intervals to be masked. Intervals can be added
+    one by one while parsing hits and are regularly merged, so that the memory used depends on
+    the number of distinct masked intervals rather than on the number of hits added. An instance
+    can be passed to RefMasker.mask instead of a list of hits.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "MASK INTERVALS\n"
+        msg += "  Intervals added : {}\n".format(self.n_added)
+        for s_id, intervals in sorted(self.get_dict().items()):
+            msg += "  {}\tMerged intervals : {}\tMasked bases : {}\n".format(
+                s_id, len(intervals), sum(end-start for start, end in intervals))
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __len__(self):
+        return len(self.merged)
+
+    def __contains__(self, s_id):
+        return s_id in self.merged
+
+    def __init__ (self, buffer_size=10000):
+        """
+        @param buffer_size Minimal number of intervals buffered per subject sequence before being
+        merged. The buffer grows with the number of merged intervals to keep merging cheap
+        """
+        self.buffer_size = buffer_size
+        self.n_added = 0
+
+        # Dict of merged intervals and dict of intervals added since the last merging
+        self.merged = {}
+        self.pending = {}
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def add (self, s_id, start, end):
+        """
+        Add a half-open interval [start, end) for the subject sequence s_id
+        """
+        self.n_added += 1
+        if s_id not in self.merged:
+            self.merged[s_id] = []
+            self.pending[s_id] = []
+
+        pending = self.pending[s_id]
+        pending.append((start, end))
+        if len(pending) >= max(self.buffer_size, len(self.merged[s_id])):
+            self._compact(s_id)
+
+    def get (self, s_id):
+        """
+        @return A sorted list of non overlapping [start, end] intervals for the subject s_id
+        """
+        if self.pending.get(s_id):
+            self._compact(s_id)
+        return self.merged.get(s_id, [])
+
+    def get_dict (self):
+        """
+        @return A dictionnary of sorted lists of non overlapping [start, end] intervals per subject
+        """
+        return {s_id: self.get(s_id) for s_id in self.merged}
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _compact (self, s_id):
+        """
+        Merge the buffered intervals of s_id with the intervals already merged
+        """
+        self.merged[s_id] = merge_intervals(self.merged[s_id] + self.pending[s_id])
+        self.pending[s_id] = []
@@ -0,0 +1,119 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Standard library packages import
+import os
+from os import path
+from glob import glob
+from hashlib import sha1
+from tempfile import mkstemp
+
+# Local library packages
+from pyDNA.Utilities import mkdir
+from HitTable import HitTable
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class ResultCache(object):
+    """
+    @class  ResultCache
+    @brief  Persistent cache of blastn results. Results are stored as HitTable binary files named
+    after a sha1 key computed from the query file content, a fingerprint of the database files
+    and the normalized blastn options. The database fingerprint is based on the name, size and
+    modification time of the database files, so that rebuilding the database automatically
+    invalidates the results obtained with the previous version. Options that do not change the
+    results (number of threads, database path) are ignored.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS FIELDS~~~~~~~#
+
+    # blastn options and their value excluded from the key
+    ignored_opt = ["-num_threads", "-db", "-query", "-out"]
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "BLAST RESULT CACHE\n"
+        msg += "  Cache directory : {}\n".format(self.cache_dir)
+        msg += "  Hits : {}\tMisses : {}\n".format(self.hits, self.misses)
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __init__ (self, cache_dir):
+        """
+        @param cache_dir Directory where to store the cached results. Created if needed
+        """
+        self.cache_dir = mkdir(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def key (self, query, db_path, blastn_opt):
+        """
+        @param query Path to the query fasta file
+        @param db_path Basename of the blast database files
+        @param blastn_opt blastn command line options as a string
+        @return A sha1 hexadecimal digest identifying the result
+        """
+        h = sha1()
+        with open(query, "rb") as f:
+            for block in iter(lambda: f.read(1048576), ""):
+                h.update(block)
+
+        h.update("\n{}\n".format(self._db_fingerprint(db_path)))
+        h.update(self._normalize_opt(blastn_opt))
+        return h.hexdigest()
+
+    def get (self, key):
+        """
+        @return The cached HitTable of key or None if not in the cache
+        """
+        result_path = self._result_path(key)
+        if not path.isfile(result_path):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return HitTable.load(result_path)
+
+    def put (self, key, table):
+        """
+        Store a HitTable in the cache. The file is written under a temporary name and renamed so
+        that concurrent readers never see a partial result
+        """
+        fd, tmp_path = mkstemp(suffix=".npz", dir=self.cache_dir)
+        os.close(fd)
+        try:
+            table.save(tmp_path)
+            os.rename(tmp_path, self._result_path(key))
+        except:
+            os.remove(tmp_path)
+            raise
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _result_path (self, key):
+        return path.join(self.cache_dir, key+".npz")
+
+    def _db_fingerprint (self, db_path):
+        """
+        @return A string describing the name, size and modification time of the database files
+        """
+        files = sorted(f for f in glob(db_path+".*") if path.isfile(f))
+        return ";".join("{}:{}:{}".format(
+            path.basename(f), path.getsize(f), path.getmtime(f)) for f in files)
+
+    def _normalize_opt (self, blastn_opt):
+        """
+        @return The options sorted by flag, without the options ignored in the key
+        """
+        opt_list = []
+        for token in blastn_opt.split():
+            # Negative numbers are values (-penalty -3)
+            if (token.startswith("-") and not token.lstrip("-").replace(".", "").isdigit()) or not opt_list:
+                opt_list.append([token])
+            else:
+                opt_list[-1].append(token)
+        return " ".join(sorted(" ".join(opt) for opt in opt_list if opt[0] not in self.ignored_opt))
@@ -12,6 +12,7 @@ Basically the top level function Blastn.align processes sequences as follow:
 * A list of fasta file (each can contains many sequences) is then submitted one by one to the balst database though  BlastnWrapper.Aligner
 * For each query fasta a list of BlastHit objects containing informations for blast hits found will be returned
 * Hit lists are combined into a single flat list and returned at the end of Blastn.align execution.
+* Alternatively Blastn.align_intervals streams blastn results into a MaskIntervals object of merged subject intervals per sequence that can be passed to RefMasker.mask without storing any BlastHit object.
 
 @copyright [GNU General Public License v2](http://www.gnu.org/licenses/gpl-2.0.html)
 @author Adrien Leger - 2014
@@ -21,4 +22,4 @@ Basically the top level function Blastn.align processes sequences as follow:
 * [Github](https://github.com/a-slide)
 * [Atlantic Gene Therapies - INSERM 1089] (http://www.atlantic-gene-therapies.fr/)
 """
-__all__ = ["Blastn", "BlastnWrapper", "MakeblastdbWrapper", "BlastHit"]
+__all__ = ["Blastn", "BlastnWrapper", "MakeblastdbWrapper", "BlastHit", "MaskIntervals", "HitTable", "HitIndex", "ResultCache"]
@@ -0,0 +1,169 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+# Standard library packages import
+from os import close, remove
+from sys import maxint
+from heapq import merge
+from tempfile import mkstemp
+from time import time
+
+# Third party packages import
+import pysam
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class BamWriter(object):
+    """
+    @class  BamWriter
+    @brief  Write a stream of SAM records (for example the standard output of bwa mem) in a BAM
+    file compressed by several threads, without writing any SAM file. Reads can be sorted by
+    coordinate with a bounded memory: reads are buffered by chunks of max_records, each chunk
+    is sorted and written in a temporary uncompressed BAM file, then chunks are merged with a
+    k-way merge in the final BAM. A BAM index is created at the end if requested.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "BAM WRITER\n"
+        msg += "Output bam : {}\n".format(self.out_path)
+        msg += "Sort : {}\tIndex : {}\tThreads : {}\tMax records in memory : {}\n".format(
+            self.sort, self.index, self.threads, self.max_records)
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __init__ (self, out_path="./out.bam", sort=True, index=True, threads=1, max_records=500000,
+        tmp_dir=None):
+        """
+        @param out_path Path of the output bam file
+        @param sort If True reads are sorted by coordinate
+        @param index If True a bam index is created (requires sort)
+        @param threads Number of threads used for BGZF compression
+        @param max_records Maximal number of reads kept in memory when sorting
+        @param tmp_dir Directory for the temporary sorted chunks. Default = system temp directory
+        """
+        self.out_path = out_path
+        self.sort = sort
+        self.index = index and sort
+        self.threads = threads
+        self.max_records = max_records
+        self.tmp_dir = tmp_dir
+        self.bai = ""
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def write (self, sam_input):
+        """
+        Read a SAM/BAM stream and write it in the output bam file
+        @param sam_input File object (pipe) or path of a SAM or BAM input
+        @return Path of the output bam file
+        """
+        start_time = time()
+        with pysam.AlignmentFile(sam_input, "r") as infile:
+            header = infile.header.to_dict()
+
+            if not self.sort:
+                with pysam.AlignmentFile(self.out_path, "wb", header=header, threads=self.threads) as outfile:
+                    for read in infile:
+                        outfile.write(read)
+                print ("Bam file created in {}s".format(round(time()-start_time, 3)))
+                return self.out_path
+
+            # Sort chunks of reads in memory and spill them in temporary bam files
+            header = self._sorted_header(header)
+            chunk_list = []
+            try:
+                reads = []
+                for read in infile:
+                    reads.append(read)
+                    if len(reads) >= self.max_records:
+                        chunk_list.append(self._write_chunk(reads, header))
+                        reads = []
+
+                # If all reads fit in memory write them directly
+                if not chunk_list:
+                    reads.sort(key=self._sort_key)
+                    with pysam.AlignmentFile(self.out_path, "wb", header=header, threads=self.threads) as outfile:
+                        for read in reads:
+                            outfile.write(read)
+                else:
+                    if reads:
+                        chunk_list.append(self._write_chunk(reads, header))
+                    del reads
+                    self._merge_chunks(chunk_list, header)
+
+            finally:
+                for chunk in chunk_list:
+                    remove(chunk)
+
+        print ("Sorted bam file created in {}s".format(round(time()-start_time, 3)))
+        self._make_index()
+        return self.out_path
+
+    def merge (self, bam_list, header=None):
+        """
+        Merge coordinate sorted bam files sharing the same references in the output bam file.
+        @param bam_list List of paths of sorted bam files
+        @param header Header dictionnary of the output file. By default the header of the first
+        file is used
+        @return Path of the output bam file
+        """
+        start_time = time()
+        if header is None:
+            with pysam.AlignmentFile(bam_list[0], "rb") as infile:
+                header = infile.header.to_dict()
+        header = self._sorted_header(header)
+
+        self._merge_chunks(bam_list, header)
+        print ("Bam files merged in {}s".format(round(time()-start_time, 3)))
+        self._make_index()
+        return self.out_path
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _sort_key (self, read):
+        """
+        Coordinate sort key: reference order of the header then position. Reads without reference
+        are placed at the end of the file
+        """
+        return (read.reference_id if read.reference_id >= 0 else maxint, read.reference_start)
+
+    def _sorted_header (self, header):
+        header["HD"] = dict(header.get("HD", {"VN": "1.5"}), SO="coordinate")
+        return header
+
+    def _write_chunk (self, reads, header):
+        """
+        Sort reads and write them in a temporary uncompressed bam file
+        @return The path of the temporary file
+        """
+        reads.sort(key=self._sort_key)
+        fd, chunk = mkstemp(suffix=".bam", dir=self.tmp_dir)
+        close(fd)
+        with pysam.AlignmentFile(chunk, "wbu", header=header) as outfile:
+            for read in reads:
+                outfile.write(read)
+        return chunk
+
+    def _iter_chunk (self, chunk, rank):
+        """
+        Yield decorated reads of a sorted bam file for the k-way merge. The rank of the file and the
+        rank of the read make the ties deterministic and avoid comparing reads
+        """
+        with pysam.AlignmentFile(chunk, "rb") as infile:
+            for i, read in enumerate(infile):
+                yield self._sort_key(read), rank, i, read
+
+    def _merge_chunks (self, chunk_list, header):
+        """
+        Merge sorted bam files in the output bam file with a k-way merge
+        """
+        with pysam.AlignmentFile(self.out_path, "wb", header=header, threads=self.threads) as outfile:
+            for key, rank, i, read in merge(*[self._iter_chunk(chunk, rank) for rank, chunk in enumerate(chunk_list)]):
+                outfile.write(read)
+
+    def _make_index (self):
+        if self.index:
+            pysam.index(self.out_path)
+            self.bai = self.out_path+".bai"
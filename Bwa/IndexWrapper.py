@@ -2,16 +2,112 @@
 # Standard library packages import
 from os import path, remove
 from time import time
+import re
 
 # Local library packages
 from pyDNA.Utilities import run_command, file_basename, make_cmd_str, merge_files
+from pyDNA.IndexCache import IndexCache
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
-class NewIndex(object):
+class SharedMemoryIndex(object):
+    """
+    @class SharedMemoryIndex
+    @brief Base class of bwa index objects making them context managers that load the index in
+    shared memory with bwa shm. bwa mem processes started inside the with block find the index in
+    shared memory instead of loading it from disk. bwa identifies indexes in shared memory by
+    basename only, and bwa mem uses any index in shared memory with the same basename. An index
+    with the same basename already in shared memory is thus only reused if the name identifies
+    the content (sha1 names of IndexCache entries), else entering the block raises an exception
+    instead of silently aligning against another reference.
+    bwa shm -d drops all the indexes at once, so shared memory is released at the end of the block
+    only if all the indexes in shared memory were loaded by context managers of this process that
+    are all closed. Indexes loaded by other processes keep the memory of the indexes loaded here
+    until "bwa shm -d" is run. If bwa shm fails (no shared memory, not enough memory...) bwa mem
+    just loads the index from disk as usual.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS FIELDS~~~~~~~#
+
+    bwa = "bwa" # Path of the bwa executable used for bwa shm
+    in_shm = False # True if the index is loaded in shared memory
+    shm_loaded = False # True if the index was loaded by this object
+
+    # Names of the indexes loaded in shared memory by this process and of those still in use
+    process_loaded = set()
+    process_active = set()
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __enter__(self):
+        # bwa identifies indexes in shared memory by the basename of the index path
+        name = path.basename(self.index_path)
+        if name in self._shm_list():
+            if not self._unique_name() and name not in self.process_loaded:
+                raise Exception ("An index named {} is already in shared memory and cannot be told "
+                    "apart from {}. Remove it with 'bwa shm -d' or use an index with a unique "
+                    "basename".format(name, self.index_path))
+            print ("Index {} already in shared memory".format(name))
+            self.in_shm = True
+            return self
+
+        print ("Load index {} in shared memory".format(path.basename(self.index_path)))
+        start_time = time()
+        try:
+            run_command("{} shm {}".format(self.bwa, self.index_path), stdin=None, ret_stderr=True, ret_stdout=False)
+        except Exception as E:
+            print (E)
+            print ("Shared memory unavailable, the index will be loaded from disk by bwa mem")
+            return self
+
+        self.in_shm = self.shm_loaded = True
+        self.process_loaded.add(name)
+        self.process_active.add(name)
+        print ("Index loaded in {}s".format(round(time()-start_time, 3)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.shm_loaded:
+            name = path.basename(self.index_path)
+            self.process_active.discard(name)
+            shm_list = self._shm_list()
+
+            # Drop all the indexes only if they were all loaded here and are not used anymore
+            if set(shm_list) <= self.process_loaded and not self.process_active:
+                print ("Remove indexes {} from shared memory".format(", ".join(shm_list)))
+                run_command("{} shm -d".format(self.bwa), stdin=None, ret_stderr=True, ret_stdout=False)
+                self.process_loaded.clear()
+            else:
+                print ("Other indexes in shared memory, {} is kept in shared memory until "
+                    "'bwa shm -d' is run".format(name))
+        self.in_shm = self.shm_loaded = False
+        return False
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _unique_name(self):
+        """
+        @return True if the basename of the index is a sha1 content fingerprint (IndexCache entry)
+        """
+        return re.match("^[0-9a-f]{40}$", path.basename(self.index_path)) is not None
+
+    def _shm_list(self):
+        """
+        @return The list of index names in shared memory, empty if shared memory is unavailable
+        """
+        try:
+            stdout = run_command("{} shm -l".format(self.bwa), stdin=None, ret_stderr=False, ret_stdout=True)
+        except Exception:
+            return []
+        return [line.split("\t")[0] for line in stdout.split("\n") if line.strip()]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class NewIndex(SharedMemoryIndex):
     """
     @class NewIndex
     @brief Wrapper for bwa index. Create a reference index from a fasta file
-    BWA 0.7.5+ needs to be install and eventually added to the path.
+    BWA 0.7.5+ needs to be install and eventually added to the path. Can be used as a context
+    manager to load the index in shared memory (see SharedMemoryIndex)
     """
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
@@ -22,12 +118,14 @@ class NewIndex(object):
         msg += "bwa index path : {}\n".format(self.indexer)
         msg += "Blastn database path : {}\n".format(self.index_path)
         msg += "Options : {}\n".format(self.index_opt)
+        msg += "In shared memory : {}\n".format(self.in_shm)
         return msg
 
     def __str__(self):
         return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
 
-    def __init__ (self, ref, index_path="./out.idx", index_opt="", bwa_index = "bwa index"):
+    def __init__ (self, ref, index_path="./out.idx", index_opt="", bwa_index = "bwa index",
+        cache_dir=None, cache_size=0):
         """
         Initialize the object and index the reference genome if necessary
         @param ref Path of the fasta file containing the reference sequence (can be gzipped)
@@ -38,9 +136,31 @@ class NewIndex(object):
         have to be the key (without "-") and the the option value in the dictionnary value. If no
         value is requested after the option flag "None" had to be asigned to the value field.
         @param bwa index Path ot the bwa index executable. Not required if bwa if added to your path
+        @param cache_dir Facultative IndexCache directory. If given, an index previously built from
+        the same reference content with the same options is reused, else the index is built in
+        the cache. index_path is then ignored and points to the index files in the cache
+        @param cache_size Maximal size of the cache in bytes. 0 = no eviction
         """
         # Creating object variables
         self.indexer = bwa_index
+        # bwa executable for bwa shm
+        if bwa_index.endswith(" index"):
+            self.bwa = bwa_index[:-len(" index")]
+
+        if cache_dir:
+            cache = IndexCache(cache_dir, cache_size)
+            key = cache.fingerprint([ref] if isinstance(ref, str) else ref, "bwa index", index_opt)
+            self.index_path = cache.get(key, lambda index_path: self._build(ref, index_path, index_opt))
+            self.index_opt = "{} -p {}".format (index_opt, self.index_path)
+        else:
+            self._build(ref, index_path, index_opt)
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _build(self, ref, index_path, index_opt):
+        """
+        Build the command line options and create the index in index_path
+        """
         self.index_path = index_path
         self.index_opt = "{} -p {}".format (index_opt, self.index_path)
 
@@ -68,8 +188,6 @@ class NewIndex(object):
             self._remove_index_files()
             raise Exception (E.message+"Impossible to generate a valid index from the reference sequence")
 
-    #~~~~~~~PRIVATE METHODS~~~~~~~#
-
     def _make_index(self):
         """
         Create a bwa index from ref using bwa index
@@ -99,28 +217,32 @@ class NewIndex(object):
                 remove (f)
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
-class ExistingIndex(object):
+class ExistingIndex(SharedMemoryIndex):
     """
     @class ExistingIndex
-    @brief Import an existing bwa index + verify the existence of files
+    @brief Import an existing bwa index + verify the existence of files. Can be used as a context
+    manager to load the index in shared memory (see SharedMemoryIndex)
     """
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
     def __repr__(self):
         msg = "BWA INDEX WRAPPER (EXISTING INDEX)\n"
         msg += "Bwa Index Path : {}\n".format(self.index_path)
+        msg += "In shared memory : {}\n".format(self.in_shm)
         return msg
 
     def __str__(self):
         return "\n<Instance of {} from {}>\n".format(self.__class__.__name__, self.__module__)
 
-    def __init__ (self, index_path):
+    def __init__ (self, index_path, bwa="bwa"):
         """
         @param index_path The index path is the name of any of the index files up to but not
         including the final "amb", "ann", "bwt", "pac" and "sa"
+        @param bwa Path of the bwa executable, used to load the index in shared memory
         """
         # Creating object variables
         self.index_path = index_path
+        self.bwa = bwa
 
         print ("Checking index files")
         # Checking if all index files needed by bwa are
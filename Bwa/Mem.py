@@ -1,13 +1,26 @@
 #~~~~~~~GLOBAL IMPORTS~~~~~~~#
 
 # Standard library packages import
-from os import remove, path
+from os import remove, path, mkfifo, close, O_WRONLY, O_NONBLOCK
+from os import open as os_open
+from shutil import rmtree
+from tempfile import mkdtemp, TemporaryFile
+from threading import Thread, Event, Condition, BoundedSemaphore
+from multiprocessing import cpu_count, Pool
+from subprocess import Popen
+from time import time
+import gzip
+
+# Third party packages import
+import pysam
 
 # Local library packages import
 #from SamSpliter import SamSpliter
 from MemWrapper import Aligner
 from IndexWrapper import NewIndex, ExistingIndex
+from BamWriter import BamWriter
 from pyDNA.Utilities import mkdir
+from pyDNA.FastqFT.FastqFilter import FastqFilter
 
 #~~~~~~~MAIN METHODS~~~~~~~#
 
@@ -23,7 +36,9 @@ def align  (R1,
             indexer = "bwa index",
             index_opt="",
             index_outdir = "./bwa_index/",
-            index_outname = "out"):
+            index_outname = "out",
+            cache_dir = None,
+            cache_size = 0):
     """
     Main function of the package allowing to validate an existing index or to create a new one,
     then perform a alignment of single or paired fastq sequences against the index. Finally a sam
@@ -43,8 +58,430 @@ def align  (R1,
     @param index_opt Bwa index command line options as a string
     @param index_outdir Directory where to store the index files
     @param index_outname Basename of the index file
+    @param cache_dir Facultative IndexCache directory where new indexes are stored and reused for
+    identical references and options. index_outdir and index_outname are then ignored
+    @param cache_size Maximal size of the cache in bytes. 0 = no eviction
     @return Path of the output sam file
     """
+    idx = _get_index(index, ref, indexer, index_opt, index_outdir, index_outname, cache_dir, cache_size)
+
+    # Create a Aligner object
+    mem = Aligner(idx, align_opt, aligner, align_threads)
+    #~print (repr(mem))
+    mkdir(align_outdir)
+
+    # Align the reference index with R1 fastq (and R2)
+    align_path = path.join(align_outdir, align_outname)
+    return (mem.align(R1, R2, align_path))
+
+def filter_align (R1,
+                  R2,
+                  index = '',
+                  ref = '',
+                  quality_filter = None,
+                  adapter_trimmer = None,
+                  input_qual = "fastq-sanger",
+                  numprocs = None,
+                  tee_outdir = None,
+                  aligner = "bwa mem",
+                  align_opt = "",
+                  align_threads = 1,
+                  align_outdir = "./bwa_align/",
+                  align_outname = "out.sam",
+                  indexer = "bwa index",
+                  index_opt = "",
+                  index_outdir = "./bwa_index/",
+                  index_outname = "out",
+                  cache_dir = None,
+                  cache_size = 0):
+    """
+    Pipelined filtering and alignment of paired fastq files. FastqFilter writes the filtered pairs
+    interleaved in a named pipe read by bwa mem -p, so that both steps run at the same time and
+    the filtered reads are neither written on disk nor compressed and decompressed again. A single
+    interleaved pipe is used because bwa reads large batches of R1 before reading R2, which would
+    block a writer feeding 2 pipes. If bwa exits before reading all the filtered reads, the
+    filtering still finishes and an exception reports the return code and stderr of bwa.
+    @param R1 Path to the forward read fastq file (can be gzipped)
+    @param R2 Path to the reverse read fastq file (can be gzipped)
+    @param quality_filter A QualityFilter object, if a quality filtering is required
+    @param adapter_trimmer An AdapterTrimmer object, if a adapter trimming is required
+    @param input_qual Quality scale of the fastq (fastq-sanger for illumina 1.8+)
+    @param numprocs Number of parrallel processes for the filtering steps
+    @param tee_outdir If given, the filtered fastq.gz files are also written in this directory
+    @return A tuple (path of the output sam file, FastqFilter object)
+    The other parameters are the same as for align
+    """
+    idx = _get_index(index, ref, indexer, index_opt, index_outdir, index_outname, cache_dir, cache_size)
+
+    mem = Aligner(idx, align_opt+" -p", aligner, align_threads)
+    mkdir(align_outdir)
+    align_path = path.join(align_outdir, align_outname)
+    if tee_outdir:
+        mkdir(tee_outdir)
+
+    # Create a named pipe in a private temporary directory
+    fifo_dir = mkdtemp()
+    fifo = path.join(fifo_dir, "filtered.fastq")
+    mkfifo(fifo)
+
+    # Start bwa in a thread, it waits for the filtered reads in the pipe
+    cmd = mem.command(fifo)
+    done = Event()
+    result = {}
+    def run_bwa():
+        # Spool stderr in a temporary file so that it cannot fill a pipe and block bwa
+        stderr = TemporaryFile()
+        try:
+            with open(align_path, "wb") as out:
+                proc = Popen(cmd, shell=True, stdout=out, stderr=stderr)
+                proc.wait()
+            stderr.seek(0)
+            result["returncode"] = proc.returncode
+            result["stderr"] = stderr.read()
+        except Exception as E:
+            result["error"] = E
+        finally:
+            stderr.close()
+
+        # Consume the reads left by bwa so that the filtering processes can finish
+        unread = 0
+        if not done.is_set():
+            with open(fifo, "rb") as f:
+                data = f.read(1048576)
+                while data:
+                    unread += len(data)
+                    data = f.read(1048576)
+        result["unread"] = unread
+
+    print ("Align against {} index with bwa mem".format(path.basename(idx.index_path)))
+
+    bwa_thread = Thread(target=run_bwa)
+    bwa_thread.start()
+
+    try:
+        fastq_filter = FastqFilter(R1, R2, quality_filter, adapter_trimmer,
+            outdir=tee_outdir or "./fastq/", input_qual=input_qual, numprocs=numprocs,
+            compress_output=True, fifo=fifo, tee_output=bool(tee_outdir))
+    finally:
+        done.set()
+        # Release the bwa thread if it is still waiting for a writer to open the pipe
+        while bwa_thread.is_alive():
+            try:
+                close(os_open(fifo, O_WRONLY|O_NONBLOCK))
+            except OSError:
+                pass
+            bwa_thread.join(1)
+        rmtree(fifo_dir)
+
+    if "error" in result:
+        raise result["error"]
+
+    stderr_list = result["stderr"].split("\n")
+    if result["returncode"] != 0 or result.get("unread") or fastq_filter.fifo_broken.value:
+        msg = "bwa mem failed or stopped before reading all the filtered reads :\n"
+        msg += "COMMAND : {}\n".format(cmd)
+        msg += "RETURN CODE : {}\n".format(result["returncode"])
+        msg += "STDERR : {}\n".format(result["stderr"])
+        raise Exception (msg)
+
+    # In bwa stderr return a report of alignment just print the most important one
+    print(stderr_list[0])
+    print("\n".join(stderr_list[-4:]))
+    return align_path, fastq_filter
+
+def align_batch (manifest,
+                 index = '',
+                 ref = '',
+                 total_threads = 0,
+                 min_threads = 4,
+                 max_threads = 16,
+                 use_shm = True,
+                 aligner = "bwa mem",
+                 align_opt = "",
+                 indexer = "bwa index",
+                 index_opt = "",
+                 index_outdir = "./bwa_index/",
+                 index_outname = "out",
+                 cache_dir = None,
+                 cache_size = 0):
+    """
+    Align a batch of samples against the same index with several concurrent bwa mem processes
+    sharing a budget of threads. Samples are started from the largest to the smallest input. Each
+    sample receives a part of the free threads proportional to its share of the input size of the
+    samples not started yet, within [min_threads, max_threads]. Large samples thus get more
+    threads and do not delay the end of the batch, small ones run concurrently with few threads,
+    and the last samples get the threads released by the others instead of leaving cores idle.
+    @param manifest List of (R1, R2, out_path) tuples. R2 can be an empty string for single end
+    @param total_threads Total number of threads for all bwa processes. 0 = all the cores
+    @param min_threads Minimal number of threads of a bwa process
+    @param max_threads Maximal number of threads of a bwa process
+    @param use_shm If True the index is loaded once in shared memory for the whole batch
+    @return A list of report dictionnaries in the manifest order, with the sample paths, threads,
+    wall time (s) and throughput (MB of input fastq per second)
+    @exception Exception Raised at the end of the batch if some samples failed
+    The other parameters are the same as for align
+    """
+    idx = _get_index(index, ref, indexer, index_opt, index_outdir, index_outname, cache_dir, cache_size)
+
+    total_threads = total_threads if total_threads else cpu_count()
+    min_threads = min(min_threads, total_threads)
+
+    # Input size of the samples in MB
+    sizes = [sum(path.getsize(f) for f in (R1, R2) if f)/1048576.0 for R1, R2, out_path in manifest]
+    order = sorted(range(len(manifest)), key=lambda i: sizes[i], reverse=True)
+
+    reports = [None]*len(manifest)
+    cond = Condition()
+    state = {"free": total_threads}
+
+    def run_sample(i, threads):
+        R1, R2, out_path = manifest[i]
+        start_time = time()
+        error = None
+        try:
+            Aligner(idx, align_opt, aligner, threads).align(R1, R2, out_path)
+        except Exception as E:
+            error = E
+        wall_time = time()-start_time
+        reports[i] = {"R1": R1, "R2": R2, "out": out_path, "threads": threads, "size": sizes[i],
+            "wall_time": wall_time, "throughput": sizes[i]/wall_time if wall_time else 0.0, "error": error}
+
+        # Give back the threads to the budget
+        with cond:
+            state["free"] += threads
+            cond.notify()
+
+    start_time = time()
+    thread_list = []
+    with (idx if use_shm else _NoContext()):
+        for rank, i in enumerate(order):
+            with cond:
+                while state["free"] < min_threads:
+                    cond.wait()
+                # Split the free threads between the samples not started yet according to their size
+                remaining_size = sum(sizes[j] for j in order[rank:])
+                if remaining_size:
+                    threads = int(round(state["free"]*sizes[i]/remaining_size))
+                else:
+                    threads = state["free"]//(len(order)-rank)
+                threads = min(max(threads, min_threads), max_threads, state["free"])
+                state["free"] -= threads
+
+            print ("Start sample {} with {} threads".format(manifest[i][2], threads))
+            t = Thread(target=run_sample, args=(i, threads))
+            t.start()
+            thread_list.append(t)
+
+        for t in thread_list:
+            t.join()
+
+    # Report per sample wall time and throughput
+    print ("\nBATCH REPORT\tTotal wall time : {}s".format(round(time()-start_time, 3)))
+    for r in reports:
+        print ("{}\tThreads : {}\tInput : {} MB\tWall time : {}s\tThroughput : {} MB/s{}".format(
+            r["out"], r["threads"], round(r["size"], 2), round(r["wall_time"], 3),
+            round(r["throughput"], 3), "\tFAILED" if r["error"] else ""))
+
+    failed = [r for r in reports if r["error"]]
+    if failed:
+        raise Exception ("{} samples failed :\n{}".format(len(failed),
+            "\n".join("{} : {}".format(r["out"], r["error"]) for r in failed)))
+
+    return reports
+
+def align_chunks (R1,
+                  R2 = '',
+                  index = '',
+                  ref = '',
+                  out_path = "./out.bam",
+                  chunk_size = 1000000,
+                  executor = None,
+                  workers = 1,
+                  max_pending = 0,
+                  read_group = "",
+                  tmp_dir = None,
+                  aligner = "bwa mem",
+                  align_opt = "",
+                  align_threads = 1,
+                  bam_threads = 1,
+                  max_records = 500000,
+                  indexer = "bwa index",
+                  index_opt = "",
+                  index_outdir = "./bwa_index/",
+                  index_outname = "out",
+                  cache_dir = None,
+                  cache_size = 0):
+    """
+    Scatter-gather alignment of a large sample. R1 and R2 are split in chunks of chunk_size
+    records (pairs stay in the same chunk), each chunk is aligned by an independent bwa mem worker
+    into a sorted bam, and the chunk bams are merged with a k-way merge into a single sorted and
+    indexed bam. Chunks are submitted to the executor while the fastq files are being split and
+    the chunk fastq are removed as soon as they are aligned.
+    @param R1 Path to the file containing fastq sequences (can be gzipped)
+    @param R2 Facultative path to the file containing paired fastq sequence (can be gzipped)
+    @param out_path Path of the output bam file
+    @param chunk_size Number of reads (or pairs) per chunk
+    @param executor Object with a multiprocessing.Pool like imap method, returning the results in
+    order, used to run the chunks (for example a pool dispatching the chunks on remote hosts
+    sharing tmp_dir). The worker function and its arguments are picklable. By default a local
+    process pool of size workers is used
+    @param workers Number of workers of the default local pool
+    @param max_pending Maximal number of chunks written on disk and not yet aligned. 0 = no limit.
+    The executor has to consume its iterable in a separate thread (as multiprocessing.Pool does)
+    @param read_group Read group line passed to bwa mem -R, for example "@RG\\tID:s1\\tSM:s1"
+    @param tmp_dir Directory for the chunks. Default = a temporary directory next to out_path
+    @param align_threads Number of threads of each bwa mem worker
+    @param bam_threads Number of threads used for the compression of the final bam
+    @param max_records Maximal number of reads kept in memory by each worker when sorting
+    @return Path of the output bam file
+    The other parameters are the same as for align
+    """
+    idx = _get_index(index, ref, indexer, index_opt, index_outdir, index_outname, cache_dir, cache_size)
+
+    if read_group:
+        align_opt += " -R '{}'".format(read_group)
+
+    work_dir = mkdtemp(dir=tmp_dir or path.dirname(path.abspath(out_path)))
+    pool = None
+    if executor is None:
+        pool = executor = Pool(workers)
+    pending = BoundedSemaphore(max_pending) if max_pending else None
+    stop = Event()
+
+    try:
+        # Scatter: split the fastq files and align the chunks as they are produced
+        def chunk_args():
+            for rank, R1_chunk, R2_chunk in _split_fastq(R1, R2, chunk_size, work_dir, pending, stop):
+                yield (idx.index_path, aligner, align_opt, align_threads, R1_chunk, R2_chunk,
+                    path.join(work_dir, "chunk_{}.bam".format(rank)), max_records)
+
+        start_time = time()
+        bam_list = []
+        for bam in executor.imap(_align_chunk, chunk_args()):
+            bam_list.append(bam)
+            if pending:
+                pending.release()
+        print ("{} chunks aligned in {}s".format(len(bam_list), round(time()-start_time, 3)))
+        if not bam_list:
+            raise Exception ("No reads to align in {}".format(R1))
+
+        # Gather: merge the sorted chunks with a consistent header
+        header = _merge_header(bam_list, R1, R2)
+        BamWriter(out_path, sort=True, index=True, threads=bam_threads).merge(bam_list, header)
+
+    finally:
+        # Release the splitting generator if it waits for a slot after a failed chunk, else the
+        # pool cannot join the thread consuming it
+        stop.set()
+        if pending:
+            try:
+                pending.release()
+            except ValueError:
+                pass
+        if pool:
+            pool.terminate()
+        rmtree(work_dir, ignore_errors=True)
+
+    return out_path
+
+#~~~~~~~PRIVATE METHODS~~~~~~~#
+
+def _split_fastq (R1, R2, chunk_size, work_dir, pending=None, stop=None):
+    """
+    Split R1 and eventually R2 in chunks of chunk_size records. The 4 lines of each record are
+    copied without parsing
+    @param pending Facultative semaphore acquired before writing each chunk
+    @param stop Facultative Event. The splitting stops if it is set
+    @return A generator of (rank, R1 chunk path, R2 chunk path or "")
+    """
+    in_list = [gzip.open(f, "rb") if f[-2:].lower() == "gz" else open(f, "rb") for f in (R1, R2) if f]
+    rank = 0
+    try:
+        while True:
+            if pending:
+                pending.acquire()
+            if stop and stop.is_set():
+                break
+            out_paths = [path.join(work_dir, "chunk_{}_{}.fastq".format(rank, i+1)) for i in range(len(in_list))]
+            out_list = [open(p, "wb") for p in out_paths]
+            n_records = 0
+            for n_records in xrange(chunk_size):
+                records = ["".join(next(f, "") for i in range(4)) for f in in_list]
+                if not records[0]:
+                    break
+                for out, record in zip(out_list, records):
+                    out.write(record)
+            else:
+                n_records = chunk_size
+            for out in out_list:
+                out.close()
+
+            if not n_records:
+                for p in out_paths:
+                    remove(p)
+                break
+
+            yield rank, out_paths[0], out_paths[1] if len(out_paths) > 1 else ""
+            if n_records < chunk_size:
+                break
+            rank += 1
+    finally:
+        for f in in_list:
+            f.close()
+
+def _align_chunk (args):
+    """
+    Align a chunk in a sorted bam without index and remove the chunk fastq files. Module level
+    function so that it can be pickled by process pools
+    @param args Tuple (index path, aligner, align options, threads, R1 chunk, R2 chunk, bam path,
+    max records in memory)
+    @return The path of the chunk bam
+    """
+    index_path, aligner, align_opt, threads, R1_chunk, R2_chunk, bam_path, max_records = args
+    mem = Aligner(ExistingIndex(index_path), align_opt, aligner, threads)
+    mem.align_bam(R1_chunk, R2_chunk, bam_path, sort=True, index=False, max_records=max_records)
+    for f in (R1_chunk, R2_chunk):
+        if f:
+            remove(f)
+    return bam_path
+
+def _merge_header (bam_list, R1, R2):
+    """
+    Build the header of the merged bam from the chunk headers. References and read groups have to
+    be identical in all chunks, and the chunk fastq paths of the @PG command lines are replaced
+    by the original fastq paths
+    @return The header dictionnary
+    """
+    with pysam.AlignmentFile(bam_list[0], "rb") as infile:
+        header = infile.header.to_dict()
+
+    for bam in bam_list[1:]:
+        with pysam.AlignmentFile(bam, "rb") as infile:
+            other = infile.header.to_dict()
+        if other.get("SQ") != header.get("SQ") or other.get("RG") != header.get("RG"):
+            raise Exception ("Inconsistent references or read groups in chunk {}".format(bam))
+
+    first = path.basename(bam_list[0]).split(".")[0]
+    for pg in header.get("PG", []):
+        if "CL" in pg:
+            pg["CL"] = pg["CL"].replace(path.join(path.dirname(bam_list[0]), first+"_1.fastq"), R1)
+            pg["CL"] = pg["CL"].replace(path.join(path.dirname(bam_list[0]), first+"_2.fastq"), R2)
+    return header
+
+class _NoContext(object):
+    """
+    Context manager doing nothing, used when the index is not loaded in shared memory
+    """
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+def _get_index (index, ref, indexer, index_opt, index_outdir, index_outname, cache_dir=None, cache_size=0):
+    """
+    Validate an existing bwa index or create a new one from the reference fasta file
+    @return A NewIndex or ExistingIndex object
+    """
     # Try to import an existing index
     try:
         if not index:
@@ -62,15 +499,11 @@ def align  (R1,
             raise Exception("Invalid or no fasta file provided. Cannot create an index")
 
         print("Generating index...")
-        mkdir(index_outdir)
-        index_path = path.join(index_outdir, index_outname)
-        idx = NewIndex(ref, index_path, index_opt, indexer)
-
-    # Create a Aligner object
-    mem = Aligner(idx, align_opt, aligner, align_threads)
-    #~print (repr(mem))
-    mkdir(align_outdir)
+        if cache_dir:
+            index_path = None
+        else:
+            mkdir(index_outdir)
+            index_path = path.join(index_outdir, index_outname)
+        idx = NewIndex(ref, index_path, index_opt, indexer, cache_dir, cache_size)
 
-    # Align the reference index with R1 fastq (and R2)
-    align_path = path.join(align_outdir, align_outname)
-    return (mem.align(R1, R2, align_path))
+    return idx
@@ -2,10 +2,13 @@
 # Standard library packages import
 from os import path, remove, rmdir
 from multiprocessing import cpu_count
+from subprocess import Popen, PIPE
+from tempfile import TemporaryFile
 from time import time
 
 # Local library packages
 from pyDNA.Utilities import run_command, file_basename, make_cmd_str
+from BamWriter import BamWriter
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class Aligner(object):
@@ -44,10 +47,23 @@ class Aligner(object):
         if self.bwa_threads == 0:
             self.bwa_threads = cpu_count()
         # By default the option t is setted to the max number of available threads
-        self.align_opt = "{} -t {}".format(align_opt, bwa_threads)
+        self.align_opt = "{} -t {}".format(align_opt, self.bwa_threads)
 
     #~~~~~~~PUBLIC METHODS~~~~~~~#
 
+    def command(self, R1_path, R2_path=""):
+        """
+        @param R1_path Path to the file containing fastq sequences
+        @param R2_path Facultative path to the file containing paired fastq sequence
+        @return The bwa mem command line writing the sam on the standard output
+        """
+        return "{} {} {} {} {}".format(
+            self.aligner,
+            self.align_opt,
+            self.Index.index_path,
+            R1_path,
+            R2_path)
+
     def align(self, R1_path, R2_path="", out_path="./out.sam"):
         """
         Align query fastq against a subject database and return a list of BlastHit object
@@ -58,13 +74,7 @@ class Aligner(object):
         @exception (SystemError,OSerror) May be returned by run_command in case of invalid command line.
         """
         # Build the command line
-        cmd = "{} {} {} {} {} {} ".format(
-            self.aligner,
-            self.align_opt,
-            self.Index.index_path,
-            R1_path,
-            R2_path,
-            "> "+out_path)
+        cmd = "{} > {}".format(self.command(R1_path, R2_path), out_path)
 
         # Execute bwa mem (Can raise a SystemError) and verify if stdout is not None
         print ("Align against {} index with bwa mem".format(file_basename (self.Index.index_path)))
@@ -74,3 +84,54 @@ class Aligner(object):
         print(stderr_list[0])
         print("\n".join(stderr_list[-4:]))
         return out_path
+
+    def align_bam(self, R1_path, R2_path="", out_path="./out.bam", sort=True, index=True,
+        bam_threads=1, max_records=500000):
+        """
+        Align query fastq against a subject database and stream bwa mem standard output through a
+        pipe into a compressed bam file. No sam file is written on disk
+        @param R1_path Path to the file containing fastq sequences
+        @param R2_path Facultative path to the file containing paired fastq sequence
+        @param out_path Path to the output bam file
+        @param sort If True reads are sorted by coordinate with a bounded memory
+        @param index If True a bam index is created (requires sort)
+        @param bam_threads Number of threads used for bam compression
+        @param max_records Maximal number of reads kept in memory when sorting
+        @return Path of the output bam file
+        @exception Exception Raised if bwa mem exit with an error code of 1
+        """
+        # Build the command line
+        cmd = self.command(R1_path, R2_path)
+
+        print ("Align against {} index with bwa mem".format(file_basename (self.Index.index_path)))
+
+        # Spool stderr in a temporary file so that it cannot fill a pipe and block bwa
+        stderr = TemporaryFile()
+        proc = Popen(cmd, shell=True, stdout=PIPE, stderr=stderr)
+        writer = BamWriter(out_path, sort, index, bam_threads, max_records)
+        write_error = None
+        try:
+            writer.write(proc.stdout)
+        # An error of bwa usually causes an invalid sam stream, report bwa error first
+        except Exception as E:
+            write_error = E
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+        stderr.seek(0)
+        stderr_list = stderr.read().split("\n")
+        stderr.close()
+
+        if proc.returncode == 1:
+            msg = "An error occured during execution of following command :\n"
+            msg += "COMMAND : {}\n".format(cmd)
+            msg += "STDERR : {}\n".format("\n".join(stderr_list))
+            raise Exception (msg)
+        if write_error:
+            raise write_error
+
+        # In bwa stderr return a report of alignment just print the most important one
+        print(stderr_list[0])
+        print("\n".join(stderr_list[-4:]))
+        return out_path
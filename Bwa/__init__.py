@@ -12,6 +12,11 @@ Basically the top level function Mem.align processes sequences as follow:
 * A instance of MemWrapper.Aligner is then created by passing the Index object as an argument.
 * A single or a pair of fastq files are then aligned against the reference through MemWrapper.Aligner
 * Finally, results are piped into a sam file
+* Alternatively MemWrapper.Aligner.align_bam streams bwa mem output into a sorted and indexed bam file through BamWriter.BamWriter
+* Mem.filter_align runs FastqFT.FastqFilter and bwa mem at the same time, filtered pairs being streamed to bwa through a named pipe
+* Index objects are context managers loading the index in shared memory with bwa shm, so that a batch of alignments does not reload it from disk
+* Mem.align_batch aligns a manifest of samples with concurrent bwa mem processes sharing a budget of threads
+* Mem.align_chunks splits a large sample in chunks aligned by independent workers and merges the sorted chunk bams
 
 @copyright [GNU General Public License v2](http://www.gnu.org/licenses/gpl-2.0.html)
 @author Adrien Leger - 2014
@@ -21,4 +26,4 @@ Basically the top level function Mem.align processes sequences as follow:
 * [Github](https://github.com/a-slide)
 * [Atlantic Gene Therapies - INSERM 1089] (http://www.atlantic-gene-therapies.fr/)
 """
-__all__ = ["Mem", "IndexWrapper", "MemWrapper"]
+__all__ = ["Mem", "IndexWrapper", "MemWrapper", "BamWriter"]
@@ -17,7 +17,8 @@ class AdapterTrimmer(object):
         """
         @param Aligner Wrapper object for pairwise alignement. The aligner needs to accept a
         query and a reference DNA string and return a match object with at least 2 fields
-        ref_begin and m.ref_end indicating the starrt and end position along the reference
+        ref_begin and m.ref_end indicating the starrt and end position along the reference.
+        A ssw_wrap Aligner created with a cache_size will memoize alignments of duplicated reads
         @param adapters List of DNA base string corresponding to adapters to be trimmed
         @param min_read_len Fraction of read lenth = minimal size of fragment after trimming
         @param min_match_len Minimal fraction of adapter len that needs to be aligned on the target
@@ -66,6 +67,10 @@ class AdapterTrimmer(object):
             msg += "  Fail len filtering: {}\n".format(self.len_fail)
             msg += "  Pass len filtering : {}\n".format(self.len_pass)
             msg += "  Total pass : {}\n\n".format(self.len_pass+self.seq_untrimmed)
+
+        # Report the alignment cache efficiency if the Aligner memoize results
+        if getattr(self.Aligner, "cache", None) is not None:
+            msg += repr(self.Aligner.cache)
         return msg
 
     def __str__(self):
@@ -7,6 +7,7 @@ from multiprocessing import Value, Process, Queue, cpu_count
 from time import time
 import gzip
 from os import path
+from errno import EPIPE
 
 # Third party package import
 from Bio import SeqIO
@@ -31,7 +32,9 @@ class FastqFilter(object):
         outdir="./fastq/",
         input_qual="fastq-sanger",
         numprocs=None,
-        compress_output=True):
+        compress_output=True,
+        fifo=None,
+        tee_output=False):
         """
         Instanciate the object by storing call parameters and init shared memory counters for
         interprocess communication. A reader process iterate over the input paired fastq files
@@ -50,6 +53,11 @@ class FastqFilter(object):
         the maximum number of thread available will be automatically used.
         @param compress_output If True the output fastq will be written directly in a gzipped file.
         False will generate an uncompressed a much bigger file but will be around
+        @param fifo Path of a named pipe in which filtered pairs are written interleaved (R1 then R2)
+        as uncompressed fastq, for example to be read by bwa mem -p while the filtering is running.
+        The consumer has to open the pipe, else the writer will block
+        @param tee_output If fifo is given, also write the filtered fastq files in outdir. Else no
+        fastq file is written
         """
         # Start a timer
         start_time = time()
@@ -63,7 +71,10 @@ class FastqFilter(object):
         self.R2_in = R2
         self.outdir = outdir
         self.compress_output = compress_output
-        if compress_output:
+        self.fifo = fifo
+        if fifo and not tee_output:
+            self.R1_out = self.R2_out = None
+        elif compress_output:
             self.R1_out = path.join(self.outdir, file_basename(self.R1_in)+"_1_filtered.fastq.gz")
             self.R2_out = path.join(self.outdir, file_basename(self.R2_in)+"_2_filtered.fastq.gz")
         else:
@@ -75,6 +86,7 @@ class FastqFilter(object):
         self.pass_qual = Value('i', 0)
         self.pass_trim = Value('i', 0)
         self.total_pass = Value('i', 0)
+        self.fifo_broken = Value('i', 0)
         if self.qual:
             self.min_qual_found = Value('i', 100)
             self.max_qual_found = Value('i', 0)
@@ -124,6 +136,8 @@ class FastqFilter(object):
         msg += "\tExecution time : {} s\n".format(self.exec_time)
         msg += "\tInput fastq files\n\t\t{}\n\t\t{}\n".format (self.R1_in, self.R2_in)
         msg += "\tOutput fastq files\n\t\t{}\n\t\t{}\n".format (self.R1_out, self.R2_out)
+        if self.fifo:
+            msg += "\tOutput named pipe (interleaved)\n\t\t{}\n".format (self.fifo)
         msg += "\tInput quality score : {}\n".format (self.input_qual)
         msg += "\tNumber of parallel processes : {}\n".format (self.numprocs)
         msg += "\tTotal pair processed : {}\n".format(self.total.value)
@@ -274,27 +288,66 @@ class FastqFilter(object):
         Write sequence couples from outqueue in a pair of compressed fastq.gz files. Sequences will
         remains paired (ie at the same index in the 2 files) but they may not be in the same order
         than in the input fastq files. The process will continue until n = numprocs STOP pills were
-        found in the outqueue (ie. the queue is empty)
+        found in the outqueue (ie. the queue is empty). If a named pipe was given, couples are also
+        written interleaved in the pipe. If the reader of the pipe exits before the end, the pipe
+        is dropped and fifo_broken is set, but the queue is still consumed so that the reader and
+        filter processes can finish.
         """
         # Open output fastq streams for writing
-        if self.compress_output:
+        if not self.R1_out:
+            out_R1 = out_R2 = None
+        elif self.compress_output:
             out_R1 = gzip.open(self.R1_out, "wb")
             out_R2 = gzip.open(self.R2_out, "wb")
         else:
             out_R1 = open(self.R1_out, "wb")
             out_R2 = open(self.R2_out, "wb")
 
+        # Opening the pipe blocks until the consumer opens it for reading
+        out_fifo = open(self.fifo, "wb") if self.fifo else None
+
         # Keep running until all numprocs STOP pills has been passed
         for works in range(self.numprocs):
             # Will exit the loop as soon as a Stop pill will be found
             for seqR1, seqR2 in iter(self.outq.get, "STOP"):
-                out_R1.write(seqR1.format("fastq-sanger"))
-                out_R2.write(seqR2.format("fastq-sanger"))
+                fastqR1 = seqR1.format("fastq-sanger")
+                fastqR2 = seqR2.format("fastq-sanger")
+                if out_fifo:
+                    try:
+                        out_fifo.write(fastqR1)
+                        out_fifo.write(fastqR2)
+                    except IOError as E:
+                        if E.errno != EPIPE:
+                            raise
+                        print ("\tThe named pipe was closed by its reader, stop writing in the pipe")
+                        self.fifo_broken.value = 1
+                        self._close_broken(out_fifo)
+                        out_fifo = None
+                if out_R1:
+                    out_R1.write(fastqR1)
+                    out_R2.write(fastqR2)
                 with self.total_pass.get_lock():
                     self.total_pass.value+=1
 
-        out_R1.close()
-        out_R2.close()
+        if out_fifo:
+            try:
+                out_fifo.close()
+            except IOError as E:
+                if E.errno != EPIPE:
+                    raise
+                self.fifo_broken.value = 1
+        if out_R1:
+            out_R1.close()
+            out_R2.close()
+
+    def _close_broken(self, out_file):
+        """
+        Close a file whose reader is gone. Buffered data cannot be flushed and are discarded
+        """
+        try:
+            out_file.close()
+        except IOError:
+            pass
 
 # Required by multiprocessing
 if __name__ == '__main__':
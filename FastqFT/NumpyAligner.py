@@ -0,0 +1,234 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+# Third party package import
+import numpy as np
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class NumpyAligner(object):
+    """
+    @class  NumpyAligner
+    @brief  Pure NumPy Smith-Waterman local aligner with affine gap penalties, used as a fallback
+    when the compiled ssw library is not available. Cells of the same anti-diagonal are independent
+    and are computed together for a whole batch of query/reference pairs. Only the best score and
+    its coordinates are returned (no traceback). The interface mimics ssw_wrap.Aligner (set_ref
+    and align) and the same scoring scheme is used: a gap of length k costs
+    gap_open + (k-1)*gap_extend and ambiguous bases are not penalized.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS VARIABLES~~~~~~~#
+
+    # Map Nucleotides to int. Any other character is considered as ambiguous, 5 is used for padding
+    base_to_int = np.full(256, 4, dtype=np.int8)
+    for base, code in zip("ACGTacgt", (0, 1, 2, 3, 0, 1, 2, 3)):
+        base_to_int[ord(base)] = code
+    del base, code
+
+    # Lower bound for E and F values, low enough to never be selected but safe from overflow
+    NEG = -(2**30)
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "NUMPY ALIGNER\n"
+        msg += "SCORE PARAMETERS:\n"
+        msg += " Gap Weight     Open: {}     Extension: {}\n".format(-self.gap_open, -self.gap_extend)
+        msg += " Align Weight   Match: {}    Mismatch: {}\n\n".format(self.match, -self.mismatch)
+        return msg
+
+    def __str__(self):
+        return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __init__(self, ref_seq="", match=2, mismatch=2, gap_open=3, gap_extend=1):
+        """
+        @param ref_seq Reference sequence as a python string (case insensitive)
+        @param match Weight for a match
+        @param mismatch Absolute value of mismatch penalty
+        @param gap_open Absolute value of gap open penalty
+        @param gap_extend Absolute value of gap extend penalty
+        """
+        self.match = match
+        self.mismatch = mismatch
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+
+        # Score matrix including the ambiguous base (4) and the padding code (5)
+        self.mat = np.full((6, 6), -mismatch, dtype=np.int32)
+        self.mat[np.arange(4), np.arange(4)] = match
+        self.mat[4:, :] = 0
+        self.mat[:, 4:] = 0
+
+        self.set_ref(ref_seq)
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def set_ref(self, ref_seq):
+        """
+        Store the reference sequence used by align
+        """
+        self.ref_seq = ref_seq
+        self.ref_len = len(ref_seq)
+
+    def align(self, query_seq, min_score=0, min_len=0):
+        """
+        Perform the alignment of query against the object reference sequence
+        @param query_seq Query sequence as a python string (case insensitive)
+        @param min_score Minimal score of match. None will be return in case of filtering out
+        @param min_len Minimal length of match. None will be return in case of filtering out
+        @return A NumpyAlignRes Object containing informations about the alignment.
+        """
+        if not query_seq or not self.ref_seq:
+            return None
+
+        score, query_begin, query_end, ref_begin, ref_end = self.align_batch(
+            [(query_seq, self.ref_seq)])[0]
+
+        if score >= min_score and query_end - query_begin + 1 >= min_len:
+            return NumpyAlignRes(score, query_begin, query_end, ref_begin, ref_end)
+        else:
+            return None
+
+    def align_batch(self, pairs):
+        """
+        Align a batch of query/reference pairs in parallel along the anti-diagonals
+        @param pairs List of (query, reference) sequence tuples
+        @return A list of (score, query_begin, query_end, ref_begin, ref_end) tuples for the best
+        alignment of each pair. Coordinates are 0-based and inclusive as in ssw_wrap. -1 is used
+        for the coordinates of pairs without positive score
+        """
+        n_pair = len(pairs)
+        if not n_pair:
+            return []
+
+        query, query_len = self._encode([q for q, r in pairs])
+        ref, ref_len = self._encode([r for q, r in pairs])
+
+        # Prepend a padding column to the references so that column j of the matrix is ref[:, j]
+        ref = np.hstack((np.full((n_pair, 1), 5, dtype=np.int8), ref))
+        n = query.shape[1]
+        m = ref.shape[1] - 1
+        NEG = self.NEG
+
+        # Rows of the matrix (1 to n), start positions are encoded as row*(m+1)+column
+        rows = np.arange(1, n+1)
+        width = m+1
+
+        # Values of the 2 previous anti-diagonals indexed by row (index 0 = row 0 = boundary)
+        H1 = np.zeros((n_pair, n+1), dtype=np.int32)
+        H2 = np.zeros((n_pair, n+1), dtype=np.int32)
+        E1 = np.full((n_pair, n+1), NEG, dtype=np.int32)
+        F1 = np.full((n_pair, n+1), NEG, dtype=np.int32)
+        S1 = np.zeros((n_pair, n+1), dtype=np.int64)
+        S2 = np.zeros((n_pair, n+1), dtype=np.int64)
+        SE1 = np.zeros((n_pair, n+1), dtype=np.int64)
+        SF1 = np.zeros((n_pair, n+1), dtype=np.int64)
+
+        best_score = np.zeros(n_pair, dtype=np.int32)
+        best_start = np.zeros(n_pair, dtype=np.int64)
+        best_end = np.zeros(n_pair, dtype=np.int64)
+        pair_idx = np.arange(n_pair)
+
+        for d in range(2, n+m+1):
+            cols = d - rows
+            valid = (cols >= 1) & (cols <= ref_len[:, None]) & (rows <= query_len[:, None])
+            sub = self.mat[query, ref[:, np.clip(cols, 0, m)]]
+
+            # Gap along the reference (same row) or along the query (previous row)
+            e_open = H1[:, 1:] - self.gap_open
+            e_ext = E1[:, 1:] - self.gap_extend
+            E = np.maximum(e_open, e_ext)
+            SE = np.where(e_open >= e_ext, S1[:, 1:], SE1[:, 1:])
+            f_open = H1[:, :-1] - self.gap_open
+            f_ext = F1[:, :-1] - self.gap_extend
+            F = np.maximum(f_open, f_ext)
+            SF = np.where(f_open >= f_ext, S1[:, :-1], SF1[:, :-1])
+
+            # Diagonal move, a new alignment starts on the current cell if nothing precedes it
+            G = H2[:, :-1] + sub
+            SG = np.where(H2[:, :-1] > 0, S2[:, :-1], rows*width + cols)
+
+            # Keep the diagonal in case of ties, then the gap along the reference
+            H = np.maximum(np.maximum(G, E), np.maximum(F, 0))
+            S = np.where(H == G, SG, np.where(H == E, SE, SF))
+            H = np.where(valid, H, 0)
+            E = np.where(valid, E, NEG)
+            F = np.where(valid, F, NEG)
+
+            # Update the best cell of each pair (first anti-diagonal and lowest row on ties)
+            i_max = H.argmax(axis=1)
+            h_max = H[pair_idx, i_max]
+            better = h_max > best_score
+            best_score[better] = h_max[better]
+            best_start[better] = S[pair_idx, i_max][better]
+            best_end[better] = (rows[i_max]*width + d - rows[i_max])[better]
+
+            # Shift the anti-diagonals
+            H2, S2 = H1, S1
+            H1 = np.hstack((np.zeros((n_pair, 1), dtype=np.int32), H))
+            S1 = np.hstack((np.zeros((n_pair, 1), dtype=np.int64), S))
+            E1 = np.hstack((np.full((n_pair, 1), NEG, dtype=np.int32), E))
+            F1 = np.hstack((np.full((n_pair, 1), NEG, dtype=np.int32), F))
+            SE1 = np.hstack((np.zeros((n_pair, 1), dtype=np.int64), SE))
+            SF1 = np.hstack((np.zeros((n_pair, 1), dtype=np.int64), SF))
+
+        # Convert the 1-based matrix cells in 0-based sequence coordinates
+        result = []
+        for score, start, end in zip(best_score, best_start, best_end):
+            if score > 0:
+                result.append((int(score), int(start//width-1), int(end//width-1),
+                    int(start%width-1), int(end%width-1)))
+            else:
+                result.append((0, -1, -1, -1, -1))
+        return result
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _encode(self, seq_list):
+        """
+        Encode a list of DNA strings in a 2D array padded with 5 and return it with the lengths
+        """
+        lengths = np.array([len(seq) for seq in seq_list], dtype=np.int64)
+        array = np.full((len(seq_list), max(lengths.max(), 1)), 5, dtype=np.int8)
+        for i, seq in enumerate(seq_list):
+            array[i, :len(seq)] = self.base_to_int[np.frombuffer(seq, dtype=np.uint8)]
+        return array, lengths
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class NumpyAlignRes(object):
+    """
+    @class  NumpyAlignRes
+    @brief  Best local alignment found by NumpyAligner. Fields are the same as ssw_wrap.PyAlignRes
+    but no cigar string and no secondary alignment are available
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHOD~~~~~~~#
+
+    def __repr__(self):
+        msg = self.__str__()
+        msg += "OPTIMAL MATCH\n"
+        msg += "Score            {}\n".format(self.score)
+        msg += "Reference begin  {}\n".format(self.ref_begin)
+        msg += "Reference end    {}\n".format(self.ref_end)
+        msg += "Query begin      {}\n".format(self.query_begin)
+        msg += "Query end        {}\n".format(self.query_end)
+        return msg
+
+    def __str__(self):
+        return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __init__ (self, score, query_begin, query_end, ref_begin, ref_end):
+        """
+        @param score Best alignment score
+        @param query_begin 0-based begin of the alignment on the query
+        @param query_end 0-based inclusive end of the alignment on the query
+        @param ref_begin 0-based begin of the alignment on the reference
+        @param ref_end 0-based inclusive end of the alignment on the reference
+        """
+        self.score = score
+        self.query_begin = query_begin
+        self.query_end = query_end
+        self.ref_begin = ref_begin
+        self.ref_end = ref_end
+        self.score2 = None
+        self.ref_end2 = None
+        self.cigar_string = None
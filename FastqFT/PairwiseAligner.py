@@ -1,14 +1,22 @@
 #~~~~~~~GLOBAL IMPORTS~~~~~~~#
-# Third party package import
-from Bio import pairwise2
+# Local Package import
+from NumpyAligner import NumpyAligner
+
+# The compiled ssw library is used if it can be loaded, else the NumPy aligner is used instead
+try:
+    from pyDNA.Ssw.ssw_wrap import Aligner as SswAligner
+except (ImportError, OSError):
+    SswAligner = None
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class PairwiseAligner(object):
     """
     @class  PairwiseAligner
-    @brief  Require the third party package Biopython
+    @brief  Local Smith-Waterman alignment of adapters along reads. The ssw_wrap Aligner is used
+    when libssw.so is available, else the pure NumPy NumpyAligner. Only the best alignment of each
+    adapter is reported. The object also exposes set_ref and align and can thus be used as the
+    Aligner of an AdapterTrimmer.
     """
-    # TODO write a wrapper for an external faster SW aligner
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
     #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
@@ -19,53 +27,90 @@ class PairwiseAligner(object):
     def __str__(self):
         return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
 
-    def __init__ (self, max_alignment=5, match=2, mismatch=-2, open_gap=-2, extend_gap=-2, cutoff=1.5):
+    def __init__ (self, max_alignment=1, match=2, mismatch=-2, open_gap=-2, extend_gap=-2, cutoff=1.5, use_ssw=True):
         """
-        @param max_alignment Maximal number of alignement per read to output
+        @param max_alignment Deprecated. Only the best alignment is reported
         @param match Gain value in case match
         @param mismatch Penality value in case mismatch
         @param open_gap Penality value in case opening a gap
         @param extend_gap Penality value in case extending a gap
         @param cutoff Raw SW score divided by the lenght of the adapter
+        @param use_ssw Use the ssw library if available. If False the NumPy aligner is always used
         """
 
         # Store parameters in object variables
-        pairwise2.MAX_ALIGNMENTS = max_alignment
         self.match = match
         self.mismatch = mismatch
         self.open_gap = open_gap
         self.extend_gap = extend_gap
         self.cutoff = cutoff
 
+        # Both aligners expect absolute values of penalties
+        if use_ssw and SswAligner:
+            self.aligner = SswAligner(
+                match=match, mismatch=-mismatch, gap_open=-open_gap, gap_extend=-extend_gap)
+        else:
+            self.aligner = NumpyAligner(
+                match=match, mismatch=-mismatch, gap_open=-open_gap, gap_extend=-extend_gap)
+
     #~~~~~~~PUBLIC METHODS~~~~~~~#
 
-    def find_match (self, adapter, sequence):
+    def set_ref (self, ref_seq):
         """
-        Pairwise alignment using the buildin Biopython function pairwise2
+        Set the reference sequence of the underlying aligner
         """
+        self.aligner.set_ref(ref_seq)
 
-        # Perform a local SW alignment with specific penalties
-        match_list = pairwise2.align.localms(
-            adapter,
-            sequence,
-            self.match,
-            self.mismatch,
-            self.open_gap,
-            self.extend_gap)
+    def align (self, query_seq, min_score=0, min_len=0):
+        """
+        Align a query against the reference sequence with the underlying aligner
+        @return An alignment result object with at least score, ref_begin, ref_end, query_begin
+        and query_end fields or None in case of filtering out
+        """
+        return self.aligner.align(query_seq, min_score, min_len)
 
-        #for seqA, seqB, score, begin, end in match_list:
-            #if score/len(adapter) > self.cutoff:
-                #print("{}\n{}\nScore:{}\tBegin:{}\tEnd:{}".format(seqA, seqB, score, begin, end))
+    def find_match (self, adapter, sequence):
+        """
+        Find the best local alignment of the adapter along the sequence
+        @return A list containing the [begin, end] interval of the match along the sequence if its
+        score divided by the lenght of the adapter is higher than the cutoff, else an empty list
+        """
+        if not adapter or not sequence:
+            return []
+
+        self.aligner.set_ref(sequence)
+        match = self.aligner.align(adapter)
 
         # Return begin and end position if a match has a score higher than the cutoff value
-        return [[begin, end] for seqA, seqB, score, begin, end in match_list if score/len(adapter) > self.cutoff]
+        if match and float(match.score)/len(adapter) > self.cutoff:
+            return [[match.ref_begin, match.ref_end+1]]
+        return []
+
+    def find_match_batch (self, adapter, sequence_list):
+        """
+        Find the best local alignment of the adapter along each sequence of a list. With the NumPy
+        aligner all the pairs are aligned in a single vectorized batch
+        @return A list of find_match results, one per sequence
+        """
+        if not isinstance(self.aligner, NumpyAligner) or not adapter:
+            return [self.find_match(adapter, sequence) for sequence in sequence_list]
+
+        match_list = []
+        for sequence, (score, query_begin, query_end, ref_begin, ref_end) in zip (
+            sequence_list, self.aligner.align_batch([(adapter, seq) for seq in sequence_list])):
+
+            if sequence and float(score)/len(adapter) > self.cutoff:
+                match_list.append([[ref_begin, ref_end+1]])
+            else:
+                match_list.append([])
+
+        return match_list
 
     def get_report (self):
         """
         """
         report = "====== PAIRWISE ALIGNER ======\n\n"
-        report += "  Parameters of pairwise2\n"
-        report += "  Maximal number of alignement : {}\n".format(pairwise2.MAX_ALIGNMENTS)
+        report += "  Aligner : {}\n".format(self.aligner.__class__.__module__)
         report += "  Match bonus : {}\n".format(self.match)
         report += "  Mismatch Penality : {}\n".format(self.mismatch)
         report += "  Gap open Penality : {}\n".format(self.open_gap)
@@ -17,4 +17,4 @@ for NGS paired end data. Basically the top level function FastqFilter process fa
 * [Atlantic Gene Therapies - INSERM 1089] (http://www.atlantic-gene-therapies.fr/)
 """
 
-__all__ = ["PairwiseAligner", "AdapterTrimmer", "QualityFilter","FastqFilter"]
+__all__ = ["PairwiseAligner", "NumpyAligner", "AdapterTrimmer", "QualityFilter","FastqFilter"]
@@ -0,0 +1,243 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Standard library packages import
+import gzip
+from time import time
+
+# Third party package import
+from Bio import SeqIO
+
+# Local library packages import
+from pyDNA.Utilities import import_seq, file_basename, DNA_reverse_comp
+from Ssw.ssw_wrap import Aligner
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class HomologyFinder(object):
+    """
+    @class  HomologyFinder
+    @brief  Blast free search of homologies between query sequences and a subject reference,
+    intended for short queries (vectors, plasmids...) against small to medium references. The
+    subject is indexed with k-mers sampled every step positions. Query k-mers found in the index
+    are clustered by subject sequence and diagonal, and each cluster is extended by a Smith-Waterman
+    alignment of the query against the corresponding subject window with ssw_wrap. Both strands
+    of the queries are searched. Hits have the same interface as BlastHit so that they can be
+    passed directly to RefMasker.mask. No external program and no database are required.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "HOMOLOGY FINDER\n"
+        msg += "  Subject sequences : {}\tTotal length : {}\n".format(
+            len(self.subject), sum(len(seq) for seq in self.subject.values()))
+        msg += "  Kmer size : {}\tStep : {}\tIndexed kmers : {}\n".format(
+            self.kmer_size, self.step, len(self.index))
+        msg += "  Min seeds : {}\tMax occurence : {}\tFlank : {}\n".format(
+            self.min_seeds, self.max_occ, self.flank)
+        msg += "  Min score : {}\tMin len : {}\n".format(self.min_score, self.min_len)
+        msg += repr(self.aligner)
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __init__ (self, subject_fasta, kmer_size=15, step=5, min_seeds=2, max_occ=1000, flank=100,
+        match=2, mismatch=3, gap_open=7, gap_extend=2, min_score=60, min_len=30):
+        """
+        Import and index the subject sequences
+        @param subject_fasta Reference fasta file (can be gzipped)
+        @param kmer_size Size of the k-mers used as seeds
+        @param step Distance between consecutive k-mers indexed along the subject. Exact matches
+        longer than kmer_size + step - 1 are always seeded
+        @param min_seeds Minimal number of seeds in a cluster to trigger an alignment
+        @param max_occ k-mers more frequent in the index are ignored (repeats)
+        @param flank Length of subject added on both side of a cluster before alignment
+        @param match Weight for a match
+        @param mismatch Absolute value of mismatch penalty
+        @param gap_open Absolute value of gap open penalty (first base of the gap)
+        @param gap_extend Absolute value of gap extend penalty
+        @param min_score Minimal score of an alignment to be reported as a hit
+        @param min_len Minimal length of the query aligned to be reported as a hit
+        """
+        self.kmer_size = kmer_size
+        self.step = step
+        self.min_seeds = min_seeds
+        self.max_occ = max_occ
+        self.flank = flank
+        self.min_score = min_score
+        self.min_len = min_len
+
+        self.aligner = Aligner(match=match, mismatch=mismatch, gap_open=gap_open, gap_extend=gap_extend)
+
+        # Import subject sequences in uppercase strings
+        print ("Import and index the subject sequences")
+        start_time = time()
+        self.subject = {
+            seq_id: str(record.seq).upper() for seq_id, record in import_seq(subject_fasta).items()}
+
+        # Index sampled k-mers of the subject
+        self.index = {}
+        for seq_id, seq in self.subject.items():
+            for pos in xrange(0, len(seq)-kmer_size+1, step):
+                kmer = seq[pos:pos+kmer_size]
+                if "N" not in kmer:
+                    self.index.setdefault(kmer, []).append((seq_id, pos))
+
+        # Remove the repeated k-mers
+        for kmer in [kmer for kmer, pos_list in self.index.items() if len(pos_list) > max_occ]:
+            del self.index[kmer]
+
+        print ("{} k-mers indexed in {}s".format(len(self.index), round(time()-start_time, 2)))
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def find (self, query_fasta):
+        """
+        Search homologies of all sequences of a fasta file in the subject
+        @param query_fasta Path to a fasta file containing the query sequences (can be gzipped)
+        @return A list of HomologyHit objects
+        """
+        print ("Search homologies of {} in the subject sequences".format(file_basename(query_fasta))),
+
+        if query_fasta[-2:].lower() == "gz":
+            handle = gzip.open(query_fasta, "r")
+        else:
+            handle = open(query_fasta, "r")
+
+        hit_list = []
+        for record in SeqIO.parse(handle, "fasta"):
+            query = str(record.seq).upper()
+            hit_list.extend(self._find_strand(record.id, query, True))
+            hit_list.extend(self._find_strand(record.id, DNA_reverse_comp(query), False))
+
+        handle.close()
+        print ("\t{} hits found".format(len(hit_list)))
+        return hit_list
+
+    def find_all (self, query_list):
+        """
+        @param query_list List of paths of fasta files containing query sequences (can be gzipped)
+        @return A list of HomologyHit objects for all queries
+        """
+        hit_list = []
+        for query_fasta in query_list:
+            hit_list.extend(self.find(query_fasta))
+        return hit_list
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _find_strand (self, q_id, query, q_orient):
+        """
+        Seed, cluster and extend the hits of one strand of a query
+        """
+        query_len = len(query)
+
+        # Collect the diagonals (subject position - query position) of seeds per subject sequence
+        diagonals = {}
+        for pos in xrange(query_len-self.kmer_size+1):
+            for seq_id, s_pos in self.index.get(query[pos:pos+self.kmer_size], ()):
+                diagonals.setdefault(seq_id, []).append(s_pos-pos)
+
+        hit_list = []
+        hit_keys = set()
+        for seq_id, diag_list in diagonals.items():
+            for min_diag, max_diag in self._cluster(sorted(diag_list), query_len):
+
+                # Align the query on the subject window covering the cluster. The window is at
+                # most 2 query lengths plus the flanks
+                subject = self.subject[seq_id]
+                w_start = max(0, min_diag-self.flank)
+                w_end = min(len(subject), max_diag+query_len+self.flank)
+                self.aligner.set_ref(subject[w_start:w_end])
+                match = self.aligner.align(query, self.min_score, self.min_len)
+                if not match:
+                    continue
+
+                # Convert in 1-based blast like coordinates along the forward query strand
+                if q_orient:
+                    q_start, q_end = match.query_begin+1, match.query_end+1
+                else:
+                    q_start, q_end = query_len-match.query_end, query_len-match.query_begin
+
+                hit = HomologyHit(q_id, seq_id, q_start, q_end, w_start+match.ref_begin+1,
+                    w_start+match.ref_end+1, q_orient, match.score)
+
+                # Close clusters can give the same alignment
+                key = (seq_id, hit.q_start, hit.q_end, hit.s_start, hit.s_end)
+                if key not in hit_keys:
+                    hit_keys.add(key)
+                    hit_list.append(hit)
+
+        return hit_list
+
+    def _cluster (self, diag_list, max_span):
+        """
+        Group sorted diagonals separated by less than flank and yield the diagonal range of the
+        groups with at least min_seeds seeds. A group is also closed when its diagonals span more
+        than max_span, so that tandem repeats of the subject do not chain into a single huge
+        alignment window
+        """
+        first = prev = diag_list[0]
+        n_seed = 0
+        for diag in diag_list:
+            if diag - prev > self.flank or diag - first > max_span:
+                if n_seed >= self.min_seeds:
+                    yield first, prev
+                first = diag
+                n_seed = 0
+            prev = diag
+            n_seed += 1
+
+        if n_seed >= self.min_seeds:
+            yield first, prev
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class HomologyHit(object):
+    """
+    @class  HomologyHit
+    @brief  Hit found by HomologyFinder with the same coordinates fields as BlastHit. Coordinates
+    are 1-based and start is always smaller than end
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __init__(self, q_id, s_id, q_start, q_end, s_start, s_end, q_orient, score):
+        """
+        @param  q_id    Query sequence name
+        @param  s_id    Subject sequence name
+        @param  q_start Hit start position of the query
+        @param  q_end   Hit end position of the query
+        @param  s_start Hit start position of the subject
+        @param  s_end   Hit end position of the subject
+        @param  q_orient Orientation of the query along the hit. True if positive
+        @param  score Smith-Waterman score of the alignement
+        """
+        self.q_id = q_id
+        self.s_id = s_id
+        self.q_start = q_start
+        self.q_end = q_end
+        self.s_start = s_start
+        self.s_end = s_end
+        self.q_orient = q_orient
+        self.s_orient = True
+        self.length = s_end-s_start+1
+        self.score = score
+
+    def __eq__(self, other):
+        return (self.q_id, self.s_id, self.q_start, self.q_end, self.s_start, self.s_end, self.q_orient) == \
+            (other.q_id, other.s_id, other.q_start, other.q_end, other.s_start, other.s_end, other.q_orient)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        msg = "HIT"
+        msg += "\tQuery\t{}:{}-{}({})\n".format(self.q_id, self.q_start, self.q_end, "+" if self.q_orient else "-")
+        msg += "\tSubject\t{}:{}-{}(+)\n".format(self.s_id, self.s_start, self.s_end)
+        msg += "\tLenght : {}\tScore : {}\n".format(self.length, self.score)
+        return (msg)
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
@@ -0,0 +1,251 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Standard library packages import
+import os
+from os import path
+from errno import ESRCH
+from glob import glob
+from hashlib import sha1
+from shutil import rmtree
+from socket import gethostname
+from time import sleep
+
+# Local library packages import
+from pyDNA.Utilities import mkdir
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class IndexCache(object):
+    """
+    @class  IndexCache
+    @brief  Content addressed cache of reference indexes (blast databases, bwa indexes...). Each
+    build is stored in a sub directory of the cache named after a sha1 fingerprint of the
+    reference files content, the indexing tool and its options, so that the same reference is
+    indexed only once whatever its path. A lock file created atomically guards concurrent
+    builders of the same entry, including from other processes sharing the cache directory, and
+    completed builds are flagged by a marker file whose modification time records the last use.
+    Index files are named after the key so that indexes of different references never share a
+    basename (bwa shm identifies indexes by basename). Each process getting an entry registers
+    itself as a reader of the entry until it exits or releases it. When the cache exceeds max_size
+    the least recently used entries without readers are evicted.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS FIELDS~~~~~~~#
+
+    # Marker file of completed entries
+    complete = ".complete"
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        entries = self._entries()
+        msg = "INDEX CACHE\n"
+        msg += "  Cache directory : {}\n".format(self.cache_dir)
+        msg += "  Entries : {}\tSize : {}\tMax size : {}\n".format(
+            len(entries), sum(size for key, size, last_use in entries), self.max_size or "unlimited")
+        return msg
+
+    def __str__(self):
+        return "<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __init__ (self, cache_dir, max_size=0, poll_interval=10):
+        """
+        @param cache_dir Directory where to store the cached indexes. Created if needed
+        @param max_size Maximal size of the cache in bytes. 0 = no eviction
+        @param poll_interval Time in seconds between 2 checks when waiting for another builder
+        """
+        self.cache_dir = mkdir(cache_dir)
+        self.max_size = max_size
+        self.poll_interval = poll_interval
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def fingerprint (self, ref_list, tool, options=""):
+        """
+        @param ref_list List of paths of the reference files (the order matters)
+        @param tool Name of the indexing tool
+        @param options Command line options of the tool as a string. Output path options should
+        not be included
+        @return A sha1 hexadecimal digest of the content of the files, the tool and the options
+        """
+        h = sha1()
+        h.update("{}\n{}\n".format(tool, " ".join(options.split())))
+        for ref in ref_list:
+            with open(ref, "rb") as f:
+                for block in iter(lambda: f.read(1048576), ""):
+                    h.update(block)
+            h.update("\n")
+        return h.hexdigest()
+
+    def get (self, key, build):
+        """
+        Return the index path of a completed entry, building it first if needed
+        @param key Fingerprint of the entry as returned by fingerprint
+        @param build Function taking the index path (basename of the index files to create) as
+        argument and creating the index. The entry is discarded if it raises an exception
+        @return The index path of the entry
+        """
+        entry_dir = path.join(self.cache_dir, key)
+        index_path = path.join(entry_dir, key)
+
+        while not self._is_complete(key):
+
+            # Only the owner of the lock builds the entry, the others wait for its completion
+            if self._lock(key):
+                try:
+                    if self._is_complete(key):
+                        break
+                    print ("Build cache entry {}".format(key))
+                    if path.isdir(entry_dir):
+                        rmtree(entry_dir)
+                    os.mkdir(entry_dir)
+                    try:
+                        build(index_path)
+                    except:
+                        rmtree(entry_dir, ignore_errors=True)
+                        raise
+                    open(path.join(entry_dir, self.complete), "w").close()
+                finally:
+                    self._unlock(key)
+            else:
+                print ("Wait for another process building cache entry {}".format(key))
+                sleep(self.poll_interval)
+
+        # Protect the entry from eviction by other processes while this process uses it
+        print ("Use cache entry {}".format(key))
+        open(self._reader_path(key), "w").close()
+        os.utime(path.join(entry_dir, self.complete), None)
+        self.evict(keep=key)
+        return index_path
+
+    def release (self, key):
+        """
+        Unregister the current process as a reader of an entry, which can then be evicted. Readers
+        are also released automatically once their process is not running anymore
+        @param key Fingerprint of the entry
+        """
+        try:
+            os.remove(self._reader_path(key))
+        except OSError:
+            pass
+
+    def evict (self, keep=None):
+        """
+        Remove the least recently used completed entries until the cache size is below max_size.
+        Entries being built or used by a running process are never removed
+        @param keep Key of an entry that should not be removed
+        @return The list of keys removed
+        """
+        if not self.max_size:
+            return []
+
+        entries = self._entries()
+        total = sum(size for key, size, last_use in entries)
+        removed = []
+
+        for key, size, last_use in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_size:
+                break
+            if key == keep or path.exists(self._lock_path(key)) or self._in_use(key):
+                continue
+            print ("Evict cache entry {}".format(key))
+            rmtree(path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+
+        return removed
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _is_complete (self, key):
+        return path.isfile(path.join(self.cache_dir, key, self.complete))
+
+    def _lock_path (self, key):
+        return path.join(self.cache_dir, key+".lock")
+
+    def _reader_path (self, key):
+        return path.join(self.cache_dir, "{}.{}.{}.reader".format(key, gethostname(), os.getpid()))
+
+    def _in_use (self, key):
+        """
+        @return True if the entry has a reader still running. Readers of dead processes of this
+        host are removed
+        """
+        in_use = False
+        for reader in glob(path.join(self.cache_dir, key+".*.reader")):
+            host, pid = path.basename(reader)[len(key)+1:-len(".reader")].rsplit(".", 1)
+            if self._is_dead(host, pid):
+                try:
+                    os.remove(reader)
+                except OSError:
+                    pass
+            else:
+                in_use = True
+        return in_use
+
+    def _lock (self, key):
+        """
+        Try to create the lock file of an entry. A lock left by a dead process of the same host is
+        removed
+        @return True if the lock was acquired
+        """
+        lock_path = self._lock_path(key)
+        try:
+            fd = os.open(lock_path, os.O_CREAT|os.O_EXCL|os.O_WRONLY)
+        except OSError:
+            if self._is_stale(lock_path):
+                print ("Remove stale lock {}".format(lock_path))
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+            return False
+
+        os.write(fd, "{} {}\n".format(gethostname(), os.getpid()))
+        os.close(fd)
+        return True
+
+    def _unlock (self, key):
+        try:
+            os.remove(self._lock_path(key))
+        except OSError:
+            pass
+
+    def _is_stale (self, lock_path):
+        """
+        @return True if the lock was created by a process of this host which is not running anymore
+        """
+        try:
+            with open(lock_path, "r") as f:
+                host, pid = f.read().split()
+        except (IOError, ValueError):
+            # Lock being written or already removed
+            return False
+
+        return self._is_dead(host, pid)
+
+    def _is_dead (self, host, pid):
+        """
+        @return True if pid is a process of this host which is not running anymore. A process of
+        another user (EPERM) is running
+        """
+        if host != gethostname():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except OSError as E:
+            return E.errno == ESRCH
+        return False
+
+    def _entries (self):
+        """
+        @return A list of (key, size in bytes, last use time) of completed entries
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = path.join(self.cache_dir, key)
+            if path.isdir(entry_dir) and self._is_complete(key):
+                size = sum(path.getsize(path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+                last_use = path.getmtime(path.join(entry_dir, self.complete))
+                entries.append((key, size, last_use))
+        return entries
@@ -4,16 +4,22 @@
 
 # Standard library packages import
 from os import remove, path
+from mmap import mmap
+from shutil import copyfile
 import gzip
 from time import time
 from sys import stdout
 
 # Third party package import
 from Bio import SeqIO
+from Bio.Seq import Seq
 
 # Local library packages import
-from pyDNA.Utilities import import_seq, file_basename, mkdir
+from pyDNA.Utilities import import_seq, file_basename, mkdir, merge_intervals, fasta_index
 from Blast import Blastn
+from Blast.MaskIntervals import MaskIntervals
+from Blast.HitTable import HitTable
+from Blast.HitIndex import HitIndex
 
 #~~~~~~~MAIN METHODS~~~~~~~#
 
@@ -27,24 +33,17 @@ def mask (  subject_fasta,
     the modified fasta sequence in a new file.
     @param subject_fasta Fasta sequence of the subject to edit (can be gzipped)
     @param hit_list List of hit objects. Hits need at least 3 fields named s_id, s_start and s_end
-    coresponding to the name of the sequence matched, and the hit start/end (0 based).
+    coresponding to the name of the sequence matched, and the hit start/end (0 based). A
+    MaskIntervals object (as returned by Blastn.align_intervals) or a HitTable is also accepted.
     @param ref_outdir Directory where the masked reference will be created
     @param ref_outname Name of the masked reference
     @param compress_ouput If true the output will be gzipped
     @return A path to the modified sequence if the hit list was valid.
     """
 
-    # Test if object the first object of hit_list have the require s_id, s_start and s_end fields
-    try:
-        a = hit_list[0].s_id
-        a = hit_list[0].s_start
-        a = hit_list[0].s_end
-
-    except IndexError:
-        print ("No hit found, The subject fasta file will not be edited")
-        return subject_fasta
-    except AttributeError as E:
-        print ("The list provided does not contain suitable hit object, The subject fasta file will not be edited")
+    # Group the hit intervals by subject sequence
+    hit_dict = _hit_dict(hit_list)
+    if hit_dict is None:
         return subject_fasta
 
     # Initialize output folder
@@ -64,9 +63,6 @@ def mask (  subject_fasta,
         ref_path = path.join (ref_outdir, ref_outname)
         out_handle = open(ref_path, 'w')
 
-    # Generate a list of ref that will need to be modified
-    id_list = {hit.s_id:0 for hit in hit_list}.keys()
-
     # Iterate over record in the subject fasta file
     print ("Masking hit positions and writting a new reference for {} ".format(ref_outname))
     i=j=0
@@ -77,19 +73,20 @@ def mask (  subject_fasta,
         stdout.flush()
 
         # Check if the record is in the list of record to modify
-        if record.id in id_list:
+        if record.id in hit_dict:
             i+=1
             #~print ("Hit found in {}. Editing the sequence".format(record.id))
-            # Casting Seq type to MutableSeq Type to allow string editing
-            record.seq = record.seq.tomutable()
+            # Casting Seq type to bytearray to allow bulk string editing
+            seq = bytearray(str(record.seq))
+            seq_len = len(seq)
 
-            # For each hit in the list of hit found
-            for hit in hit_list:
-                if record.id == hit.s_id:
+            # Replace all positions between start and end coordinates of merged hits by N
+            for start, end in merge_intervals(hit_dict[record.id]):
+                start, end = max(start, 0), min(end, seq_len)
+                if start < end:
+                    seq[start:end] = 'n'*(end-start)
 
-                    # For all position between start and end coordinates modify the base by N
-                    for position in range (hit.s_start, hit.s_end):
-                        record.seq[position]= 'n'
+            record.seq = Seq(str(seq))
         else:
             j+=1
             #~print ("No hit found in {}".format(record.id))
@@ -104,3 +101,111 @@ def mask (  subject_fasta,
     in_handle.close()
     out_handle.close()
     return ref_path
+
+def mask_inplace (  subject_fasta,
+                    hit_list,
+                    ref_outdir="./references/",
+                    ref_outname="masked_ref.fa"):
+    """
+    Copy an uncompressed reference fasta file and mask positions indicated by hits directly in a
+    memory map of the copy. The file is copied without being parsed and the positions of hits are
+    located with a faidx index (the .fai file is used if available), so that the masking time
+    depends on the number of masked bases rather than on the size of the reference. Contrary to
+    mask, the line length and headers of the original file are preserved.
+    @param subject_fasta Uncompressed fasta sequence of the subject to edit. Compressed files are
+    masked with mask instead
+    @param hit_list List of hit objects or MaskIntervals object as for mask
+    @param ref_outdir Directory where the masked reference will be created
+    @param ref_outname Name of the masked reference
+    @return A path to the modified sequence if the hit list was valid.
+    @exception ValueError Raise if lines of a sequence do not have the same length
+    """
+    # The memory map requires an uncompressed file
+    if subject_fasta[-2:].lower() == "gz":
+        print ("Compressed reference, the whole reference will be parsed to be masked")
+        return mask(subject_fasta, hit_list, ref_outdir, ref_outname, compress_ouput=True)
+
+    # Group the hit intervals by subject sequence
+    hit_dict = _hit_dict(hit_list)
+    if hit_dict is None:
+        return subject_fasta
+
+    # Index the reference before copying it
+    print ("Masking hit positions in place in a copy of the reference for {} ".format(ref_outname))
+    start_time = time()
+    index = fasta_index(subject_fasta)
+
+    mkdir(ref_outdir)
+    ref_path = path.join (ref_outdir, ref_outname)
+    copyfile(subject_fasta, ref_path)
+
+    i = n_base = 0
+    with open(ref_path, "r+b") as fp:
+        mm = mmap(fp.fileno(), 0)
+
+        for s_id, interval_list in hit_dict.items():
+            # Skip the hits on sequences absent from the reference
+            if s_id not in index:
+                continue
+            i+=1
+            length, offset, line_bases, line_width = index[s_id]
+
+            for start, end in merge_intervals(interval_list):
+                start, end = max(start, 0), min(end, length)
+                n_base += max(end-start, 0)
+
+                # Overwrite the bases line by line
+                while start < end:
+                    line_end = min(end, (start//line_bases+1)*line_bases)
+                    file_start = offset + start//line_bases*line_width + start%line_bases
+                    mm[file_start:file_start+line_end-start] = 'n'*(line_end-start)
+                    start = line_end
+
+        mm.flush()
+        mm.close()
+
+    # Report informations
+    print("{} sequence(s) from {} modified ({} bases masked) in {}s".format(
+        i, ref_outname, n_base, round(time()-start_time, 2)))
+    return ref_path
+
+#~~~~~~~PRIVATE METHODS~~~~~~~#
+
+def _hit_dict (hit_list):
+    """
+    Group the intervals of a list of hits, a MaskIntervals or a HitTable by subject sequence
+    @return A dictionnary of list of (start, end) intervals per subject sequence or None if the
+    hit list is empty or invalid
+    """
+    # Intervals already grouped by subject sequence and merged
+    if isinstance(hit_list, MaskIntervals):
+        if not hit_list:
+            print ("No hit found, The subject fasta file will not be edited")
+            return None
+        hit_dict = hit_list.get_dict()
+
+    # Columnar hit table
+    elif isinstance(hit_list, HitTable):
+        if not hit_list:
+            print ("No hit found, The subject fasta file will not be edited")
+            return None
+        hit_dict = hit_list.interval_dict()
+
+    # Test if object the first object of hit_list have the require s_id, s_start and s_end fields
+    else:
+        try:
+            a = hit_list[0].s_id
+            a = hit_list[0].s_start
+            a = hit_list[0].s_end
+
+        except IndexError:
+            print ("No hit found, The subject fasta file will not be edited")
+            return None
+        except AttributeError as E:
+            print ("The list provided does not contain suitable hit object, The subject fasta file will not be edited")
+            return None
+
+        # Group and merge the hit intervals by reference sequence that will need to be modified
+        hit_dict = HitIndex(hit_list).interval_dict()
+
+    return hit_dict
@@ -56,7 +56,8 @@ def align (opt):
         gap_open=int(opt.gap_open),
         gap_extend= int(opt.gap_extend),
         report_secondary=False,
-        report_cigar=True)
+        report_cigar=True,
+        cache_size=int(opt.cache_size))
 
     # Write the header of the SAM file
     with open("result.sam", "w") as f:
@@ -113,6 +114,8 @@ def align (opt):
                 print ("{} sequences \t{}% \tRemaining time = {}s".format(i, int(frac*100), round(t/frac-t, 2)))
 
         print ("\n{} Sequences processed in {}s".format(i, round(time()-start, 2)))
+        if ssw.cache is not None:
+            print (repr(ssw.cache))
 
 #~~~~~~~HELPER FUNCTIONS~~~~~~~#
 
@@ -236,6 +239,8 @@ def optparser():
     optparser.add_option( '-r', '--reverse', dest="reverse", action="store_true", default=True, help=hstr)
     hstr = "Flag. Write unaligned reads in sam output [Unset by default]"
     optparser.add_option( '-u', '--unaligned', dest="unaligned", action="store_true", default=False, help=hstr)
+    hstr = "Integer. Maximal number of alignment results memoized for duplicated reads. 0 = no cache [default: 0]"
+    optparser.add_option( '-c', '--cache_size', dest="cache_size", default=0, help=hstr)
 
     # Parse arg and return a dictionnary_like object of options
     opt, args = optparser.parse_args()
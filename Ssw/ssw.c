@@ -43,6 +43,14 @@
 #include <math.h>
 #include "ssw.h"
 
+/* AVX2 kernels are compiled with a function target attribute and selected at runtime, so the
+   library does not need to be built with -mavx2 and still runs on SSE2 only CPUs. */
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__)) && (__GNUC__ > 4 || (__GNUC__ == 4 && __GNUC_MINOR__ >= 9))
+#define SSW_AVX2 1
+#include <immintrin.h>
+#define AVX2_TARGET __attribute__((target("avx2")))
+#endif
+
 #ifdef __GNUC__
 #define LIKELY(x) __builtin_expect((x),1)
 #define UNLIKELY(x) __builtin_expect((x),0)
@@ -76,13 +84,14 @@ typedef struct {
 } cigar;
 
 struct _profile{
-	__m128i* profile_byte;	// 0: none
-	__m128i* profile_word;	// 0: none
+	void* profile_byte;	// 0: none; __m256i* if avx2 else __m128i*
+	void* profile_word;	// 0: none; __m256i* if avx2 else __m128i*
 	const int8_t* read;
 	const int8_t* mat;
 	int32_t readLen;
 	int32_t n;
 	uint8_t bias;
+	uint8_t avx2;	// 1: profiles were built for the AVX2 kernels
 };
 
 /* Generate query profile rearrange query sequence & calculate the weight of match/mismatch. */
@@ -237,7 +246,7 @@ static alignment_end* sw_sse2_byte (const int8_t* ref,
 			vH = _mm_load_si128(pvHLoad + j);
 		}
 
-		/* Lazy_F loop: has been revised to disallow adjecent insertion and then deletion, so don't update E(i, j), learn from SWPS3 */
+		/* Lazy_F loop: corrected H values also update E(i, j), so that the scores do not depend on the vector width */
         /* reset pointers to the start of the saved data */
         j = 0;
         vH = _mm_load_si128 (pvHStore + j);
@@ -256,6 +265,8 @@ static alignment_end* sw_sse2_byte (const int8_t* ref,
             vH = _mm_max_epu8 (vH, vF);
 			vMaxColumn = _mm_max_epu8(vMaxColumn, vH);
             _mm_store_si128 (pvHStore + j, vH);
+			e = _mm_max_epu8(_mm_load_si128(pvE + j), _mm_subs_epu8(vH, vGapO));
+			_mm_store_si128(pvE + j, e);
             vF = _mm_subs_epu8 (vF, vGapE);
             j++;
             if (j >= segLen)
@@ -464,16 +475,22 @@ static alignment_end* sw_sse2_word (const int8_t* ref,
 			vH = _mm_load_si128(pvHLoad + j);
 		}
 
-		/* Lazy_F loop: has been revised to disallow adjecent insertion and then deletion, so don't update E(i, j), learn from SWPS3 */
+		/* Lazy_F loop: corrected H values also update E(i, j), so that the scores do not depend on the vector width */
 		for (k = 0; LIKELY(k < 8); ++k) {
 			vF = _mm_slli_si128 (vF, 2);
 			for (j = 0; LIKELY(j < segLen); ++j) {
 				vH = _mm_load_si128(pvHStore + j);
 				vH = _mm_max_epi16(vH, vF);
+				vMaxColumn = _mm_max_epi16(vMaxColumn, vH); /* lazy-F corrections can hold the column max */
 				_mm_store_si128(pvHStore + j, vH);
 				vH = _mm_subs_epu16(vH, vGapO);
+				e = _mm_max_epi16(_mm_load_si128(pvE + j), vH);
+				_mm_store_si128(pvE + j, e);
 				vF = _mm_subs_epu16(vF, vGapE);
-				if (UNLIKELY(! _mm_movemask_epi8(_mm_cmpgt_epi16(vF, vH)))) goto end;
+				if (j + 1 == segLen) break;
+				/* F can only change the next H if it beats the gap opened from it */
+				vTemp = _mm_subs_epu16(_mm_load_si128(pvHStore + j + 1), vGapO);
+				if (UNLIKELY(! _mm_movemask_epi8(_mm_cmpgt_epi16(vF, vTemp)))) goto end;
 			}
 		}
 
@@ -545,6 +562,503 @@ end:
 	return bests;
 }
 
+#ifdef SSW_AVX2
+
+/* Shift the 256-bit value in v left by 1 or 2 bytes across the two 128-bit lanes. */
+#define slli1_avx2(v) _mm256_alignr_epi8((v), _mm256_permute2x128_si256((v), (v), 0x08), 15)
+#define slli2_avx2(v) _mm256_alignr_epi8((v), _mm256_permute2x128_si256((v), (v), 0x08), 14)
+
+/* Allocate a zeroed buffer of 256 bit vectors aligned for _mm256_load_si256. */
+static __m256i* calloc_avx2 (int32_t n) {
+	void* p = 0;
+	if (posix_memalign(&p, 32, n * sizeof(__m256i)) != 0) return 0;
+	memset(p, 0, n * sizeof(__m256i));
+	return (__m256i*)p;
+}
+
+/* Lane mask of the rows computed by the SSE2 kernel (read rounded up to sseLanes rows). The
+   extra rows of the wider AVX2 registers must not contribute to the column maxima, so that the
+   scores and positions are the same as with the SSE2 kernel. */
+static __m256i* row_mask_avx2 (int32_t readLen, int32_t segLen, int32_t lanes, int32_t sseLanes, int32_t width) {
+	int32_t sseLen = (readLen + sseLanes - 1) / sseLanes * sseLanes;
+	__m256i* vMask = calloc_avx2(segLen);
+	uint8_t* t = (uint8_t*)vMask;
+	int32_t i, segNum;
+	for (i = 0; i < segLen; i ++) {
+		for (segNum = 0; segNum < lanes; segNum ++) {
+			memset(t, segNum * segLen + i < sseLen ? 0xff : 0, width);
+			t += width;
+		}
+	}
+	return vMask;
+}
+
+/* AVX2 version of qP_byte: the read is split into 32 segments. */
+AVX2_TARGET static __m256i* qP_byte_avx2 (const int8_t* read_num,
+				  const int8_t* mat,
+				  const int32_t readLen,
+				  const int32_t n,	/* the edge length of the squre matrix mat */
+				  uint8_t bias) {
+
+	int32_t segLen = (readLen + 31) / 32;
+	__m256i* vProfile = calloc_avx2(n * segLen);
+	int8_t* t = (int8_t*)vProfile;
+	int32_t nt, i, j, segNum;
+
+	for (nt = 0; LIKELY(nt < n); nt ++) {
+		for (i = 0; i < segLen; i ++) {
+			j = i;
+			for (segNum = 0; LIKELY(segNum < 32) ; segNum ++) {
+				*t++ = j>= readLen ? bias : mat[nt * n + read_num[j]] + bias;
+				j += segLen;
+			}
+		}
+	}
+	return vProfile;
+}
+
+/* AVX2 version of sw_sse2_byte: 32 cells of 8 bits are computed in parallel. */
+AVX2_TARGET static alignment_end* sw_avx2_byte (const int8_t* ref,
+							 int8_t ref_dir,	// 0: forward ref; 1: reverse ref
+							 int32_t refLen,
+							 int32_t readLen,
+							 const uint8_t weight_gapO, /* will be used as - */
+							 const uint8_t weight_gapE, /* will be used as - */
+							 const __m256i* vProfile,
+							 uint8_t terminate,	/* the best alignment score: used to terminate
+												   the matrix calculation when locating the
+												   alignment beginning point. If this score
+												   is set to 0, it will not be used */
+	 						 uint8_t bias,  /* Shift 0 point to a positive value. */
+							 int32_t maskLen) {
+
+#define max32(m, vm) (vm) = _mm256_max_epu8((vm), _mm256_permute2x128_si256((vm), (vm), 0x01)); \
+					  (vm) = _mm256_max_epu8((vm), _mm256_srli_si256((vm), 8)); \
+					  (vm) = _mm256_max_epu8((vm), _mm256_srli_si256((vm), 4)); \
+					  (vm) = _mm256_max_epu8((vm), _mm256_srli_si256((vm), 2)); \
+					  (vm) = _mm256_max_epu8((vm), _mm256_srli_si256((vm), 1)); \
+					  (m) = _mm_extract_epi16(_mm256_castsi256_si128(vm), 0)
+
+	uint8_t max = 0;		                     /* the max alignment score */
+	int32_t end_read = readLen - 1;
+	int32_t end_ref = -1; /* 0_based best alignment ending point; Initialized as isn't aligned -1. */
+	int32_t segLen = (readLen + 31) / 32; /* number of segment */
+
+	/* array to record the largest score of each reference position */
+	uint8_t* maxColumn = (uint8_t*) calloc(refLen, 1);
+
+	/* Define 32 byte 0 vector. */
+	__m256i vZero = _mm256_setzero_si256();
+
+	__m256i* pvHStore = calloc_avx2(segLen);
+	__m256i* pvHLoad = calloc_avx2(segLen);
+	__m256i* pvE = calloc_avx2(segLen);
+	__m256i* pvHmax = calloc_avx2(segLen);
+	__m256i* pvMask = row_mask_avx2(readLen, segLen, 32, 16, 1);
+
+	int32_t i, j;
+	__m256i vGapO = _mm256_set1_epi8(weight_gapO);
+	__m256i vGapE = _mm256_set1_epi8(weight_gapE);
+	__m256i vBias = _mm256_set1_epi8(bias);
+
+	__m256i vMaxScore = vZero; /* Trace the highest score of the whole SW matrix. */
+	__m256i vMaxMark = vZero; /* Trace the highest score till the previous column. */
+	__m256i vTemp;
+	int32_t edge, begin = 0, end = refLen, step = 1;
+
+	/* outer loop to process the reference sequence */
+	if (ref_dir == 1) {
+		begin = refLen - 1;
+		end = -1;
+		step = -1;
+	}
+	for (i = begin; LIKELY(i != end); i += step) {
+		uint32_t cmp;
+		__m256i e, vF = vZero, vMaxColumn = vZero;
+
+		__m256i vH = pvHStore[segLen - 1];
+		vH = slli1_avx2 (vH);
+		const __m256i* vP = vProfile + ref[i] * segLen; /* Right part of the vProfile */
+
+		/* Swap the 2 H buffers. */
+		__m256i* pv = pvHLoad;
+		pvHLoad = pvHStore;
+		pvHStore = pv;
+
+		/* inner loop to process the query sequence */
+		for (j = 0; LIKELY(j < segLen); ++j) {
+			vH = _mm256_adds_epu8(vH, _mm256_load_si256(vP + j));
+			vH = _mm256_subs_epu8(vH, vBias); /* vH will be always > 0 */
+
+			/* Get max from vH, vE and vF. */
+			e = _mm256_load_si256(pvE + j);
+			vH = _mm256_max_epu8(vH, e);
+			vH = _mm256_max_epu8(vH, vF);
+			vMaxColumn = _mm256_max_epu8(vMaxColumn, _mm256_and_si256(vH, pvMask[j]));
+
+			/* Save vH values. */
+			_mm256_store_si256(pvHStore + j, vH);
+
+			/* Update vE value. */
+			vH = _mm256_subs_epu8(vH, vGapO); /* saturation arithmetic, result >= 0 */
+			e = _mm256_subs_epu8(e, vGapE);
+			e = _mm256_max_epu8(e, vH);
+			_mm256_store_si256(pvE + j, e);
+
+			/* Update vF value. */
+			vF = _mm256_subs_epu8(vF, vGapE);
+			vF = _mm256_max_epu8(vF, vH);
+
+			/* Load the next vH. */
+			vH = _mm256_load_si256(pvHLoad + j);
+		}
+
+		/* Lazy_F loop: same as in sw_sse2_byte */
+		j = 0;
+		vH = _mm256_load_si256 (pvHStore + j);
+		vF = slli1_avx2 (vF);
+		vTemp = _mm256_subs_epu8 (vH, vGapO);
+		vTemp = _mm256_subs_epu8 (vF, vTemp);
+		vTemp = _mm256_cmpeq_epi8 (vTemp, vZero);
+		cmp  = (uint32_t)_mm256_movemask_epi8 (vTemp);
+
+		while (cmp != 0xffffffff)
+		{
+			vH = _mm256_max_epu8 (vH, vF);
+			vMaxColumn = _mm256_max_epu8(vMaxColumn, _mm256_and_si256(vH, pvMask[j]));
+			_mm256_store_si256 (pvHStore + j, vH);
+			e = _mm256_max_epu8(_mm256_load_si256(pvE + j), _mm256_subs_epu8(vH, vGapO));
+			_mm256_store_si256(pvE + j, e);
+			vF = _mm256_subs_epu8 (vF, vGapE);
+			j++;
+			if (j >= segLen)
+			{
+				j = 0;
+				vF = slli1_avx2 (vF);
+			}
+			vH = _mm256_load_si256 (pvHStore + j);
+
+			vTemp = _mm256_subs_epu8 (vH, vGapO);
+			vTemp = _mm256_subs_epu8 (vF, vTemp);
+			vTemp = _mm256_cmpeq_epi8 (vTemp, vZero);
+			cmp  = (uint32_t)_mm256_movemask_epi8 (vTemp);
+		}
+
+		vMaxScore = _mm256_max_epu8(vMaxScore, vMaxColumn);
+		vTemp = _mm256_cmpeq_epi8(vMaxMark, vMaxScore);
+		cmp = (uint32_t)_mm256_movemask_epi8(vTemp);
+		if (cmp != 0xffffffff) {
+			uint8_t temp;
+			vMaxMark = vMaxScore;
+			max32(temp, vMaxScore);
+			vMaxScore = vMaxMark;
+
+			if (LIKELY(temp > max)) {
+				max = temp;
+				if (max + bias >= 255) break;	//overflow
+				end_ref = i;
+
+				/* Store the column with the highest alignment score in order to trace the alignment ending position on read. */
+				for (j = 0; LIKELY(j < segLen); ++j) pvHmax[j] = pvHStore[j];
+			}
+		}
+
+		/* Record the max score of current column. */
+		max32(maxColumn[i], vMaxColumn);
+		if (maxColumn[i] == terminate) break;
+	}
+
+	/* Trace the alignment ending position on read. */
+	uint8_t *t = (uint8_t*)pvHmax;
+	uint8_t *m = (uint8_t*)pvMask;
+	int32_t column_len = segLen * 32;
+	for (i = 0; LIKELY(i < column_len); ++i, ++t, ++m) {
+		int32_t temp;
+		if (*t == max && *m) {
+			temp = i / 32 + i % 32 * segLen;
+			if (temp < end_read) end_read = temp;
+		}
+	}
+
+	free(pvMask);
+	free(pvHmax);
+	free(pvE);
+	free(pvHLoad);
+	free(pvHStore);
+
+	/* Find the most possible 2nd best alignment. */
+	alignment_end* bests = (alignment_end*) calloc(2, sizeof(alignment_end));
+	bests[0].score = max + bias >= 255 ? 255 : max;
+	bests[0].ref = end_ref;
+	bests[0].read = end_read;
+
+	bests[1].score = 0;
+	bests[1].ref = 0;
+	bests[1].read = 0;
+
+	edge = (end_ref - maskLen) > 0 ? (end_ref - maskLen) : 0;
+	for (i = 0; i < edge; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+	edge = (end_ref + maskLen) > refLen ? refLen : (end_ref + maskLen);
+	for (i = edge + 1; i < refLen; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+
+	free(maxColumn);
+	return bests;
+}
+
+/* AVX2 version of qP_word: the read is split into 16 segments. */
+AVX2_TARGET static __m256i* qP_word_avx2 (const int8_t* read_num,
+				  const int8_t* mat,
+				  const int32_t readLen,
+				  const int32_t n) {
+
+	int32_t segLen = (readLen + 15) / 16;
+	__m256i* vProfile = calloc_avx2(n * segLen);
+	int16_t* t = (int16_t*)vProfile;
+	int32_t nt, i, j;
+	int32_t segNum;
+
+	for (nt = 0; LIKELY(nt < n); nt ++) {
+		for (i = 0; i < segLen; i ++) {
+			j = i;
+			for (segNum = 0; LIKELY(segNum < 16) ; segNum ++) {
+				*t++ = j>= readLen ? 0 : mat[nt * n + read_num[j]];
+				j += segLen;
+			}
+		}
+	}
+	return vProfile;
+}
+
+/* AVX2 version of sw_sse2_word: 16 cells of 16 bits are computed in parallel. */
+AVX2_TARGET static alignment_end* sw_avx2_word (const int8_t* ref,
+							 int8_t ref_dir,	// 0: forward ref; 1: reverse ref
+							 int32_t refLen,
+							 int32_t readLen,
+							 const uint8_t weight_gapO, /* will be used as - */
+							 const uint8_t weight_gapE, /* will be used as - */
+							 const __m256i* vProfile,
+							 uint16_t terminate,
+							 int32_t maskLen) {
+
+#define max16w(m, vm) (vm) = _mm256_max_epi16((vm), _mm256_permute2x128_si256((vm), (vm), 0x01)); \
+					(vm) = _mm256_max_epi16((vm), _mm256_srli_si256((vm), 8)); \
+					(vm) = _mm256_max_epi16((vm), _mm256_srli_si256((vm), 4)); \
+					(vm) = _mm256_max_epi16((vm), _mm256_srli_si256((vm), 2)); \
+					(m) = _mm_extract_epi16(_mm256_castsi256_si128(vm), 0)
+
+	uint16_t max = 0;		                     /* the max alignment score */
+	int32_t end_read = readLen - 1;
+	int32_t end_ref = 0; /* 1_based best alignment ending point; Initialized as isn't aligned - 0. */
+	int32_t segLen = (readLen + 15) / 16; /* number of segment */
+
+	/* array to record the largest score of each reference position */
+	uint16_t* maxColumn = (uint16_t*) calloc(refLen, 2);
+
+	/* Define 32 byte 0 vector. */
+	__m256i vZero = _mm256_setzero_si256();
+
+	__m256i* pvHStore = calloc_avx2(segLen);
+	__m256i* pvHLoad = calloc_avx2(segLen);
+	__m256i* pvE = calloc_avx2(segLen);
+	__m256i* pvHmax = calloc_avx2(segLen);
+	__m256i* pvMask = row_mask_avx2(readLen, segLen, 16, 8, 2);
+
+	int32_t i, j, k;
+	__m256i vGapO = _mm256_set1_epi16(weight_gapO);
+	__m256i vGapE = _mm256_set1_epi16(weight_gapE);
+
+	__m256i vMaxScore = vZero; /* Trace the highest score of the whole SW matrix. */
+	__m256i vMaxMark = vZero; /* Trace the highest score till the previous column. */
+	__m256i vTemp;
+	int32_t edge, begin = 0, end = refLen, step = 1;
+
+	/* outer loop to process the reference sequence */
+	if (ref_dir == 1) {
+		begin = refLen - 1;
+		end = -1;
+		step = -1;
+	}
+	for (i = begin; LIKELY(i != end); i += step) {
+		uint32_t cmp;
+		__m256i e, vF = vZero;
+		__m256i vH = pvHStore[segLen - 1];
+		vH = slli2_avx2 (vH);
+
+		/* Swap the 2 H buffers. */
+		__m256i* pv = pvHLoad;
+
+		__m256i vMaxColumn = vZero; /* vMaxColumn is used to record the max values of column i. */
+
+		const __m256i* vP = vProfile + ref[i] * segLen; /* Right part of the vProfile */
+		pvHLoad = pvHStore;
+		pvHStore = pv;
+
+		/* inner loop to process the query sequence */
+		for (j = 0; LIKELY(j < segLen); j ++) {
+			vH = _mm256_adds_epi16(vH, _mm256_load_si256(vP + j));
+
+			/* Get max from vH, vE and vF. */
+			e = _mm256_load_si256(pvE + j);
+			vH = _mm256_max_epi16(vH, e);
+			vH = _mm256_max_epi16(vH, vF);
+			vMaxColumn = _mm256_max_epi16(vMaxColumn, _mm256_and_si256(vH, pvMask[j]));
+
+			/* Save vH values. */
+			_mm256_store_si256(pvHStore + j, vH);
+
+			/* Update vE value. */
+			vH = _mm256_subs_epu16(vH, vGapO); /* saturation arithmetic, result >= 0 */
+			e = _mm256_subs_epu16(e, vGapE);
+			e = _mm256_max_epi16(e, vH);
+			_mm256_store_si256(pvE + j, e);
+
+			/* Update vF value. */
+			vF = _mm256_subs_epu16(vF, vGapE);
+			vF = _mm256_max_epi16(vF, vH);
+
+			/* Load the next vH. */
+			vH = _mm256_load_si256(pvHLoad + j);
+		}
+
+		/* Lazy_F loop: same as in sw_sse2_word */
+		for (k = 0; LIKELY(k < 16); ++k) {
+			vF = slli2_avx2 (vF);
+			for (j = 0; LIKELY(j < segLen); ++j) {
+				vH = _mm256_load_si256(pvHStore + j);
+				vH = _mm256_max_epi16(vH, vF);
+				vMaxColumn = _mm256_max_epi16(vMaxColumn, _mm256_and_si256(vH, pvMask[j]));
+				_mm256_store_si256(pvHStore + j, vH);
+				vH = _mm256_subs_epu16(vH, vGapO);
+				e = _mm256_max_epi16(_mm256_load_si256(pvE + j), vH);
+				_mm256_store_si256(pvE + j, e);
+				vF = _mm256_subs_epu16(vF, vGapE);
+				if (j + 1 == segLen) break;
+				vTemp = _mm256_subs_epu16(_mm256_load_si256(pvHStore + j + 1), vGapO);
+				if (UNLIKELY(! _mm256_movemask_epi8(_mm256_cmpgt_epi16(vF, vTemp)))) goto end;
+			}
+		}
+
+end:
+		vMaxScore = _mm256_max_epi16(vMaxScore, vMaxColumn);
+		vTemp = _mm256_cmpeq_epi16(vMaxMark, vMaxScore);
+		cmp = (uint32_t)_mm256_movemask_epi8(vTemp);
+		if (cmp != 0xffffffff) {
+			uint16_t temp;
+			vMaxMark = vMaxScore;
+			max16w(temp, vMaxScore);
+			vMaxScore = vMaxMark;
+
+			if (LIKELY(temp > max)) {
+				max = temp;
+				end_ref = i;
+				for (j = 0; LIKELY(j < segLen); ++j) pvHmax[j] = pvHStore[j];
+			}
+		}
+
+		/* Record the max score of current column. */
+		max16w(maxColumn[i], vMaxColumn);
+		if (maxColumn[i] == terminate) break;
+	}
+
+	/* Trace the alignment ending position on read. */
+	uint16_t *t = (uint16_t*)pvHmax;
+	uint16_t *m = (uint16_t*)pvMask;
+	int32_t column_len = segLen * 16;
+	for (i = 0; LIKELY(i < column_len); ++i, ++t, ++m) {
+		int32_t temp;
+		if (*t == max && *m) {
+			temp = i / 16 + i % 16 * segLen;
+			if (temp < end_read) end_read = temp;
+		}
+	}
+
+	free(pvMask);
+	free(pvHmax);
+	free(pvE);
+	free(pvHLoad);
+	free(pvHStore);
+
+	/* Find the most possible 2nd best alignment. */
+	alignment_end* bests = (alignment_end*) calloc(2, sizeof(alignment_end));
+	bests[0].score = max;
+	bests[0].ref = end_ref;
+	bests[0].read = end_read;
+
+	bests[1].score = 0;
+	bests[1].ref = 0;
+	bests[1].read = 0;
+
+	edge = (end_ref - maskLen) > 0 ? (end_ref - maskLen) : 0;
+	for (i = 0; i < edge; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+	edge = (end_ref + maskLen) > refLen ? refLen : (end_ref + maskLen);
+	for (i = edge; i < refLen; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+
+	free(maxColumn);
+	return bests;
+}
+
+#endif	// SSW_AVX2
+
+/* Return 1 if the AVX2 kernels can be used. The detection can be disabled by setting the
+   SSW_SIMD environment variable to "sse2". */
+static int use_avx2 (void) {
+#ifdef SSW_AVX2
+	static int avx2 = -1;
+	if (avx2 < 0) {
+		const char* env = getenv("SSW_SIMD");
+		__builtin_cpu_init();
+		avx2 = __builtin_cpu_supports("avx2") && !(env && strcmp(env, "sse2") == 0);
+	}
+	return avx2;
+#else
+	return 0;
+#endif
+}
+
+/* Build the byte or word query profile for the kernels selected by avx2. */
+static void* qP_dispatch (int8_t avx2, int8_t word, const int8_t* read_num, const int8_t* mat, const int32_t readLen, const int32_t n, uint8_t bias) {
+#ifdef SSW_AVX2
+	if (avx2) return word ? (void*)qP_word_avx2(read_num, mat, readLen, n) : (void*)qP_byte_avx2(read_num, mat, readLen, n, bias);
+#endif
+	return word ? (void*)qP_word(read_num, mat, readLen, n) : (void*)qP_byte(read_num, mat, readLen, n, bias);
+}
+
+/* Run the byte kernel matching the instruction set of the profile. */
+static alignment_end* sw_byte_dispatch (int8_t avx2, const int8_t* ref, int8_t ref_dir, int32_t refLen, int32_t readLen, const uint8_t weight_gapO, const uint8_t weight_gapE, const void* vProfile, uint8_t terminate, uint8_t bias, int32_t maskLen) {
+#ifdef SSW_AVX2
+	if (avx2) return sw_avx2_byte(ref, ref_dir, refLen, readLen, weight_gapO, weight_gapE, (const __m256i*)vProfile, terminate, bias, maskLen);
+#endif
+	return sw_sse2_byte(ref, ref_dir, refLen, readLen, weight_gapO, weight_gapE, (const __m128i*)vProfile, terminate, bias, maskLen);
+}
+
+/* Run the word kernel matching the instruction set of the profile. */
+static alignment_end* sw_word_dispatch (int8_t avx2, const int8_t* ref, int8_t ref_dir, int32_t refLen, int32_t readLen, const uint8_t weight_gapO, const uint8_t weight_gapE, const void* vProfile, uint16_t terminate, int32_t maskLen) {
+#ifdef SSW_AVX2
+	if (avx2) return sw_avx2_word(ref, ref_dir, refLen, readLen, weight_gapO, weight_gapE, (const __m256i*)vProfile, terminate, maskLen);
+#endif
+	return sw_sse2_word(ref, ref_dir, refLen, readLen, weight_gapO, weight_gapE, (const __m128i*)vProfile, terminate, maskLen);
+}
+
 static cigar* banded_sw (const int8_t* ref,
 				 const int8_t* read,
 				 int32_t refLen,
@@ -751,6 +1265,7 @@ s_profile* ssw_init (const int8_t* read, const int32_t readLen, const int8_t* ma
 	p->profile_byte = 0;
 	p->profile_word = 0;
 	p->bias = 0;
+	p->avx2 = use_avx2();
 
 	if (score_size == 0 || score_size == 2) {
 		/* Find the bias to use in the substitution matrix */
@@ -759,9 +1274,9 @@ s_profile* ssw_init (const int8_t* read, const int32_t readLen, const int8_t* ma
 		bias = abs(bias);
 
 		p->bias = bias;
-		p->profile_byte = qP_byte (read, mat, readLen, n, bias);
+		p->profile_byte = qP_dispatch (p->avx2, 0, read, mat, readLen, n, bias);
 	}
-	if (score_size == 1 || score_size == 2) p->profile_word = qP_word (read, mat, readLen, n);
+	if (score_size == 1 || score_size == 2) p->profile_word = qP_dispatch (p->avx2, 1, read, mat, readLen, n, 0);
 	p->read = read;
 	p->mat = mat;
 	p->readLen = readLen;
@@ -786,7 +1301,7 @@ s_align* ssw_align (const s_profile* prof,
 					const int32_t maskLen) {
 
 	alignment_end* bests = 0, *bests_reverse = 0;
-	__m128i* vP = 0;
+	void* vP = 0;
 	int32_t word = 0, band_width = 0, readLen = prof->readLen;
 	int8_t* read_reverse = 0;
 	cigar* path;
@@ -801,10 +1316,10 @@ s_align* ssw_align (const s_profile* prof,
 
 	// Find the alignment scores and ending positions
 	if (prof->profile_byte) {
-		bests = sw_sse2_byte(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_byte, -1, prof->bias, maskLen);
+		bests = sw_byte_dispatch(prof->avx2, ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_byte, -1, prof->bias, maskLen);
 		if (prof->profile_word && bests[0].score == 255) {
 			free(bests);
-			bests = sw_sse2_word(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
+			bests = sw_word_dispatch(prof->avx2, ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
 			word = 1;
 		} else if (bests[0].score == 255) {
 			fprintf(stderr, "Please set 2 to the score_size parameter of the function ssw_init, otherwise the alignment results will be incorrect.\n");
@@ -812,7 +1327,7 @@ s_align* ssw_align (const s_profile* prof,
 			return NULL;
 		}
 	}else if (prof->profile_word) {
-		bests = sw_sse2_word(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
+		bests = sw_word_dispatch(prof->avx2, ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
 		word = 1;
 	}else {
 		fprintf(stderr, "Please call the function ssw_init before ssw_align.\n");
@@ -835,11 +1350,11 @@ s_align* ssw_align (const s_profile* prof,
 	// Find the beginning position of the best alignment.
 	read_reverse = seq_reverse(prof->read, r->read_end1);
 	if (word == 0) {
-		vP = qP_byte(read_reverse, prof->mat, r->read_end1 + 1, prof->n, prof->bias);
-		bests_reverse = sw_sse2_byte(ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, prof->bias, maskLen);
+		vP = qP_dispatch(prof->avx2, 0, read_reverse, prof->mat, r->read_end1 + 1, prof->n, prof->bias);
+		bests_reverse = sw_byte_dispatch(prof->avx2, ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, prof->bias, maskLen);
 	} else {
-		vP = qP_word(read_reverse, prof->mat, r->read_end1 + 1, prof->n);
-		bests_reverse = sw_sse2_word(ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, maskLen);
+		vP = qP_dispatch(prof->avx2, 1, read_reverse, prof->mat, r->read_end1 + 1, prof->n, 0);
+		bests_reverse = sw_word_dispatch(prof->avx2, ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, maskLen);
 	}
 	free(vP);
 	free(read_reverse);
@@ -872,6 +1387,10 @@ void align_destroy (s_align* a) {
 	free(a);
 }
 
+const char* ssw_kernel (void) {
+	return use_avx2() ? "AVX2" : "SSE2";
+}
+
 char cigar_int_to_op (uint32_t cigar_int)
 {
 	uint8_t letter_code = cigar_int & 0xfU;
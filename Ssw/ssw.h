@@ -181,6 +181,11 @@ char cigar_int_to_op (uint32_t cigar_int);
 */
 uint32_t cigar_int_to_len (uint32_t cigar_int);
 
+/*!	@function	Name of the SIMD kernels selected at runtime.
+	@return	"AVX2" if the CPU supports AVX2 (unless the SSW_SIMD environment variable is set to "sse2"), else "SSE2"
+*/
+const char* ssw_kernel (void);
+
 #ifdef __cplusplus
 }
 #endif	// __cplusplus
@@ -12,6 +12,9 @@ library and update the cache by using /sbin/ldconfig as root
 #~~~~~~~GLOBAL IMPORTS~~~~~~~#
 # Standard library packages
 from ctypes import *
+from collections import OrderedDict
+from hashlib import md5
+from multiprocessing.pool import ThreadPool
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class CAlignRes(Structure):
@@ -67,11 +70,20 @@ class Aligner(object):
     align_destroy = libssw.align_destroy
     align_destroy.restype = None
     align_destroy.argtypes = [POINTER(CAlignRes)]
+    # ssw_kernel function (absent from libraries built before the AVX2 kernels = SSE2 only)
+    try:
+        ssw_kernel = libssw.ssw_kernel
+        ssw_kernel.restype = c_char_p
+        ssw_kernel.argtypes = []
+        simd_kernel = ssw_kernel()
+    except AttributeError:
+        simd_kernel = "SSE2"
 
     #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
 
     def __repr__(self):
         msg = "SSW WRAPPER\n"
+        msg += "SIMD KERNEL: {}\n".format(self.simd_kernel)
         msg += "SCORE PARAMETERS:\n"
         msg += " Gap Weight     Open: {}     Extension: {}\n".format(-self.gap_open, -self.gap_extend)
         msg += " Align Weight   Match: {}    Mismatch: {}\n\n".format(self.match, -self.mismatch)
@@ -84,7 +96,13 @@ class Aligner(object):
         msg += " N\t{}\t{}\t{}\t{}\t{}\n\n".format(0,0,0,0,0)
         msg += "RESULT PARAMETERS:\n"
         msg += " Report cigar           {}\n".format(self.report_cigar)
-        msg += " Report secondary match {}\n\n".format(self.report_secondary)
+        msg += " Report secondary match {}\n".format(self.report_secondary)
+        if self.tile_size:
+            msg += " Tile size              {}\n".format(self.tile_size)
+            msg += " Tile threads           {}\n".format(self.tile_threads)
+        msg += "\n"
+        if self.cache is not None:
+            msg += repr(self.cache)
         #msg += "REFERENCE SEQUENCE :\n"
         #if self.ref_len <= 50:
             #msg += "".join([self.int_to_base[i] for i in self.ref_seq])+"\n"
@@ -103,7 +121,10 @@ class Aligner(object):
                 gap_open=3,
                 gap_extend=1,
                 report_secondary=False,
-                report_cigar=False):
+                report_cigar=False,
+                cache_size=0,
+                tile_size=0,
+                tile_threads=1):
         """
         Initialize object by creating an interface with ssw library fonctions
         A reference sequence is also assigned to the object for multiple alignment against queries
@@ -115,12 +136,26 @@ class Aligner(object):
         @param gap_extend Absolute value of gap extend penalty
         @param report_secondary Report the 2nd best alignement if true
         @param report_cigar Report cigar string if true
+        @param cache_size Maximal number of alignment results memoized in an AlignCache. Usefull
+        for highly redundant libraries in which the same read is aligned many times. 0 = no cache
+        @param tile_size If the reference is longer, it is split in overlapping windows of this
+        size aligned in parallel. The best hit is identical to an untiled alignment but no
+        secondary alignment is reported. 0 = no tiling
+        @param tile_threads Number of threads used to align the windows
         """
 
         # Store overall alignment parameters
         self.report_secondary = report_secondary
         self.report_cigar = report_cigar
 
+        # Init a cache of results if required
+        self.cache = AlignCache(cache_size) if cache_size > 0 else None
+
+        # Tiling parameters for long references
+        self.tile_size = tile_size
+        self.tile_threads = tile_threads
+        self._pool = None
+
         # Set gap penalties
         self.set_gap(gap_open, gap_extend)
 
@@ -130,6 +165,9 @@ class Aligner(object):
         # Set the reference sequence
         self.set_ref(ref_seq)
 
+    def __del__(self):
+        self.close()
+
     #~~~~~~~SETTERS METHODS~~~~~~~#
 
     def set_gap(self, gap_open=3, gap_extend=1):
@@ -158,13 +196,20 @@ class Aligner(object):
     def set_ref(self, ref_seq):
         """
         Determine the size of the ref sequence and cast it in a c type integer matrix
+        If a cache is used the cast is delayed until an alignment is not found in the cache
         """
         if ref_seq:
             self.ref_len = len(ref_seq)
-            self.ref_seq = self._DNA_to_int_mat (ref_seq, self.ref_len)
+            if self.cache is not None:
+                self.ref_id = md5(ref_seq).digest()
+                self.ref_str = ref_seq
+                self.ref_seq = None
+            else:
+                self.ref_seq = self._DNA_to_int_mat (ref_seq, self.ref_len)
         else:
             self.ref_len = 0
             self.ref_seq = ""
+            self.ref_id = None
 
     #~~~~~~~PUBLIC METHODS~~~~~~~#
 
@@ -176,6 +221,18 @@ class Aligner(object):
         @param min_len Minimal length of match. None will be return in case of filtering out
         @return A SSWAlignRes Object containing informations about the alignment.
         """
+        # Return the memoized result if the same alignment was already done
+        if self.cache is not None:
+            key = (query_seq, min_score, min_len, self.match, self.mismatch, self.gap_open,
+                self.gap_extend, self.report_secondary, self.report_cigar, self.tile_size, self.ref_id)
+            py_result = self.cache.get(key, AlignCache.MISSING)
+            if py_result is not AlignCache.MISSING:
+                return py_result
+
+            # Cast the reference delayed by set_ref
+            if self.ref_seq is None:
+                self.ref_seq = self._DNA_to_int_mat (self.ref_str, self.ref_len)
+
         # Determine the size of the ref sequence and cast it in a c type integer matrix
         query_len = len(query_seq)
         query_seq = self._DNA_to_int_mat (query_seq, query_len)
@@ -195,22 +252,21 @@ class Aligner(object):
         else:
             mask_len = 15
 
-        c_result = self.ssw_align (profile, # Query profile
-                                self.ref_seq, # Ref seq in c type integers
-                                c_int32(self.ref_len), # Length of Refseq in bites
-                                self.gap_open, # Absolute value of gap open penalty
-                                self.gap_extend, # absolute value of gap extend penalty
-                                1, # Bitwise FLAG for output values = return all
-                                0, # Score filter = return all
-                                0, # Distance filter = return all
-                                mask_len) # Distance between the optimal and suboptimal alignment
+        # Align against the complete reference or against overlapping tiles of a long reference
+        if self.tile_size and self.ref_len > self.tile_size:
+            c_result, ref_offset = self._tiled_align(profile, query_len, mask_len)
+            report_secondary = False
+        else:
+            c_result = self._ssw_align(profile, self.ref_seq, self.ref_len, mask_len)
+            ref_offset = 0
+            report_secondary = self.report_secondary
 
         # Transform the Cstructure into a python object if score and lenght match the requirements
         score = c_result.contents.score
         match_len  = c_result.contents.query_end - c_result.contents.query_begin + 1
 
         if score >= min_score and match_len >= min_len:
-            py_result = PyAlignRes(c_result, query_len, self.report_secondary, self.report_cigar)
+            py_result = PyAlignRes(c_result, query_len, report_secondary, self.report_cigar, ref_offset)
         else:
             py_result = None
 
@@ -218,11 +274,88 @@ class Aligner(object):
         self._init_destroy(profile)
         self._align_destroy(c_result)
 
+        # Memoize the result (including None for filtered out alignments)
+        if self.cache is not None:
+            self.cache.add(key, py_result)
+
         # Return the object
         return py_result
 
+    def close(self):
+        """
+        Terminate the thread pool used for tiled alignments if it was created. The aligner can
+        still be used afterwards, a new pool being created if needed
+        """
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            self._pool = None
+            pool.close()
+            pool.join()
+
     #~~~~~~~PRIVATE METHODS~~~~~~~#
 
+    def _ssw_align (self, profile, ref_seq, ref_len, mask_len):
+        """
+        Align a query profile against a c type integer reference and return a CAlignRes pointer
+        """
+        return self.ssw_align (profile, # Query profile
+                                ref_seq, # Ref seq in c type integers
+                                c_int32(ref_len), # Length of Refseq in bites
+                                self.gap_open, # Absolute value of gap open penalty
+                                self.gap_extend, # absolute value of gap extend penalty
+                                1, # Bitwise FLAG for output values = return all
+                                0, # Score filter = return all
+                                0, # Distance filter = return all
+                                mask_len) # Distance between the optimal and suboptimal alignment
+
+    def _tiled_align (self, profile, query_len, mask_len):
+        """
+        Split the reference in windows overlapping by more than the longest possible local
+        alignment of the query, align all windows in parallel threads (ctypes release the GIL
+        during the C calls) and keep the best hit. The best window is the one with the highest
+        score and in case of ties the smallest reference end, as in an untiled alignment.
+        @return A tuple with the CAlignRes pointer of the best window and the window offset
+        """
+        overlap = self._tile_overlap(query_len)
+
+        # The tiles would be entirely overlapping = no benefit of the tiling
+        if overlap >= self.tile_size:
+            return self._ssw_align(profile, self.ref_seq, self.ref_len, mask_len), 0
+
+        # List the start positions of the windows
+        step = self.tile_size - overlap
+        start_list = [0]
+        while start_list[-1] + self.tile_size < self.ref_len:
+            start_list.append(start_list[-1] + step)
+
+        # Align windows with pointers on the reference array = no copy of the sequence
+        ref_address = addressof(self.ref_seq)
+        def align_tile (start):
+            tile_seq = cast(ref_address + start, POINTER(c_int8))
+            tile_len = min(self.tile_size, self.ref_len - start)
+            return self._ssw_align(profile, tile_seq, tile_len, mask_len), start
+
+        # The thread pool is created at the first tiled alignment and reused by the next ones
+        if self._pool is None:
+            self._pool = ThreadPool(self.tile_threads)
+        result_list = self._pool.map(align_tile, start_list)
+
+        # Select the best window and free the others
+        best = max(result_list, key=lambda r: (r[0].contents.score, -(r[0].contents.ref_end+r[1])))
+        for c_result, start in result_list:
+            if c_result is not best[0]:
+                self._align_destroy(c_result)
+        return best
+
+    def _tile_overlap (self, query_len):
+        """
+        Length of the reference that can be spanned by a local alignment of the query. Each
+        deletion costs at least gap_extend and the score cannot exceed query_len*match
+        """
+        if self.gap_extend <= 0:
+            return self.ref_len
+        return query_len + (query_len*self.match)//self.gap_extend + 1
+
     def _DNA_to_int_mat (self, seq, len_seq):
         """
         Cast a python DNA string into a Ctype int8 matrix
@@ -255,6 +388,93 @@ class Aligner(object):
         """
         self.align_destroy(align)
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class AlignCache(object):
+    """
+    @class  AlignCache
+    @brief  Bounded LRU cache of alignment results. Keys are tuples identifying the query, the
+    filtering and scoring parameters and the reference. Values are PyAlignRes objects or None
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS VARIABLES~~~~~~~#
+
+    # Sentinel returned by get for keys absent from the cache since None is a valid result
+    MISSING = object()
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __repr__(self):
+        msg = "ALIGNMENT CACHE\n"
+        msg += " Size           {}/{}\n".format(len(self), self.max_size)
+        msg += " Hits           {}\n".format(self.hits)
+        msg += " Misses         {}\n".format(self.misses)
+        msg += " Hit rate       {}\n".format(round(self.hit_rate(), 4))
+        msg += " Evictions      {}\n\n".format(self.evictions)
+        return msg
+
+    def __str__(self):
+        return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __init__(self, max_size=100000):
+        """
+        @param max_size Maximal number of results stored. When full the least recently used
+        result is evicted
+        """
+        self.max_size = max_size
+        self.results = OrderedDict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def get(self, key, default=None):
+        """
+        @param key Hashable key of the alignment
+        @param default Value returned if the key is not in the cache
+        @return The memoized result and mark it as the most recently used
+        """
+        try:
+            value = self.results.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.results[key] = value
+        self.hits += 1
+        return value
+
+    def add(self, key, value):
+        """
+        Store a result and evict the least recently used one if the cache is full
+        """
+        if key in self.results:
+            del self.results[key]
+        elif len(self.results) >= self.max_size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+        self.results[key] = value
+
+    def hit_rate(self):
+        """
+        @return Fraction of get calls that found a result in the cache
+        """
+        total = self.hits + self.misses
+        return self.hits/float(total) if total else 0.0
+
+    def clear(self):
+        """
+        Empty the cache and reset counters
+        """
+        self.results.clear()
+        self.hits = self.misses = self.evictions = 0
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class PyAlignRes(object):
     """
@@ -304,19 +524,20 @@ class PyAlignRes(object):
         return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
 
 
-    def __init__ (self, Res, query_len, report_secondary=False, report_cigar=False):
+    def __init__ (self, Res, query_len, report_secondary=False, report_cigar=False, ref_offset=0):
         """
         Parse CAlignRes structure and copy its values in object variables
         @param Res A CAlignRes structure
         @param query_len length of the query sequence
         @param report_secondary Report the 2nd best alignement if true
         @param report_cigar Report cigar string if true
+        @param ref_offset Position of the aligned sequence in the reference (for tiled alignments)
         """
         # Parse value in the C type structure pointer
         # Minimal mandatory parameters
         self.score = Res.contents.score
-        self.ref_begin = Res.contents.ref_begin
-        self.ref_end = Res.contents.ref_end
+        self.ref_begin = Res.contents.ref_begin + ref_offset
+        self.ref_end = Res.contents.ref_end + ref_offset
         self.query_begin = Res.contents.query_begin
         self.query_end = Res.contents.query_end
 
@@ -324,7 +545,7 @@ class PyAlignRes(object):
         score2 = Res.contents.score2
         if report_secondary and score2 != 0:
             self.score2 = score2
-            self.ref_end2 = Res.contents.ref_end2
+            self.ref_end2 = Res.contents.ref_end2 + ref_offset
         else:
             self.score2 = None
             self.ref_end2 = None
@@ -12,11 +12,14 @@
 
 #~~~~~~~COMMAND LINE UTILITIES~~~~~~~#
 
-def run_command(cmd, stdin=None, ret_stderr=False, ret_stdout=True):
+def run_command(cmd, stdin=None, ret_stderr=False, ret_stdout=True, stdin_file=None):
     """
     Run a command line in the default shell and return the standard output
     @param  cmd A command line string formated as a string
     @param  stdinput    Facultative parameters to redirect an object to the standard input
+    @param  stdin_file  Facultative file object or descriptor connected to the standard input,
+    for example the read end of a pipe returned by gunzip_pipe. It is closed once the process is
+    started
     @param  ret_stderr  If True the standard error output will be returned
     @param  ret_stdout  If True the standard output will be returned
     @note If ret_stderr and ret_stdout are True a tuple will be returned and if both are False
@@ -28,12 +31,19 @@ def run_command(cmd, stdin=None, ret_stderr=False, ret_stdout=True):
     # Function specific imports
     from subprocess import Popen, PIPE
 
-    # Execute the command line in the default shell
+    # Execute the command line in the default shell. Descriptors of other commands running in
+    # parallel threads (pipes of gunzip_pipe) are not inherited, else they could not see the EOF
     if stdin:
-        proc = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        proc = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
         stdout, stderr = proc.communicate(input=stdin)
+    elif stdin_file is not None:
+        try:
+            proc = Popen(cmd, shell=True, stdin=stdin_file, stdout=PIPE, stderr=PIPE, close_fds=True)
+        finally:
+            _close_file(stdin_file)
+        stdout, stderr = proc.communicate()
     else:
-        proc = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
+        proc = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, close_fds=True)
         stdout, stderr = proc.communicate()
 
     if proc.returncode == 1:
@@ -52,6 +62,59 @@ def run_command(cmd, stdin=None, ret_stderr=False, ret_stdout=True):
     else:
         return None
 
+def iter_command(cmd, stdin_file=None):
+    """
+    Run a command line in the default shell and iterate over its standard output line by line
+    without loading it in memory. The standard error is spooled in a temporary file so that it
+    cannot fill a pipe and block the process.
+    @param  cmd A command line string formated as a string
+    @param  stdin_file  Facultative file object or descriptor connected to the standard input,
+    for example the read end of a pipe returned by gunzip_pipe. It is closed once the process is
+    started
+    @return A generator of the standard output lines
+    @exception  OSError Raise if the command exits with an error code of 1
+    @exception  (ValueError,OSError) May be raise by Popen
+    """
+    # Function specific imports
+    from subprocess import Popen, PIPE
+    from tempfile import TemporaryFile
+
+    stderr = TemporaryFile()
+    try:
+        # Descriptors of other commands running in parallel threads are not inherited
+        proc = Popen(cmd, shell=True, stdin=stdin_file, stdout=PIPE, stderr=stderr, close_fds=True)
+    finally:
+        # The child process has its own copy of the stdin descriptor
+        if stdin_file is not None:
+            _close_file(stdin_file)
+
+    try:
+        for line in iter(proc.stdout.readline, ""):
+            yield line
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+    if proc.returncode == 1:
+        stderr.seek(0)
+        msg = "An error occured during execution of following command :\n"
+        msg += "COMMAND : {}\n".format(cmd)
+        msg += "STDERR : {}\n".format(stderr.read())
+        stderr.close()
+        raise Exception (msg)
+
+    stderr.close()
+
+def _close_file(f):
+    """
+    Close a file object or a file descriptor
+    """
+    from os import close
+    if isinstance(f, int):
+        close(f)
+    else:
+        f.close()
+
 def make_cmd_str(prog_name, opt_dict={}, opt_list=[]):
     """
     Create a Unix like command line string from a
@@ -194,6 +257,54 @@ def fgunzip(in_path, out_path=None):
             except OSError:
                 print "Can't remove {}".format(out_path)
 
+def gunzip_pipe(in_path, block_size=1048576):
+    """
+    Decompress a gzipped file in a pipe from a background thread, so that a command line tool can
+    read the uncompressed data from its standard input while it is decompressed, without writing
+    a temporary file. The read end has to be given to run_command or iter_command as stdin_file
+    @param in_path Path of the input compressed file
+    @param block_size Size of the blocks decompressed and written in the pipe
+    @return A tuple (read end file object, feeder thread). Once the command is finished, join the
+    feeder thread and check its error attribute that contains the exception raised during the
+    decompression or None
+    """
+    # Function specific imports
+    import gzip
+    from os import pipe, fdopen
+    from errno import EPIPE
+    from fcntl import fcntl, F_GETFD, F_SETFD, FD_CLOEXEC
+    from shutil import copyfileobj
+    from threading import Thread
+
+    # The pipe must not be inherited by child processes, otherwise the consumer would never
+    # receive the end of file. Popen duplicates the read end as the consumer standard input.
+    # FD_CLOEXEC is not set atomically with the creation of the pipe, so run_command and
+    # iter_command also start their process with close_fds
+    read_fd, write_fd = pipe()
+    for fd in (read_fd, write_fd):
+        fcntl(fd, F_SETFD, fcntl(fd, F_GETFD) | FD_CLOEXEC)
+    in_handle = gzip.GzipFile(in_path, 'rb')
+
+    def feed():
+        try:
+            with fdopen(write_fd, "wb") as out_handle:
+                copyfileobj(in_handle, out_handle, block_size)
+        except (IOError, OSError) as E:
+            # The consumer stopped reading its input (process finished or killed)
+            if E.errno != EPIPE:
+                feeder.error = E
+        except Exception as E:
+            feeder.error = E
+        finally:
+            in_handle.close()
+
+    feeder = Thread(target=feed)
+    feeder.error = None
+    feeder.daemon = True
+    feeder.start()
+
+    return fdopen(read_fd, "rb"), feeder
+
 def expand_file (infile, outdir="./"):
     """
     expand file in outdir if the file are gzipped
@@ -234,17 +345,21 @@ def mkdir(fp):
         mkdir(fp)
         return fp
 
-def merge_files (inpath_list, outpath="out", compress_output=True, bufsize = 100000):
+def merge_files (inpath_list, outpath="out", compress_output=True, bufsize = 16777216):
     """
-    Merge a list of text file (gzip or not) in a single file taht can be compress or not
+    Merge a list of text file (gzip or not) in a single file taht can be compress or not. Files
+    are copied by large blocks without parsing the lines. When the output is compressed, gzipped
+    input files are appended as raw gzip members (a concatenation of gzip members is a valid gzip
+    file) and only uncompressed input files are compressed.
     @param input_list List of files to merge
     @param outpath Destination file
     @param compress_output Gzip the output file. Slower if true
-    @param bufline Size of the output file write buffer in line (positive integer)
+    @param bufsize Size of the copy blocks in bytes (positive integer)
     @return path of the output merged file
     """
     # Standard library import
     import gzip
+    from shutil import copyfileobj
     from sys import stdout
     from os import path
     from time import time
@@ -252,37 +367,32 @@ def merge_files (inpath_list, outpath="out", compress_output=True, bufsize = 100
     stime = time()
     # Creating and storing a file for writting output
     outpath = path.abspath(outpath)+".gz" if compress_output else path.abspath(outpath)
-    openout = gzip.open if compress_output else open
 
-    with openout(outpath, "wb") as out_handle:
+    with open(outpath, "wb") as out_handle:
         # Iterate over files in the input list
         for inpath in inpath_list:
+            stdout.write("\t+ {}  ".format(file_name(inpath)))
+            stdout.flush()
 
-            # Open according to the compression
-            openin = gzip.open if is_gziped(inpath) else open
-            with openin (inpath, "rb") as in_handle:
-                stdout.write("\t+ {}  ".format(file_name(inpath)))
-                stdout.flush()
-
-                # Init a line counter and a text buffer
-                lineno = 0
-                linebuf = ""
-
-                # Store line in the buffer until the line size is full then flush in out_handle
-                for line in in_handle:
-                    lineno += 1
-                    linebuf += line
-                    if lineno % bufsize == 0:
-                        out_handle.write(linebuf)
-                        linebuf = ""
-                    if lineno % 1000000 == 0:
-                        stdout.write("*")
-                        stdout.flush()
-
-                # Flush the remaining lines in the buffer
-                stdout.write("*\n")
-                stdout.flush()
-                out_handle.write(linebuf)
+            # Same compression in input and output = raw copy of the bytes
+            if is_gziped(inpath) == compress_output:
+                with open(inpath, "rb") as in_handle:
+                    copyfileobj(in_handle, out_handle, bufsize)
+
+            # Compressed input in uncompressed output = decompress
+            elif is_gziped(inpath):
+                with gzip.open(inpath, "rb") as in_handle:
+                    copyfileobj(in_handle, out_handle, bufsize)
+
+            # Uncompressed input in compressed output = compress in a new gzip member
+            else:
+                with open(inpath, "rb") as in_handle:
+                    gz_handle = gzip.GzipFile(filename="", mode="wb", fileobj=out_handle)
+                    copyfileobj(in_handle, gz_handle, bufsize)
+                    gz_handle.close()
+
+            stdout.write("*\n")
+            stdout.flush()
 
     print ("{} files merged in {}s\n".format (len(inpath_list), round(time()-stime,3)))
     return outpath
@@ -416,6 +526,51 @@ def count_seq (filename, seq_type="fasta"):
         fp.close()
         return nline/4
 
+def fasta_index (filename):
+    """
+    Return a samtools faidx like index of an uncompressed fasta file. The .fai file is used if
+    available else the index is build by scanning the file
+    @param filename Path to an uncompressed fasta file
+    @return A dictionnary of (length, offset, line_bases, line_width) tuples per sequence name.
+    offset is the position of the first base in the file, line_bases the number of bases per line
+    and line_width the number of bytes per line including the end of line characters
+    @exception ValueError Raise if lines of a sequence do not have the same length
+    """
+    from os import path
+
+    index = {}
+
+    # Import the samtools faidx index if available
+    if path.isfile(filename+".fai"):
+        with open(filename+".fai", "r") as fai:
+            for line in fai:
+                name, length, offset, line_bases, line_width = line.split()[:5]
+                index[name] = (int(length), int(offset), int(line_bases), int(line_width))
+        return index
+
+    # Else index the fasta file
+    with open(filename, "rb") as fp:
+        name = None
+        pos = 0
+        for line in fp:
+            if line[0] == ">":
+                name = line[1:].split()[0] if line[1:].strip() else ""
+                index[name] = [0, pos+len(line), 0, 0]
+                last_len = None
+            elif name is not None:
+                bases = len(line.rstrip("\r\n"))
+                entry = index[name]
+                # Only the last line of a sequence can be shorter
+                if last_len is not None and (last_len != entry[2] or bases > entry[2]):
+                    raise ValueError ("Different line length in sequence {} of {}".format(name, filename))
+                if not entry[2]:
+                    entry[2], entry[3] = bases, len(line)
+                entry[0] += bases
+                last_len = bases
+            pos += len(line)
+
+    return {name: tuple(entry) for name, entry in index.items()}
+
 def DNA_reverse_comp (sequence, AmbiguousBase=True):
     """
     Generate the reverese complementary sequence of a given DNA sequence
@@ -436,6 +591,24 @@ def DNA_reverse_comp (sequence, AmbiguousBase=True):
 
     return compl_sequence[::-1]
 
+def merge_intervals (interval_list):
+    """
+    Merge overlapping or adjacent half-open intervals
+    @param interval_list Iterable of (start, end) tuples. Empty intervals (start >= end) are skipped
+    @return A sorted list of non overlapping [start, end] lists
+    """
+    merged = []
+    for start, end in sorted(interval_list, key=lambda interval: interval[0]):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    return merged
+
 
 def gb_to_bed(gb_file, track_description="User Supplied Track", features_type = []):
     """
@@ -6,6 +6,8 @@ For now it includes BWA, Blast and Smith–Waterman wrappers as well as higher l
 
 * FastqFT : Filter fastq file based on quality and adapter trimming
 * RefMasker : Align a fasta reference against several fastq queries and mask homologies in the reference file
+* HomologyFinder : Blast free k-mer and Smith-Waterman search of query homologies in a reference, usable as hit provider for RefMasker
+* IndexCache : Content addressed cache of blast databases and bwa indexes shared between runs
 * pySamTools :  Manipulate aligned reads manipulation though pysam
 * Utilities : Library of simple generic functions to manipulate paths and file, interact with command line interpreter and so on
 
@@ -18,5 +20,5 @@ For now it includes BWA, Blast and Smith–Waterman wrappers as well as higher l
 * [Atlantic Gene Therapies - INSERM 1089] (http://www.atlantic-gene-therapies.fr/)
 """
 
-__all__ = ["Utilities", "Blast", "Bwa", "FastqFT", "pySamTools", "Ssw", "RefMasker", "Ungzip"]
+__all__ = ["Utilities", "Blast", "Bwa", "FastqFT", "pySamTools", "Ssw", "RefMasker", "HomologyFinder", "IndexCache", "Ungzip"]
 __version__ = 0.1
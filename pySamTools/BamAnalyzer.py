@@ -0,0 +1,500 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Standard library packages import
+from heapq import heappush, heappop
+
+# Third party packages import
+import pysam
+import numpy as np
+
+# Local Package import
+from RegionExecutor import RegionExecutor
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class BamAnalyzer (object):
+    """
+    @class  BamAnalyzer
+    @brief  Generate all the outputs of a CoverageMaker and a VariantMaker (bedgraph, bed, coverage
+    graphics and frequent variants report) in a single pass over the reads of each sequence of a
+    sorted and indexed bam file. The number of A, C, G, T, N and deletions at each position is
+    accumulated block by block in numpy arrays, and the depth and all outputs are derived from
+    these shared arrays instead of running one pileup per output.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~CLASS FIELDS~~~~~~~#
+
+    # Order of the rows of the count arrays. An additional last row counts the bases below the
+    # minimal base quality, which are part of the depth but not of the base counts as in pileup
+    bases = ['A', 'C', 'G', 'T', 'N', 'Del']
+
+    # Reads ignored by pileup: unmapped, secondary, QC failed and duplicate
+    filter_flag = 0x4|0x100|0x200|0x400
+
+    # Row of each ascii character in the count arrays. Other characters are counted as N
+    base_code = np.full(256, 4, dtype=np.int64)
+    base_code[np.frombuffer("ACGTacgt", dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __init__ (self, coverage_maker=None, variant_maker=None, batch_size=4194304, executor=None,
+        min_base_quality=13, region_size=1000000):
+        """
+        Create a BamAnalyzer object
+        @param coverage_maker CoverageMaker object defining the coverage outputs to generate. None
+        if no coverage output is required
+        @param variant_maker VariantMaker object defining the variant outputs to generate. None if
+        no variant output is required
+        @param batch_size Number of aligned bases buffered before being added to the count arrays
+        @param executor RegionExecutor object used to analyse regions of the bam in parallel. By
+        default the sequences are analysed one after the other in the current process
+        @param min_base_quality Minimal quality of the bases counted in the variant report. Same
+        default as pysam pileup. The depth includes all bases
+        @param region_size Size of the regions analysed one after the other without executor, to
+        bound the memory used by the count arrays of large sequences
+        """
+        self.coverage_maker = coverage_maker
+        self.variant_maker = variant_maker
+        self.batch_size = batch_size
+        self.executor = executor
+        self.min_base_quality = min_base_quality
+        self.region_size = region_size
+
+    def __repr__(self):
+        msg = "\tBAM ANALYZER\n"
+        if self.coverage_maker:
+            msg += repr(self.coverage_maker)
+        if self.variant_maker:
+            msg += repr(self.variant_maker)
+        if self.executor:
+            msg += repr(self.executor)
+        return msg
+
+    def __str__(self):
+        return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def __call__ (self, bam_path, bai_path, outpath="./out", ref_name = "ref"):
+        """
+        @param bam_path Path to the bam file to analyse
+        @param bai_path Path to the bam index file. I won't be used but it's existence is
+        required to fetch the reads of each sequence
+        @param outpath Basename of the path where to output files
+        @param ref_name Name of the reference genome containing the sequence listed in the bam file
+        """
+        self.make(bam_path, bai_path, outpath, ref_name)
+
+    def make (self, bam_path, bai_path, outpath="./out", ref_name = "ref"):
+        """
+        Generate all the outputs requested by the coverage and variant makers. The output files
+        and attributes of the makers are the same as with their own make method
+        @param bam_path Path to the bam file to analyse
+        @param bai_path Path to the bam index file. I won't be used but it's existence is
+        required to fetch the reads of each sequence
+        @param outpath Basename of the path where to output files
+        @param ref_name Name of the reference genome containing the sequence listed in the bam file
+        """
+        cov = self.coverage_maker
+        var = self.variant_maker
+        make_bedgraph = cov is not None and cov.make_bedgraph
+        make_bed = cov is not None and cov.make_bed
+        make_covgraph = cov is not None and cov.make_covgraph
+        make_freqvar = var is not None and var.make_freqvar
+
+        if not make_bedgraph and not make_bed and not make_covgraph and not make_freqvar:
+            return
+
+        print ("\tAnalyse all sequences of the bam file in a single pass...")
+        bedgraph_file = bed_file = None
+        covgraph_list = []
+        freqvar_list = []
+
+        # Only pass the makers with requested outputs to the workers
+        if not make_bedgraph and not make_bed and not make_covgraph:
+            cov = None
+        if not make_freqvar:
+            var = None
+
+        if self.executor:
+            results = self.executor.map(_analyze_interval, bam_path, cov, var, ref_name,
+                self.batch_size, self.min_base_quality)
+        else:
+            results = self._iter_results(bam_path, cov, var, ref_name)
+
+        try:
+            if make_bedgraph:
+                cov.bedgraph = "{}_{}.bedgraph".format(outpath, ref_name)
+                bedgraph_file = open(cov.bedgraph, "wb")
+                cov.write_bedgraph_header(bedgraph_file, ref_name)
+
+            if make_bed:
+                cov.bed = "{}_{}.bed".format(outpath, ref_name)
+                bed_file = open(cov.bed, "wb")
+                cov.write_bed_header(bed_file, ref_name)
+
+            # Results are stitched in the order of the sequences and positions
+            run_seq = None
+            run_list = []
+            depth_list = []
+            for seq_name, seq_len, start, end, (runs, depth, rows) in results:
+
+                if make_bedgraph:
+                    if seq_name != run_seq:
+                        cov.write_bedgraph_runs(bedgraph_file, run_seq, run_list)
+                        run_seq = seq_name
+                        run_list = []
+
+                    # Join the first run of the region with the last run of the previous region
+                    if run_list and runs and run_list[-1][1] == runs[0][0] and run_list[-1][2] == runs[0][2]:
+                        run_list[-1][1] = runs.pop(0)[1]
+                    run_list.extend(runs)
+
+                    # The last run is kept since it could continue in the next region
+                    cov.write_bedgraph_runs(bedgraph_file, seq_name, run_list[:-1])
+                    run_list = run_list[-1:]
+
+                # The depth of small sequences is gathered to create bed and graphics
+                if depth is not None:
+                    depth_list.append(depth)
+                    if end == seq_len:
+                        depth = np.concatenate(depth_list)
+                        depth_list = []
+                        if make_bed:
+                            cov.write_bed(bed_file, seq_name, seq_len, depth)
+                        if make_covgraph:
+                            svg = cov.covgraph(seq_name, seq_len, depth, outpath, ref_name)
+                            if svg:
+                                covgraph_list.append(svg)
+
+                freqvar_list.extend(rows)
+
+            if make_bedgraph:
+                cov.write_bedgraph_runs(bedgraph_file, run_seq, run_list)
+
+        finally:
+            results.close()
+            for outfile in (bedgraph_file, bed_file):
+                if outfile:
+                    outfile.close()
+
+        if make_covgraph:
+            cov.covgraph_list = covgraph_list
+        if make_freqvar:
+            var.write_freqvar(freqvar_list, outpath, ref_name)
+
+    def iter_counts (self, bam_path):
+        """
+        Iterate over the sequences of the bam header by regions of about region_size bases and
+        count the bases of each position
+        @param bam_path Path to a sorted and indexed bam file
+        @return A generator of (sequence name, sequence length, start, end, depth array, count
+        array) tuples. The count array has one row per element of bases and one column per
+        position of the region. As in pileup bases below min_base_quality are not counted but are
+        included in the depth
+        """
+        with pysam.Samfile(bam_path, "rb") as bam:
+            for seq_name, seq_len, start, end in self._intervals(bam):
+                counts = self._count(bam, seq_name, seq_len, start, end)
+                yield seq_name, seq_len, start, end, counts.sum(axis=0, dtype=np.int32), counts[:-1]
+
+    @classmethod
+    def is_pileup_read (cls, read):
+        """
+        Select the reads counted by pileup with the default options of pysam. Unmapped,
+        secondary, QC failed and duplicate reads, as well as paired reads not mapped in proper pair
+        (orphans) are ignored
+        @param read pysam.AlignedSegment to test
+        @return True if the read is counted in the depth
+        """
+        if read.flag & cls.filter_flag or read.reference_end is None:
+            return False
+        return not read.is_paired or read.is_proper_pair
+
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _iter_results (self, bam_path, cov, var, ref_name):
+        """
+        Analyse the regions of the sequences one after the other in the current process
+        @return A generator of (seq_name, seq_len, start, end, result) as RegionExecutor.map
+        """
+        with pysam.Samfile(bam_path, "rb") as bam:
+            for seq_name, seq_len, start, end in self._intervals(bam):
+                yield seq_name, seq_len, start, end, self._analyze(bam, seq_name, seq_len, start, end, cov, var, ref_name)
+
+    def _intervals (self, bam):
+        """
+        @return The list of (seq_name, seq_len, start, end) intervals of about region_size bases
+        covering all the sequences of an opened bam, in the order of the bam header
+        """
+        region_list = RegionExecutor(1, self.region_size).regions(bam.references, bam.lengths)
+        return [interval for region in region_list for interval in region]
+
+    def _analyze (self, bam, seq_name, seq_len, start, end, cov, var, ref_name):
+        """
+        Compute the outputs of a region of a sequence. Base counts are only computed if the
+        frequent variants report is requested, else only the depth
+        @return A tuple (bedgraph runs, depth or None if not needed for the bed and graphics,
+        frequent variant rows)
+        """
+        if var:
+            counts = self._count(bam, seq_name, seq_len, start, end)
+            depth = counts.sum(axis=0, dtype=np.int32)
+            rows = var.freqvar_rows(ref_name, seq_name, depth, counts[:-1], start)
+        else:
+            depth = cov.depth_array(bam, seq_name, seq_len, start, end)
+            rows = []
+
+        if not cov:
+            return [], None, rows
+
+        runs = cov.bedgraph_runs(depth, start) if cov.make_bedgraph else []
+        keep_depth = ((cov.make_bed and seq_len < cov.bed_max_len) or
+            (cov.make_covgraph and seq_len < cov.covgraph_max_len))
+        return runs, depth if keep_depth else None, rows
+
+    def _count (self, bam, seq_name, seq_len, start=0, end=None):
+        """
+        Count the bases and deletions of the reads of a sequence. Aligned blocks of each read are
+        converted in arrays of base codes and reference positions, which are added to the count
+        array by batches. Deleted and skipped reference bases are counted as deletions like in
+        pileup, and inserted or clipped bases are ignored. Bases below min_base_quality are counted
+        in the last row, deletions taking the quality of the next base of the read like in pileup.
+        As with the overlap detection of pileup, the first mate of an overlapping pair is kept until
+        its mate is found, and the qualities of the bases read by both mates are merged so that
+        these bases are counted once
+        @param start First position of the region to analyse
+        @param end End of the region to analyse (excluded). Default = end of the sequence
+        @return A numpy array of shape (number of bases + 1, region length)
+        """
+        end = seq_len if end is None else end
+        counts = np.zeros((len(self.bases)+1, end-start), dtype=np.int32)
+        code_list = []
+        pos_list = []
+        buffered = 0
+
+        # Reads waiting for an overlapping mate by name, with a heap of their end positions
+        waiting = {}
+        waiting_ends = []
+
+        for rank, read in enumerate(bam.fetch(seq_name, start, end)):
+            if not self.is_pileup_read(read):
+                continue
+
+            # Waiting reads ending before the current read cannot overlap their mate anymore
+            ready = []
+            while waiting_ends and waiting_ends[0][0] <= read.reference_start:
+                _, mate_rank, name = heappop(waiting_ends)
+                if name in waiting and waiting[name][0] == mate_rank:
+                    ready.append(waiting.pop(name)[1])
+
+            quals = np.zeros(read.query_length+1, dtype=np.uint8)
+            qual = read.query_qualities
+            if qual is not None:
+                quals[:-1] = np.frombuffer(qual, dtype=np.uint8)
+            entry = (read, quals)
+
+            if (read.is_proper_pair and not read.mate_is_unmapped and
+                abs(read.template_length) < 2*read.query_length):
+                name = read.query_name
+                if name in waiting:
+                    mate = waiting.pop(name)[1]
+                    self._merge_mates(mate, entry)
+                    ready.append(mate)
+                elif read.next_reference_start >= read.reference_start:
+                    waiting[name] = (rank, entry)
+                    heappush(waiting_ends, (read.reference_end, rank, name))
+                    entry = None
+
+            if entry:
+                ready.append(entry)
+            for entry in ready:
+                buffered += self._read_codes(entry, code_list, pos_list)
+
+            if buffered >= self.batch_size:
+                self._add_counts(counts, code_list, pos_list, start)
+                code_list = []
+                pos_list = []
+                buffered = 0
+
+        for _, entry in sorted(waiting.values()):
+            self._read_codes(entry, code_list, pos_list)
+
+        if code_list:
+            self._add_counts(counts, code_list, pos_list, start)
+        return counts
+
+    def _merge_mates (self, first, second):
+        """
+        Merge the qualities of the bases aligned at the same positions by 2 overlapping mates as
+        pileup does (htslib tweak_overlap_quality). If both bases are identical the first mate
+        gets the sum of the qualities (at most 200), else the best base keeps 80% of its quality.
+        The quality of the other base is set to 0. The positions compared are those visited by
+        htslib: a common position directly following a gap of the second mate is skipped
+        @param first Tuple (read, qualities) of the first mate in the bam
+        @param second Tuple (read, qualities) of the second mate
+        """
+        start = second[0].reference_start
+        first_query, first_ref = self._overlap_walk(first[0], start)
+        second_query, second_ref = self._overlap_walk(second[0], start)
+        if not len(first_ref) or not len(second_ref):
+            return
+
+        # Indexes of the last positions of the runs of consecutive positions
+        first_ends = np.append(np.flatnonzero(first_ref[1:]-first_ref[:-1] != 1), len(first_ref)-1)
+        second_ends = np.append(np.flatnonzero(second_ref[1:]-second_ref[:-1] != 1), len(second_ref)-1)
+
+        first_pos = []
+        second_pos = []
+        ref_pos = start
+        while True:
+            i = np.searchsorted(first_ref, ref_pos)
+            if i == len(first_ref):
+                break
+            j = np.searchsorted(second_ref, first_ref[i])
+            if j == len(second_ref):
+                break
+            if first_ref[i] != second_ref[j]:
+                ref_pos = second_ref[j]+1
+                continue
+            # All positions of the common run are compared
+            n = min(first_ends[np.searchsorted(first_ends, i)]-i,
+                second_ends[np.searchsorted(second_ends, j)]-j)+1
+            first_pos.append(first_query[i:i+n])
+            second_pos.append(second_query[j:j+n])
+            ref_pos = first_ref[i]+n
+
+        if not first_pos:
+            return
+        first_pos = np.concatenate(first_pos)
+        second_pos = np.concatenate(second_pos)
+        first_qual = first[1][first_pos].astype(np.int64)
+        second_qual = second[1][second_pos].astype(np.int64)
+        same = (np.frombuffer(first[0].query_sequence, dtype=np.uint8)[first_pos] ==
+            np.frombuffer(second[0].query_sequence, dtype=np.uint8)[second_pos])
+        first_best = first_qual >= second_qual
+
+        first[1][first_pos] = np.where(same, np.minimum(first_qual+second_qual, 200),
+            np.where(first_best, (first_qual*0.8).astype(np.int64), 0))
+        second[1][second_pos] = np.where(same | first_best, 0, (second_qual*0.8).astype(np.int64))
+
+    def _overlap_walk (self, read, ref_start):
+        """
+        List the bases of a read visited by htslib when comparing overlapping mates, from the
+        first aligned base at or after ref_start. The aligned block containing this base is
+        visited until its end, but the following blocks lose their last base and their positions
+        are shifted accordingly, as in the cigar iteration of htslib
+        @return A tuple of numpy arrays (query positions, reference positions)
+        """
+        skip = ref_start-read.reference_start
+        query_pos = ref_pos = 0
+        query_list = []
+        ref_list = []
+        landed = False
+
+        for op, length in read.cigartuples:
+            # Match or mismatch (M, =, X)
+            if op in (0, 7, 8):
+                if not landed and skip >= length:
+                    skip -= length
+                    query_pos += length
+                    ref_pos += length
+                elif not landed:
+                    query_list.append(np.arange(query_pos+skip, query_pos+length))
+                    ref_list.append(np.arange(ref_pos+skip, ref_pos+length))
+                    query_pos += length-1
+                    ref_pos += length-1
+                    landed = True
+                else:
+                    query_list.append(np.arange(query_pos+1, query_pos+length))
+                    ref_list.append(np.arange(ref_pos+1, ref_pos+length))
+                    query_pos += length-1
+                    ref_pos += length-1
+
+            # Deletion or skipped region (D, N)
+            elif op in (2, 3):
+                if not landed:
+                    skip = max(0, skip-length)
+                ref_pos += length
+
+            # Insertion or soft clip (I, S)
+            elif op in (1, 4):
+                query_pos += length
+
+        if not landed:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(query_list), np.concatenate(ref_list)+read.reference_start
+
+    def _read_codes (self, entry, code_list, pos_list):
+        """
+        Append the base codes and reference positions of the aligned blocks of a read to the
+        batch lists
+        @param entry Tuple (read, qualities). The quality after the last base is 0
+        @return Number of positions added
+        """
+        read, quals = entry
+        seq = read.query_sequence
+        if seq:
+            codes = self.base_code[np.frombuffer(seq, dtype=np.uint8)]
+        else:
+            codes = np.full(read.infer_query_length(), 4, dtype=np.int64)
+            quals = np.zeros(len(codes)+1, dtype=np.uint8)
+
+        # Bases without qualities have a quality of 0 and are only part of the depth as in pileup
+        low_code = len(self.bases)
+        low = quals < self.min_base_quality
+        codes[low[:-1]] = low_code
+        ref_pos = read.reference_start
+        query_pos = 0
+        added = 0
+
+        for op, length in read.cigartuples:
+            # Match or mismatch (M, =, X)
+            if op in (0, 7, 8):
+                code_list.append(codes[query_pos:query_pos+length])
+                pos_list.append(np.arange(ref_pos, ref_pos+length))
+                query_pos += length
+                ref_pos += length
+                added += length
+
+            # Deletion or skipped region (D, N)
+            elif op in (2, 3):
+                code_list.append(np.full(length, low_code if low[query_pos] else 5, dtype=np.int64))
+                pos_list.append(np.arange(ref_pos, ref_pos+length))
+                ref_pos += length
+                added += length
+
+            # Insertion or soft clip (I, S)
+            elif op in (1, 4):
+                query_pos += length
+
+        return added
+
+    def _add_counts (self, counts, code_list, pos_list, offset=0):
+        """
+        Add a batch of base codes and positions to the count array. Since reads are sorted, the
+        batch spans a small window of the sequence counted at once with bincount. Positions
+        outside of the region starting at offset are discarded
+        """
+        codes = np.concatenate(code_list)
+        positions = np.concatenate(pos_list)-offset
+        inside = (positions >= 0) & (positions < counts.shape[1])
+        if not inside.any():
+            return
+        codes = codes[inside]
+        positions = positions[inside]
+        start = positions.min()
+        span = positions.max()+1-start
+        batch = np.bincount(codes*span+positions-start, minlength=counts.shape[0]*span)
+        counts[:, start:start+span] += batch.reshape(counts.shape[0], span).astype(np.int32)
+
+#~~~~~~~PRIVATE METHODS~~~~~~~#
+
+def _analyze_interval (bam, seq_name, seq_len, start, end, cov, var, ref_name, batch_size,
+    min_base_quality):
+    """
+    Compute the outputs of a region of a sequence in a RegionExecutor worker. Module level
+    function so that it can be pickled by process pools
+    """
+    analyzer = BamAnalyzer(cov, var, batch_size, min_base_quality=min_base_quality)
+    return analyzer._analyze(bam, seq_name, seq_len, start, end, cov, var, ref_name)
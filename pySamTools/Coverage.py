@@ -2,9 +2,12 @@
 
 # Third party packages import
 import pysam
+import numpy as np
 
 # Local Package import
 from pyDNA.Utilities import fill_between_graph
+from BamAnalyzer import BamAnalyzer
+from RegionExecutor import RegionExecutor
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class CoverageMaker (object):
@@ -13,9 +16,16 @@ class CoverageMaker (object):
     """
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
+    #~~~~~~~CLASS FIELDS~~~~~~~#
+
+    # Maximal length of sequences included in bed files and coverage graphics
+    bed_max_len = 1000000
+    covgraph_max_len = 50000
+
     #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
 
-    def __init__ (self, min_depth=0, make_bedgraph=True ,make_bed=False, make_covgraph=False):
+    def __init__ (self, min_depth=0, make_bedgraph=True ,make_bed=False, make_covgraph=False,
+        num_processes=1):
         """
         Create a CoverageMaker object
         @param min_depth Minimal depth to report. Elsewhere it will be considered to be null
@@ -25,6 +35,8 @@ class CoverageMaker (object):
         bases of the sequence even if bellow the minimal depth. In this case the depth will be 0
         @param make_covgraph Allow the object to create coverage graphics (1 per sequence mapped in
         the bam file) using Matplotlib.
+        @param num_processes Number of processes analysing regions of the bam file in parallel.
+        If more than 1 all outputs are created in a single pass by a BamAnalyzer
         """
         # Creating object variables
         self.min_depth = min_depth
@@ -38,6 +50,8 @@ class CoverageMaker (object):
         self.make_covgraph = make_covgraph
         self.covgraph_list = []
 
+        self.num_processes = num_processes
+
     def __repr__(self):
         msg = "\tCOVERAGE MAKER\n"
 
@@ -46,6 +60,7 @@ class CoverageMaker (object):
             return msg
 
         msg+= "\t\tMinimal depth : {}\n".format(self.min_depth)
+        msg+= "\t\tProcesses : {}\n".format(self.num_processes)
         msg+= "\t\tOutput requested :"
         if self.make_bedgraph:
             msg+= "\tBedGraph"
@@ -88,6 +103,12 @@ class CoverageMaker (object):
         if not self.make_bed and not self.make_bedgraph and not self.make_covgraph:
             return
 
+        # Analyse regions of the bam in parallel and create all outputs at once
+        if self.num_processes > 1:
+            analyzer = BamAnalyzer(self, executor=RegionExecutor(self.num_processes))
+            analyzer.make(bam_path, bai_path, outpath, ref_name)
+            return
+
         if self.make_bedgraph:
             print ("\tCreate a bedGraph File...")
             self.bedgraph = self._make_bedgraph(bam_path, outpath, ref_name)
@@ -100,6 +121,131 @@ class CoverageMaker (object):
             print ("\tCreate coverage graphics...")
             self.covgraph_list = self._make_covgraph(bam_path, outpath, ref_name)
 
+    def write_bedgraph_header (self, outfile, ref_name="ref"):
+        """
+        @param outfile File object where to write the bedgraph
+        @param ref_name Name of the reference genome
+        """
+        # TODO NAME SHOULD INCLUDE USER PREFIX
+        outfile.write ("track type=bedGraph name={} color=0,0,0\n".format(ref_name))
+
+    def write_bedgraph (self, outfile, seq_name, depth):
+        """
+        Write the bedgraph entries of a sequence. Positions below the min depth are nulled and
+        contiguous same depth bases are grouped in a single entry
+        @param outfile File object where to write the bedgraph
+        @param seq_name Name of the sequence
+        @param depth Numpy array of the depth of each position of the sequence
+        """
+        self.write_bedgraph_runs(outfile, seq_name, self.bedgraph_runs(depth))
+
+    def write_bedgraph_runs (self, outfile, seq_name, runs):
+        """
+        Write bedgraph entries of a sequence
+        @param outfile File object where to write the bedgraph
+        @param seq_name Name of the sequence
+        @param runs List of [start, end, depth] entries as returned by bedgraph_runs
+        """
+        for start, end, value in runs:
+            outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, start, end, value))
+
+    def bedgraph_runs (self, depth, offset=0):
+        """
+        Group contiguous same depth bases of a depth array in runs. Positions below the min depth
+        are nulled and null runs are not reported
+        @param depth Numpy array of the depth of each position of a sequence or of a region
+        @param offset Position of the first element of depth in the sequence
+        @return A list of [start, end, depth] runs
+        """
+        depth = np.where(depth < self.min_depth, 0, depth)
+        return [[start+offset, end+offset, value] for start, end, value in zip(*self._runs(depth))]
+
+    def write_bed_header (self, outfile, ref_name="ref"):
+        """
+        @param outfile File object where to write the bed
+        @param ref_name Name of the reference genome
+        """
+        outfile.write ("track type=bed name={} color=0,0,0\n".format(ref_name))
+
+    def write_bed (self, outfile, seq_name, seq_len, depth):
+        """
+        Write one bed entry per base of a sequence if at least one base is covered. Nothing is
+        written for sequences larger than bed_max_len
+        @param outfile File object where to write the bed
+        @param seq_name Name of the sequence
+        @param seq_len Length of the sequence
+        @param depth Numpy array of the depth of each position of the sequence
+        """
+        if seq_len >= self.bed_max_len:
+            return
+
+        depth = self._thresholded_depth(depth, seq_len)
+        if depth is not None:
+            outfile.writelines("{}\t{}\t{}\t{}\n".format(seq_name, i, i+1, value)
+                for i, value in enumerate(depth.tolist()))
+
+    def covgraph (self, seq_name, seq_len, depth, outpath="./out", ref_name="ref"):
+        """
+        Create the coverage graphics of a sequence if at least one base is covered. No graphics is
+        created for sequences larger than covgraph_max_len
+        @param seq_name Name of the sequence
+        @param seq_len Length of the sequence
+        @param depth Numpy array of the depth of each position of the sequence
+        @param outpath Basename of the path where to output files
+        @param ref_name Name of the reference genome
+        @return The path of the svg file or None if no graphics was created
+        """
+        if seq_len >= self.covgraph_max_len:
+            return None
+
+        coverage = self._thresholded_depth(depth, seq_len)
+        if coverage is None:
+            return None
+        coverage = coverage.tolist()
+
+        # Create the graph with Utilities.fill_between_graph
+        try:
+            fill_between_graph (
+                X = [i+1 for i in range (len(coverage))],
+                Y = coverage,
+                basename = "{}_{}_{}".format(outpath,ref_name,seq_name),
+                img_type = "svg",
+                title = ("Coverage of reads over {} from {}".format (seq_name, ref_name)),
+                xlabel = 'Position', ylabel = 'Count',
+                xsize = 50, ysize = 10, dpi = 150)
+            return "{}_{}_{}.svg".format(outpath,ref_name,seq_name)
+
+        except ImportError as E:
+            print(E)
+            print("Cannot create the required CovGraph file. Skip to the next step")
+            return None
+
+    def depth_array (self, bam, seq_name, seq_len, start=0, end=None):
+        """
+        Compute the depth of all positions of a sequence in a single pass over its reads. +1 is
+        added at the start and -1 at the end of the span of each read in a difference array, and
+        the depth is obtained by a cumulative sum. As in pileup, the span of a read includes its
+        deletions and skipped regions and unmapped, secondary, QC failed and duplicate reads are
+        ignored
+        @param start First position of the region to analyse
+        @param end End of the region to analyse (excluded). Default = end of the sequence
+        @return A numpy array of the depth of each position of the region
+        """
+        end = seq_len if end is None else end
+        starts = []
+        ends = []
+        for read in bam.fetch(seq_name, start, end):
+            if not BamAnalyzer.is_pileup_read(read):
+                continue
+            starts.append(read.reference_start)
+            ends.append(read.reference_end)
+
+        # Spans are clipped to the region
+        diff = np.zeros(end-start+1, dtype=np.int32)
+        np.add.at(diff, np.clip(np.array(starts, dtype=np.int64), start, end)-start, 1)
+        np.subtract.at(diff, np.clip(np.array(ends, dtype=np.int64), start, end)-start, 1)
+        return np.cumsum(diff[:-1], dtype=np.int32)
+
     ##~~~~~~~PRIVATE METHODS~~~~~~~#
 
     def _make_bedgraph (self, bam_path, outpath="./out", ref_name = "ref"):
@@ -114,45 +260,11 @@ class CoverageMaker (object):
         # Open a handle on the to read the bam file and another to write the bedgraph
         with pysam.Samfile(bam_path, "rb") as bamfile:
             with open (bedgraph, "wb") as outfile:
-            
-            # TODO NAME SHOULD INCLUDE USER PREFIX 
-            # Write bedGraph header
-                outfile.write ("track type=bedGraph name={} color=0,0,0\n".format(ref_name))
+                self.write_bedgraph_header(outfile, ref_name)
 
                 # Iterate over all seq in bam header
-                for seq_name in bamfile.references:
-
-                    # Open a PileUpColumn generator with an high limit of depth to avoid cuts
-                    start = depth_prec = pos_prec = -1
-                    for PileUpCol in bamfile.pileup(seq_name, max_depth=10000000):
-
-                        # If bellow the threshold write only if the last position was above
-                        if PileUpCol.n < self.min_depth:
-                            if start != -1:
-                                outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, start, pos_prec+1, depth_prec))
-                            start = -1
-                            depth_prec = -1
-
-                        # If above the threshold but missing bases
-                        elif PileUpCol.pos != pos_prec+1:
-                            if start != -1:
-                                outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, start, pos_prec+1, depth_prec))
-                            start = PileUpCol.pos
-                            depth_prec = PileUpCol.n
-
-                        # And finally if there was a change in depth.
-                        elif PileUpCol.n != depth_prec:
-                            if start != -1:
-                                outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, start, pos_prec+1, depth_prec))
-                            start = PileUpCol.pos
-                            depth_prec = PileUpCol.n
-
-                        # Update the position tracker
-                        pos_prec = PileUpCol.pos
-
-                    # Write the last entry for the sequence if needed
-                    if start != -1:
-                        outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, start, pos_prec+1, depth_prec))
+                for seq_name, seq_len in zip(bamfile.references, bamfile.lengths):
+                    self.write_bedgraph(outfile, seq_name, self.depth_array(bamfile, seq_name, seq_len))
         return bedgraph
 
 
@@ -170,9 +282,7 @@ class CoverageMaker (object):
         # Open a handle on the to read the bam file and another to write the bedgraph
         with pysam.Samfile(bam_path, "rb") as bam:
             with open (bed, "wb") as outfile:
-
-            # Write bed header
-                outfile.write ("track type=bed name={} color=0,0,0\n".format(ref_name))
+                self.write_bed_header(outfile, ref_name)
 
                 # Iterate over all seq in bam header
                 for seq_dict in bam.header['SQ']:
@@ -180,35 +290,8 @@ class CoverageMaker (object):
                     seq_len = seq_dict['LN']
 
                     # If the sequence if larger than 1M bp it will no be included in the bed
-                    if seq_len >= 1000000:
-                        continue
-
-                    # Open a PileUpColumn generator with an high limit of depth to avoid cuts
-                    pos_prec = -1
-                    write = False
-                    for PileUpCol in bam.pileup(seq_name, max_depth=10000000):
-
-                        # Write the missing positions since pileup do not report uncovered regions
-                        if PileUpCol.pos != pos_prec+1:
-                            for i in range(pos_prec+1, PileUpCol.pos):
-                                outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, i, i+1, 0))
-                                write = True
-
-                        # Write the current position
-                        if PileUpCol.n < self.min_depth:
-                            outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, PileUpCol.pos, PileUpCol.pos+1, 0))
-                            write = True
-                        else:
-                            outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, PileUpCol.pos, PileUpCol.pos+1, PileUpCol.n))
-                            write = True
-
-                        # Update the position tracker
-                        pos_prec = PileUpCol.pos
-
-                    # Write the last entries for the sequence if needed
-                    if write and pos_prec < seq_len-1:
-                        for i in range(pos_prec+1, seq_len-1):
-                            outfile.write("{}\t{}\t{}\t{}\n".format(seq_name, i, i+1, 0))
+                    if seq_len < self.bed_max_len:
+                        self.write_bed(outfile, seq_name, seq_len, self.depth_array(bam, seq_name, seq_len))
         return bed
 
     def _make_covgraph (self, bam_path, outpath="./out", ref_name = "ref"):
@@ -228,53 +311,42 @@ class CoverageMaker (object):
                 seq_len = seq_dict['LN']
 
                 # If the sequence if larger than 50 000 bp the graphics will not be created
-                if seq_len >= 50000:
-                    continue
-
-                # Open a PileUpColumn generator with an high limit of depth to avoid cuts
-                pos_prec = -1
-                coverage = []
-                for PileUpCol in bam.pileup(seq_name, max_depth=10000000):
-
-                    # Write the missing positions since pileup do not report uncovered regions
-                    if PileUpCol.pos != pos_prec+1:
-                        for i in range(pos_prec+1, PileUpCol.pos):
-                            coverage.append(0)
-
-                    # Write the current position
-                    if PileUpCol.n < self.min_depth:
-                        coverage.append(0)
-                    else:
-                        coverage.append(PileUpCol.n)
-
-                    # Update the position tracker
-                    pos_prec = PileUpCol.pos
-
-                # This will be done only if elements were added to the coverage list
-                if coverage:
-                    # Write the last entries for the sequence if needed
-                    if pos_prec < seq_len-1:
-                        for i in range(pos_prec+1, seq_len-1):
-                            coverage.append(0)
-
-                    # Create the graph with Utilities.fill_between_graph
-                    try:
-                        fill_between_graph (
-                            X = [i+1 for i in range (len(coverage))],
-                            Y = coverage,
-                            basename = "{}_{}_{}".format(outpath,ref_name,seq_name),
-                            img_type = "svg",
-                            title = ("Coverage of reads over {} from {}".format (seq_name, ref_name)),
-                            xlabel = 'Position', ylabel = 'Count',
-                            xsize = 50, ysize = 10, dpi = 150)
-                        covgraph_list.append("{}_{}_{}.svg".format(outpath,ref_name,seq_name))
-
-                    except ImportError as E:
-                        print(E)
-                        print("Cannot create the required CovGraph file. Skip to the next step")
+                if seq_len < self.covgraph_max_len:
+                    svg = self.covgraph(seq_name, seq_len, self.depth_array(bam, seq_name, seq_len), outpath, ref_name)
+                    if svg:
+                        covgraph_list.append(svg)
 
         return covgraph_list
 
+    def _thresholded_depth (self, depth, seq_len):
+        """
+        Copy of a depth array with the positions below the min depth set to 0. The array is
+        extended up to the end of the sequence minus one position, like the pileup based
+        implementation
+        @return A numpy array or None if no base of the sequence is covered
+        """
+        covered = np.flatnonzero(depth)
+        if not len(covered):
+            return None
+
+        depth = np.where(depth < self.min_depth, 0, depth)
+        return depth[:max(covered[-1]+1, seq_len-1)]
+
+    def _runs (self, depth):
+        """
+        Run length encoding of the non null positions of a depth array
+        @return 3 lists of start, end and value of the runs
+        """
+        if not len(depth):
+            return [], [], []
+
+        bounds = np.r_[0, np.flatnonzero(np.diff(depth))+1, len(depth)]
+        starts = bounds[:-1]
+        ends = bounds[1:]
+        values = depth[starts]
+        mask = values != 0
+        return starts[mask].tolist(), ends[mask].tolist(), values[mask].tolist()
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class CoverageDecoy(object):
     """
@@ -0,0 +1,114 @@
+#~~~~~~~GLOBAL IMPORTS~~~~~~~#
+
+# Standard library packages import
+from multiprocessing import cpu_count, Pool
+
+# Third party packages import
+import pysam
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class RegionExecutor (object):
+    """
+    @class  RegionExecutor
+    @brief  Run a computation over all the sequences of a sorted and indexed bam file by regions
+    analysed in parallel. Sequences larger than region_size are split in windows of equal size and
+    consecutive small sequences are grouped, so that all regions have about the same size. Each
+    region is analysed by a worker of a process pool opening its own handle on the bam file, and
+    the results are returned in the order of the sequences of the bam header.
+    """
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
+
+    def __init__ (self, num_processes=0, region_size=1000000, executor=None):
+        """
+        Create a RegionExecutor object
+        @param num_processes Number of processes of the default local pool. 0 = number of CPU
+        @param region_size Approximate number of bases analysed by each task
+        @param executor Object with a multiprocessing.Pool like imap method, returning the results
+        in order. By default a local process pool of size num_processes is created for each run
+        """
+        self.num_processes = num_processes or cpu_count()
+        self.region_size = region_size
+        self.executor = executor
+
+    def __repr__(self):
+        msg = "\tREGION EXECUTOR\n"
+        msg+= "\t\tProcesses : {}\n".format(self.num_processes)
+        msg+= "\t\tRegion size : {}\n".format(self.region_size)
+        return msg
+
+    def __str__(self):
+        return "\n<Instance of {} from {} >\n".format(self.__class__.__name__, self.__module__)
+
+    #~~~~~~~PUBLIC METHODS~~~~~~~#
+
+    def regions (self, references, lengths):
+        """
+        Split sequences in regions of about region_size bases
+        @param references List of sequence names
+        @param lengths List of sequence lengths
+        @return A list of regions. Each region is a list of (sequence name, sequence length, start,
+        end) intervals in the order of references
+        """
+        region_list = []
+        region = []
+        region_len = 0
+
+        for seq_name, seq_len in zip(references, lengths):
+            # Windows of equal size no larger than region_size
+            n_windows = max(1, -(-seq_len//self.region_size))
+            bounds = [seq_len*i//n_windows for i in range(n_windows+1)]
+
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if region and region_len+end-start > self.region_size:
+                    region_list.append(region)
+                    region = []
+                    region_len = 0
+                region.append((seq_name, seq_len, start, end))
+                region_len += end-start
+
+        if region:
+            region_list.append(region)
+        return region_list
+
+    def map (self, func, bam_path, *args):
+        """
+        Apply a function to all intervals of the regions of a bam file
+        @param func Module level function (picklable) called as func(bam, seq_name, seq_len, start,
+        end, *args) with bam an opened pysam.AlignmentFile
+        @param bam_path Path to a sorted and indexed bam file
+        @param args Additional picklable arguments of func
+        @return A generator of (seq_name, seq_len, start, end, result) in the order of the sequences
+        and positions of the bam file
+        """
+        with pysam.AlignmentFile(bam_path, "rb") as bam:
+            region_list = self.regions(bam.references, bam.lengths)
+
+        pool = None
+        executor = self.executor
+        if executor is None:
+            pool = executor = Pool(self.num_processes)
+
+        try:
+            for result_list in executor.imap(_run_region,
+                ((func, bam_path, region, args) for region in region_list)):
+                for result in result_list:
+                    yield result
+        finally:
+            if pool:
+                pool.terminate()
+
+#~~~~~~~PRIVATE METHODS~~~~~~~#
+
+def _run_region (task):
+    """
+    Apply a function to all intervals of a region with a bam handle opened by the worker. Module
+    level function so that it can be pickled by process pools
+    @param task Tuple (function, bam path, region, additional arguments)
+    @return A list of (seq_name, seq_len, start, end, result)
+    """
+    func, bam_path, region, args = task
+    with pysam.AlignmentFile(bam_path, "rb") as bam:
+        return [(seq_name, seq_len, start, end, func(bam, seq_name, seq_len, start, end, *args))
+            for seq_name, seq_len, start, end in region]
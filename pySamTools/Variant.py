@@ -4,7 +4,11 @@
 import csv
 
 # Third party packages import
-import pysam
+import numpy as np
+
+# Local Package import
+from BamAnalyzer import BamAnalyzer
+from RegionExecutor import RegionExecutor
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class VariantMaker (object):
@@ -15,12 +19,13 @@ class VariantMaker (object):
 
     #~~~~~~~FONDAMENTAL METHODS~~~~~~~#
 
-    def __init__ (self, min_depth=1000, min_freq=0.02, make_freqvar=True):
+    def __init__ (self, min_depth=1000, min_freq=0.02, make_freqvar=True, num_processes=1):
         """
         Create a PileUpMaker object
         @param min_depth Minimal depth to search for variations. Else the position will be ignored
         @param min_freq Mimimal frequency of a base at a given positionto be considered above the
         threshold. If bellow the base will be considered as undetected
+        @param num_processes Number of processes analysing regions of the bam file in parallel
         """
         # Creating object variables
         self.min_depth = min_depth
@@ -29,6 +34,8 @@ class VariantMaker (object):
         self.make_freqvar = make_freqvar
         self.freqvar = ""
 
+        self.num_processes = num_processes
+
     def __repr__(self):
         msg = "\tVARIANT MAKER\n"
         if not self.make_freqvar:
@@ -37,6 +44,7 @@ class VariantMaker (object):
 
         msg+= "\t\tMinimal depth : {}\n".format(self.min_depth)
         msg+= "\t\tMimimal frequency : {}\n".format(self.min_freq)
+        msg+= "\t\tProcesses : {}\n".format(self.num_processes)
         msg+= "\t\tOutput requested :"
         if self.make_freqvar:
             msg+= "\tFrequent_Variants_Report"
@@ -69,55 +77,53 @@ class VariantMaker (object):
 
         if self.make_freqvar:
             print ("\tCreate a Frequent variants report file...")
-            self._make_freqvar(bam_path, outpath, ref_name)
 
+            # Analyse regions of the bam in parallel
+            if self.num_processes > 1:
+                analyzer = BamAnalyzer(variant_maker=self, executor=RegionExecutor(self.num_processes))
+                analyzer.make(bam_path, bai_path, outpath, ref_name)
+            else:
+                self._make_freqvar(bam_path, outpath, ref_name)
 
-    def _make_freqvar (self, bam_path, outpath="./out", ref_name = "ref"):
 
-        # Create a list and for results collecting
-        out_list =[]
-
-        # Open a handle on the bamfile
-        with pysam.Samfile(bam_path, "rb") as bamfile:
-            # Open a PileUpColumn generator with an high limit of depth to avoid cuts
-            # Analyse only if the sequencing depth is sufficient
-            for PileUpCol in bamfile.pileup(max_depth=10000000):
-                if PileUpCol.n > self.min_depth:
-
-                    # Fill a dictionary for positions of reads overlapping each positions.
-                    posDic = {'A':0,'C':0,'T':0,'G':0,'Del':0,'N':0}
-                    for read in PileUpCol.pileups:
-                        if read.is_del:
-                            posDic['Del']+=1
-                        else:
-                            try:
-                                posDic[read.alignment.seq[read.qpos].upper()]+=1
-                            except IndexError:
-                                posDic['N']+=1
-
-                    # Define a threshold above which variations are not considered
-                    threshold = int(PileUpCol.n*self.min_freq)
-
-                    # If more than one frequent DNA base or indel was found at this position
-                    if sum([1 for base, count in posDic.items() if count >= threshold]) >= 2:
-                        out_list.append([
-                            ref_name,
-                            bamfile.getrname(PileUpCol.tid),
-                            PileUpCol.pos,
-                            PileUpCol.n,
-                            posDic['A'],
-                            posDic['T'],
-                            posDic['C'],
-                            posDic['G'],
-                            posDic['N'],
-                            posDic['Del'],
-                            round(posDic['A']/float(PileUpCol.n), 3),
-                            round(posDic['T']/float(PileUpCol.n), 3),
-                            round(posDic['C']/float(PileUpCol.n), 3),
-                            round(posDic['G']/float(PileUpCol.n), 3),
-                            round(posDic['N']/float(PileUpCol.n), 3),
-                            round(posDic['Del']/float(PileUpCol.n), 3)])
+    def freqvar_rows (self, ref_name, seq_name, depth, counts, offset=0):
+        """
+        List the positions of a sequence where more than one base or deletion is frequent
+        @param ref_name Name of the reference genome
+        @param seq_name Name of the sequence
+        @param depth Numpy array of the depth of each position of the sequence
+        @param counts Numpy array of shape (6, sequence length) of the number of A, C, G, T, N and
+        deletions at each position, as computed by BamAnalyzer
+        @param offset Position of the first column of depth and counts in the sequence, when only
+        a region of the sequence is analysed
+        @return A list of frequent variant report rows
+        """
+        # Analyse only if the sequencing depth is sufficient
+        positions = np.flatnonzero(depth > self.min_depth)
+        n = depth[positions]
+        pos_counts = counts[:, positions]
+
+        # Define a threshold above which variations are not considered
+        threshold = (n*self.min_freq).astype(np.int64)
+
+        # Keep positions where more than one frequent DNA base or indel was found
+        frequent = (pos_counts >= threshold).sum(axis=0) >= 2
+
+        out_list = []
+        for pos, pos_n, pos_count in zip(positions[frequent].tolist(), n[frequent].tolist(),
+            pos_counts[:, frequent].T.tolist()):
+            out_list.append(self._freqvar_row(ref_name, seq_name, pos+offset, pos_n,
+                dict(zip(BamAnalyzer.bases, pos_count))))
 
+        return out_list
+
+    def write_freqvar (self, out_list, outpath="./out", ref_name = "ref"):
+        """
+        Write the frequent variant report if results were found
+        @param out_list List of rows as returned by freqvar_rows
+        @param outpath Basename of the path where to output files
+        @param ref_name Name of the reference genome
+        """
         # Create a file to write out the list if results were found
         if out_list:
             self.freqvar =  "{}_{}_pileup.csv".format(outpath, ref_name)
@@ -131,6 +137,39 @@ class VariantMaker (object):
         else:
             print("\t  No frequent variation found")
 
+    #~~~~~~~PRIVATE METHODS~~~~~~~#
+
+    def _make_freqvar (self, bam_path, outpath="./out", ref_name = "ref"):
+
+        # Count the bases and deletions of the sequences region by region
+        out_list = []
+        for seq_name, seq_len, start, end, depth, counts in BamAnalyzer().iter_counts(bam_path):
+            out_list.extend(self.freqvar_rows(ref_name, seq_name, depth, counts, start))
+
+        self.write_freqvar(out_list, outpath, ref_name)
+
+    def _freqvar_row (self, ref_name, seq_name, pos, n, posDic):
+        """
+        @return A frequent variant report row from the counts of each base and deletions
+        """
+        return [
+            ref_name,
+            seq_name,
+            pos,
+            n,
+            posDic['A'],
+            posDic['T'],
+            posDic['C'],
+            posDic['G'],
+            posDic['N'],
+            posDic['Del'],
+            round(posDic['A']/float(n), 3),
+            round(posDic['T']/float(n), 3),
+            round(posDic['C']/float(n), 3),
+            round(posDic['G']/float(n), 3),
+            round(posDic['N']/float(n), 3),
+            round(posDic['Del']/float(n), 3)]
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class VariantUpDecoy(object):
     """
@@ -10,4 +10,4 @@
 * [Github](https://github.com/a-slide)
 * [Atlantic Gene Therapies - INSERM 1089] (http://www.atlantic-gene-therapies.fr/)
 """
-__all__ = ["Bam", "Coverage", "Variant"]
+__all__ = ["Bam", "BamAnalyzer", "Coverage", "RegionExecutor", "Variant"]